@@ -0,0 +1,153 @@
+"""
+Admission control for expensive endpoints.
+
+Each AdmissionLimiter caps how many requests of one route class run at once
+and how many may wait for a slot. Requests that cannot be served within
+`max_wait` are rejected up front with 503 + Retry-After instead of occupying
+a worker thread and a pooled connection while they queue. Limiters are plain
+FastAPI dependencies, configured per route in main.py:
+
+    @app.get("/api/templates/{template_id}/full",
+             dependencies=[Depends(template_full_limiter)])
+
+All state lives on the event loop (dependencies are async), so no locks are
+needed; sync endpoints only reach the thread pool once admitted.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+
+from fastapi import HTTPException
+
+import deadlines
+import metrics
+
+ADMISSION_ACTIVE = metrics.registry.register(metrics.Gauge(
+    "admission_active_requests", "Requests admitted and running per limiter", ("limiter",),
+))
+ADMISSION_QUEUED = metrics.registry.register(metrics.Gauge(
+    "admission_queued_requests", "Requests waiting for a slot per limiter", ("limiter",),
+))
+ADMISSION_REJECTED = metrics.registry.register(metrics.Counter(
+    "admission_rejected_total", "Requests shed with 503 by limiter and reason",
+    ("limiter", "reason"),
+))
+
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded, deadline-aware wait queue."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters: deque = deque()
+        # Exponentially weighted average of how long an admitted request holds its slot
+        self._service_time = 0.05
+
+    @classmethod
+    def from_env(cls, name: str, max_concurrent: int, max_queue: int, max_wait: float):
+        """Build a limiter, letting ADMISSION_<NAME>_{CONCURRENCY,QUEUE,MAX_WAIT} override defaults."""
+        prefix = f"ADMISSION_{name.upper()}_"
+        return cls(
+            name,
+            max_concurrent=int(os.getenv(prefix + "CONCURRENCY", max_concurrent)),
+            max_queue=int(os.getenv(prefix + "QUEUE", max_queue)),
+            max_wait=float(os.getenv(prefix + "MAX_WAIT", max_wait)),
+        )
+
+    # -------------------------------------------------------------------------
+
+    def estimated_wait(self) -> float:
+        """Rough time until a new arrival would be admitted."""
+        if self._active < self.max_concurrent:
+            return 0.0
+        waves = len(self._waiters) // self.max_concurrent + 1
+        return waves * self._service_time
+
+    def _publish(self):
+        ADMISSION_ACTIVE.set(self._active, self.name)
+        ADMISSION_QUEUED.set(len(self._waiters), self.name)
+
+    def _reject(self, reason: str, retry_after: float):
+        ADMISSION_REJECTED.inc(self.name, reason)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({reason}), retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def _hand_off(self):
+        """Pass a finished request's slot to the next live waiter, or free it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._publish()
+                return
+        self._active -= 1
+        self._publish()
+
+    async def acquire(self):
+        """Wait for a slot, or raise 503 if none is expected in time.
+
+        The wait budget is `max_wait`, shortened to the request's remaining
+        deadline when it has one.
+        """
+        budget = self.max_wait
+        left = deadlines.remaining()
+        if left is not None:
+            budget = min(budget, left)
+
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self._publish()
+            return
+
+        if budget <= 0:
+            self._reject("deadline", self._service_time)
+        estimate = self.estimated_wait()
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full", estimate)
+        if estimate > budget:
+            self._reject("deadline", estimate)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._publish()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), budget)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self._publish()
+            self._reject("timeout", self._service_time)
+        except BaseException:
+            # Client went away while queued: give back a slot we were just handed
+            if waiter.done() and not waiter.cancelled():
+                self._hand_off()
+            else:
+                waiter.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._publish()
+            raise
+
+    def release(self, held: float):
+        self._service_time = 0.8 * self._service_time + 0.2 * held
+        self._hand_off()
+
+    async def __call__(self):
+        await self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
@@ -0,0 +1,165 @@
+"""
+Storage backends for the connection pool.
+
+queries.py is written against a small DB-API surface (cursor(dictionary=True),
+execute with %s placeholders, fetchone/fetchall, lastrowid, commit/rollback).
+Each backend opens raw connections that provide that surface:
+
+    mysql  - mysql.connector (the production target)
+    sqlite - the stdlib sqlite3 module, file-backed or in-memory, so the API
+             and its benchmarks can run without a MySQL server
+
+Select with DB_BACKEND=mysql|sqlite; SQLite reads DB_PATH (default ":memory:").
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class MySQLBackend:
+    """mysql.connector connections, one server per pool."""
+
+    name = "mysql"
+    # MAX_EXECUTION_TIME optimizer hints and error 3024 are MySQL features
+    supports_statement_timeout = True
+    # Placeholder limit of the binary protocol (text statements are bounded
+    # only by max_allowed_packet)
+    max_statement_params = 65535
+
+    def __init__(self):
+        self._connector = None
+        self._errors = None
+
+    @property
+    def connector(self):
+        # Imported on first connect, not at startup: mysql.connector is the
+        # heaviest import after FastAPI itself
+        if self._connector is None:
+            import mysql.connector
+            self._connector = mysql.connector
+        return self._connector
+
+    @property
+    def errors(self) -> tuple:
+        if self._errors is None:
+            self._errors = (self.connector.Error,)
+        return self._errors
+
+    def connect(self, config: dict):
+        return self.connector.connect(**config)
+
+    @staticmethod
+    def errno(error: Exception) -> int | None:
+        return getattr(error, "errno", None)
+
+
+class SQLiteCursor:
+    """sqlite3 cursor speaking the mysql.connector dialect used by queries.py."""
+
+    def __init__(self, cursor, dictionary: bool):
+        self._cursor = cursor
+        if dictionary:
+            cursor.row_factory = _dict_row
+
+    def execute(self, operation, params=None):
+        return self._cursor.execute(_qmark(operation), params or ())
+
+    def executemany(self, operation, seq_params):
+        return self._cursor.executemany(_qmark(operation), seq_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SQLiteConnection:
+    """sqlite3 connection with the mysql.connector methods the pool relies on."""
+
+    def __init__(self, raw: sqlite3.Connection):
+        self._raw = raw
+
+    def cursor(self, dictionary: bool = False, **kwargs):
+        return SQLiteCursor(self._raw.cursor(), dictionary)
+
+    def is_connected(self) -> bool:
+        return True
+
+    def reconnect(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+_qmark_cache: dict[str, str] = {}
+
+
+def _qmark(operation: str) -> str:
+    """Translate %s placeholders to sqlite's ? style (queries.py never uses a literal %)."""
+    translated = _qmark_cache.get(operation)
+    if translated is None:
+        translated = _qmark_cache[operation] = operation.replace("%s", "?")
+    return translated
+
+
+def _dict_row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+# Extended result codes the data layer reacts to, as the MySQL error numbers
+# it checks for: ER_DUP_ENTRY and ER_NO_REFERENCED_ROW_2
+_SQLITE_ERRNOS = {
+    1555: 1062,  # SQLITE_CONSTRAINT_PRIMARYKEY
+    2067: 1062,  # SQLITE_CONSTRAINT_UNIQUE
+    787: 1452,   # SQLITE_CONSTRAINT_FOREIGNKEY
+}
+
+
+class SQLiteBackend:
+    """Embedded sqlite3 database, shared by every pooled connection of the process."""
+
+    name = "sqlite"
+    supports_statement_timeout = False
+    errors = (sqlite3.Error,)
+    # SQLITE_MAX_VARIABLE_NUMBER default; 999 before SQLite 3.32
+    max_statement_params = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+    def __init__(self, path: str):
+        # A named shared-cache database is visible to all connections
+        self.memory = path == ":memory:"
+        if self.memory:
+            self.uri = f"file:diet_{id(self)}?mode=memory&cache=shared"
+        else:
+            self.uri = f"file:{os.path.abspath(path)}"
+        self._keeper = None
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def connect(self, config: dict) -> SQLiteConnection:
+        with self._init_lock:
+            if self.memory and self._keeper is None:
+                # Opened with the first connection, not at import: keeps the
+                # in-memory database alive while the pool is idle
+                self._keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        raw = sqlite3.connect(self.uri, uri=True, check_same_thread=False, timeout=30)
+        raw.execute("PRAGMA foreign_keys = ON")
+        with self._init_lock:
+            if not self._initialized and not self.memory:
+                # WAL lets readers proceed while a writer holds the lock
+                raw.execute("PRAGMA journal_mode = WAL")
+            self._initialized = True
+        return SQLiteConnection(raw)
+
+    @staticmethod
+    def errno(error: Exception) -> int | None:
+        return _SQLITE_ERRNOS.get(getattr(error, "sqlite_errorcode", None))
+
+
+def get_backend():
+    """Instantiate the backend selected by DB_BACKEND."""
+    name = os.getenv("DB_BACKEND", "mysql").lower()
+    if name == "mysql":
+        return MySQLBackend()
+    if name == "sqlite":
+        return SQLiteBackend(os.getenv("DB_PATH", ":memory:"))
+    raise ValueError(f"Unknown DB_BACKEND: {name}")
@@ -0,0 +1,112 @@
+#!/bin/bash
+# Connection reuse across serve.py profiles
+# Usage: ./connections.sh [profile ...]   (default: default gateway churn h2)
+#
+# Starts serve.py on CONNECTIONS_PORT once per SERVER_PROFILE, waits for
+# /health/ready, and runs k6/connections.js against it once per connection
+# mode: keep-alive reuse, a new connection per iteration, and a new
+# connection per request. The database comes from the usual DB_* variables;
+# SERVER_WORKERS, SERVER_HTTP and the other SERVER_* variables still apply,
+# so `SERVER_HTTP=h11 ./connections.sh default` measures the h11 parser.
+#
+# TLS=1 (default) serves every profile over TLS with a throwaway
+# certificate: k6 speaks HTTP/2 only over TLS, and a new connection then
+# costs the handshake a real client pays. With TLS=0 the h2 profile is
+# measured over HTTP/1.1 (the http2 column shows which protocol was used).
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+ROOT_DIR="$(dirname "$SCRIPT_DIR")"
+K6_DIR="$SCRIPT_DIR/k6"
+RESULTS_DIR="$SCRIPT_DIR/results"
+
+PORT=${CONNECTIONS_PORT:-8100}
+DURATION=${DURATION:-30s}
+VUS=${VUS:-64}
+TLS=${TLS:-1}
+PROFILES=("$@")
+[ ${#PROFILES[@]} -eq 0 ] && PROFILES=(default gateway churn h2)
+MODES=(reuse iteration none)
+
+# Colors
+GREEN='\033[0;32m'
+YELLOW='\033[1;33m'
+RED='\033[0;31m'
+NC='\033[0m'
+
+TIMESTAMP=$(date +%Y%m%d_%H%M%S)
+RESULT_DIR="$RESULTS_DIR/${TIMESTAMP}_connections"
+mkdir -p "$RESULT_DIR"
+
+if ! command -v k6 &> /dev/null; then
+    echo -e "${RED}Error: k6 is not installed${NC}"
+    exit 1
+fi
+
+if [ "$TLS" = "1" ]; then
+    openssl req -x509 -newkey rsa:2048 -nodes -days 1 -subj "/CN=localhost" \
+        -keyout "$RESULT_DIR/key.pem" -out "$RESULT_DIR/cert.pem" 2> /dev/null
+    export SERVER_CERTFILE="$RESULT_DIR/cert.pem" SERVER_KEYFILE="$RESULT_DIR/key.pem"
+    BASE_URL="https://127.0.0.1:$PORT"
+else
+    BASE_URL="http://127.0.0.1:$PORT"
+fi
+
+echo -e "${GREEN}============================================${NC}"
+echo -e "${GREEN}  Connection reuse: ${PROFILES[*]}${NC}"
+echo -e "${GREEN}============================================${NC}"
+echo -e "Results: ${YELLOW}$RESULT_DIR${NC}"
+
+for profile in "${PROFILES[@]}"; do
+    echo ""
+    echo -e "${GREEN}[$profile]${NC}"
+    (cd "$ROOT_DIR" && SERVER_PROFILE=$profile SERVER_BIND="127.0.0.1:$PORT" \
+        exec python serve.py > "$RESULT_DIR/server-$profile.log" 2>&1) &
+    server=$!
+
+    attempt=0
+    until curl -sfk "$BASE_URL/health/ready" > /dev/null 2>&1; do
+        attempt=$((attempt + 1))
+        if [ $attempt -ge 60 ]; then
+            echo -e "${RED}Server not ready after 60 attempts; see server-$profile.log${NC}"
+            kill -TERM $server 2>/dev/null || true
+            exit 1
+        fi
+        sleep 1
+    done
+
+    for mode in "${MODES[@]}"; do
+        echo -e "  ${YELLOW}$mode${NC}"
+        k6 run --quiet \
+            -e BASE_URL=$BASE_URL -e PROFILE=$profile -e CONN_MODE=$mode \
+            -e VUS=$VUS -e DURATION=$DURATION \
+            "$K6_DIR/connections.js" > "$RESULT_DIR/connections-$profile-$mode.json" || true
+    done
+
+    kill -TERM $server 2>/dev/null || true
+    wait $server 2>/dev/null || true
+    # Let the listening socket go before the next run binds it
+    sleep 2
+done
+
+# Summary table: one row per profile and mode, in the order they ran
+python - "$RESULT_DIR" "${PROFILES[@]}" <<'PY' | tee "$RESULT_DIR/connections.txt"
+import json, os, sys
+
+result_dir, profiles = sys.argv[1], sys.argv[2:]
+print(f"{'profile':>8} {'mode':>9} {'req/s':>9} {'p95 ms':>8} {'p99 ms':>8} "
+      f"{'connect ms':>10} {'http2':>6} {'errors':>7}")
+for profile in profiles:
+    for mode in ("reuse", "iteration", "none"):
+        path = os.path.join(result_dir, f"connections-{profile}-{mode}.json")
+        try:
+            with open(path) as f:
+                run = json.load(f)
+        except (OSError, ValueError):
+            print(f"{profile:>8} {mode:>9} {'failed':>9}")
+            continue
+        print(f"{profile:>8} {mode:>9} {run['requests_per_second']:>9.0f} "
+              f"{run['p95_latency_ms']:>8.1f} {run['p99_latency_ms']:>8.1f} "
+              f"{run['avg_connect_ms']:>10.2f} {run['http2_rate']:>6.0%} {run['error_rate']:>7.2%}")
+PY
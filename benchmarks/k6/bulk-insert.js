@@ -7,6 +7,10 @@ const latency = new Trend('latency');
 
 const BASE_URL = __ENV.BASE_URL || 'http://localhost:8000';
 
+// Dataset size from seed.py (it prints these after seeding)
+const FOOD_COUNT = parseInt(__ENV.FOOD_COUNT || '49');
+const MEAL_COUNT = parseInt(__ENV.MEAL_COUNT || '10');
+
 export const options = {
     stages: [
         { duration: '10s', target: 10 },
@@ -24,7 +28,7 @@ function generateMealItems(count) {
     const items = [];
     for (let i = 0; i < count; i++) {
         items.push({
-            food_item_id: Math.floor(Math.random() * 49) + 1,
+            food_item_id: Math.floor(Math.random() * FOOD_COUNT) + 1,
             portion_grams_min: 50 + Math.floor(Math.random() * 100),
             portion_grams_max: 150 + Math.floor(Math.random() * 100),
             portion_description: `${Math.floor(Math.random() * 3) + 1} serving(s)`,
@@ -37,7 +41,7 @@ function generateMealItems(count) {
 
 export default function () {
     const payload = JSON.stringify({
-        meal_id: Math.floor(Math.random() * 10) + 1,
+        meal_id: Math.floor(Math.random() * MEAL_COUNT) + 1,
         items: generateMealItems(50),  // 50 items per request
     });
 
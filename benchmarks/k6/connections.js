@@ -0,0 +1,64 @@
+import http from 'k6/http';
+import { check } from 'k6';
+import { Rate, Trend } from 'k6/metrics';
+
+const errorRate = new Rate('errors');
+const connectTime = new Trend('connect_time');
+const http2Rate = new Rate('http2');
+
+const BASE_URL = __ENV.BASE_URL || 'http://localhost:8000';
+const CATEGORY_COUNT = parseInt(__ENV.CATEGORY_COUNT || '8');
+
+// How clients hold connections (see connections.sh):
+//   reuse      keep-alive across iterations, like a pooling gateway
+//   iteration  a new connection per iteration, reused for its two requests
+//   none       a new connection for every request
+const MODE = __ENV.CONN_MODE || 'reuse';
+
+export const options = {
+    vus: parseInt(__ENV.VUS || '64'),
+    duration: __ENV.DURATION || '30s',
+    noVUConnectionReuse: MODE === 'iteration',
+    noConnectionReuse: MODE === 'none',
+    // connections.sh serves a throwaway self-signed certificate
+    insecureSkipTLSVerify: true,
+    thresholds: {
+        errors: ['rate<0.01'],
+    },
+};
+
+export default function () {
+    const responses = [
+        http.get(`${BASE_URL}/api/categories`),
+        http.get(`${BASE_URL}/api/foods?category_id=${Math.floor(Math.random() * CATEGORY_COUNT) + 1}`),
+    ];
+
+    for (const res of responses) {
+        check(res, {
+            'status is 200': (r) => r.status === 200,
+        });
+        errorRate.add(res.status !== 200);
+        // Zero when the request went out on an open connection
+        connectTime.add(res.timings.connecting + res.timings.tls_handshaking);
+        http2Rate.add(res.proto === 'HTTP/2.0');
+    }
+}
+
+export function handleSummary(data) {
+    return {
+        'stdout': JSON.stringify({
+            test: 'connections',
+            profile: __ENV.PROFILE || '',
+            mode: MODE,
+            vus: options.vus,
+            requests_total: data.metrics.http_reqs.values.count,
+            requests_per_second: data.metrics.http_reqs.values.rate,
+            avg_latency_ms: data.metrics.http_req_duration.values.avg,
+            p95_latency_ms: data.metrics.http_req_duration.values['p(95)'],
+            p99_latency_ms: data.metrics.http_req_duration.values['p(99)'],
+            avg_connect_ms: data.metrics.connect_time.values.avg,
+            http2_rate: data.metrics.http2.values.rate,
+            error_rate: data.metrics.errors?.values?.rate || 0,
+        }, null, 2) + '\n',
+    };
+}
@@ -7,6 +7,9 @@ const latency = new Trend('latency');
 
 const BASE_URL = __ENV.BASE_URL || 'http://localhost:8000';
 
+// Dataset size from seed.py (it prints these after seeding)
+const CATEGORY_COUNT = parseInt(__ENV.CATEGORY_COUNT || '10');
+
 export const options = {
     stages: [
         { duration: '10s', target: 50 },
@@ -21,7 +24,7 @@ export const options = {
 
 export default function () {
     // Randomly select category filter
-    const category = Math.floor(Math.random() * 10) + 1;
+    const category = Math.floor(Math.random() * CATEGORY_COUNT) + 1;
     const useFilter = Math.random() > 0.5;
 
     const url = useFilter
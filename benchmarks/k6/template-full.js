@@ -7,8 +7,8 @@ const latency = new Trend('latency');
 
 const BASE_URL = __ENV.BASE_URL || 'http://localhost:8000';
 
-// Template IDs to test (assumes these exist from seed data)
-const TEMPLATE_IDS = [1, 2, 3];
+// Dataset size from seed.py (it prints these after seeding)
+const TEMPLATE_COUNT = parseInt(__ENV.TEMPLATE_COUNT || '3');
 
 export const options = {
     stages: [
@@ -24,7 +24,7 @@ export const options = {
 
 export default function () {
     // Randomly select a template
-    const templateId = TEMPLATE_IDS[Math.floor(Math.random() * TEMPLATE_IDS.length)];
+    const templateId = Math.floor(Math.random() * TEMPLATE_COUNT) + 1;
 
     const res = http.get(`${BASE_URL}/api/templates/${templateId}/full`);
 
@@ -0,0 +1,54 @@
+import http from 'k6/http';
+import { check } from 'k6';
+import { Rate } from 'k6/metrics';
+
+const errorRate = new Rate('errors');
+
+const BASE_URL = __ENV.BASE_URL || 'http://localhost:8000';
+const TEMPLATE_COUNT = parseInt(__ENV.TEMPLATE_COUNT || '3');
+const CATEGORY_COUNT = parseInt(__ENV.CATEGORY_COUNT || '8');
+
+// Closed loop without think time: measures how many requests the server
+// completes, not how many the script asks for (see scaling.sh)
+export const options = {
+    vus: parseInt(__ENV.VUS || '64'),
+    duration: __ENV.DURATION || '30s',
+    thresholds: {
+        errors: ['rate<0.01'],
+    },
+};
+
+// Read mix of the other scripts: cheap list, filtered list, template tree
+const PATHS = [
+    () => '/api/categories',
+    () => `/api/foods?category_id=${Math.floor(Math.random() * CATEGORY_COUNT) + 1}`,
+    () => `/api/templates/${Math.floor(Math.random() * TEMPLATE_COUNT) + 1}/full`,
+];
+
+export default function () {
+    const path = PATHS[Math.floor(Math.random() * PATHS.length)]();
+    const res = http.get(`${BASE_URL}${path}`);
+
+    check(res, {
+        'status is 200': (r) => r.status === 200,
+    });
+
+    errorRate.add(res.status !== 200);
+}
+
+export function handleSummary(data) {
+    return {
+        'stdout': JSON.stringify({
+            test: 'throughput',
+            workers: parseInt(__ENV.WORKERS || '0'),
+            vus: options.vus,
+            requests_total: data.metrics.http_reqs.values.count,
+            requests_per_second: data.metrics.http_reqs.values.rate,
+            avg_latency_ms: data.metrics.http_req_duration.values.avg,
+            p50_latency_ms: data.metrics.http_req_duration.values['p(50)'],
+            p95_latency_ms: data.metrics.http_req_duration.values['p(95)'],
+            p99_latency_ms: data.metrics.http_req_duration.values['p(99)'],
+            error_rate: data.metrics.errors?.values?.rate || 0,
+        }, null, 2) + '\n',
+    };
+}
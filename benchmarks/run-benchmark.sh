@@ -42,7 +42,7 @@ fi
 echo -e "${YELLOW}Waiting for service...${NC}"
 max_attempts=30
 attempt=0
-until curl -s "$BASE_URL/health" > /dev/null 2>&1; do
+until curl -sf "$BASE_URL/health" > /dev/null 2>&1; do
     attempt=$((attempt + 1))
     if [ $attempt -ge $max_attempts ]; then
         echo -e "${RED}Service not responding after $max_attempts attempts${NC}"
@@ -0,0 +1,93 @@
+#!/bin/bash
+# Throughput of serve.py from 1 to N worker processes
+# Usage: ./scaling.sh [max_workers]   (default: usable CPUs, as serve.py sizes it)
+#
+# Starts serve.py on SCALING_PORT once per worker count, waits for
+# /health/ready, runs k6/throughput.js against it and stops it again. The
+# database comes from the usual DB_* variables. k6 shares the machine, so
+# on small hosts the top worker counts also measure k6's CPU contention.
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+ROOT_DIR="$(dirname "$SCRIPT_DIR")"
+K6_DIR="$SCRIPT_DIR/k6"
+RESULTS_DIR="$SCRIPT_DIR/results"
+
+PORT=${SCALING_PORT:-8100}
+BASE_URL="http://127.0.0.1:$PORT"
+MAX_WORKERS=${1:-$(cd "$ROOT_DIR" && python -c "import serve; print(serve.usable_cpus())")}
+DURATION=${DURATION:-30s}
+VUS=${VUS:-64}
+
+# Colors
+GREEN='\033[0;32m'
+YELLOW='\033[1;33m'
+RED='\033[0;31m'
+NC='\033[0m'
+
+TIMESTAMP=$(date +%Y%m%d_%H%M%S)
+RESULT_DIR="$RESULTS_DIR/${TIMESTAMP}_scaling"
+mkdir -p "$RESULT_DIR"
+
+if ! command -v k6 &> /dev/null; then
+    echo -e "${RED}Error: k6 is not installed${NC}"
+    exit 1
+fi
+
+# 1, 2, 4, ... and MAX_WORKERS itself
+COUNTS=()
+for ((w = 1; w < MAX_WORKERS; w *= 2)); do COUNTS+=("$w"); done
+COUNTS+=("$MAX_WORKERS")
+
+echo -e "${GREEN}============================================${NC}"
+echo -e "${GREEN}  Worker scaling: ${COUNTS[*]}${NC}"
+echo -e "${GREEN}============================================${NC}"
+echo -e "Results: ${YELLOW}$RESULT_DIR${NC}"
+
+for workers in "${COUNTS[@]}"; do
+    echo ""
+    echo -e "${GREEN}[$workers workers]${NC}"
+    (cd "$ROOT_DIR" && SERVER_WORKERS=$workers SERVER_BIND="127.0.0.1:$PORT" \
+        exec python serve.py > "$RESULT_DIR/server-$workers.log" 2>&1) &
+    server=$!
+
+    attempt=0
+    until curl -sf "$BASE_URL/health/ready" > /dev/null 2>&1; do
+        attempt=$((attempt + 1))
+        if [ $attempt -ge 60 ]; then
+            echo -e "${RED}Server not ready after 60 attempts; see server-$workers.log${NC}"
+            kill -TERM $server 2>/dev/null || true
+            exit 1
+        fi
+        sleep 1
+    done
+
+    k6 run --quiet \
+        -e BASE_URL=$BASE_URL -e WORKERS=$workers -e VUS=$VUS -e DURATION=$DURATION \
+        "$K6_DIR/throughput.js" > "$RESULT_DIR/throughput-$workers.json" || true
+    cat "$RESULT_DIR/throughput-$workers.json"
+
+    # The gunicorn master: graceful shutdown of all its workers
+    kill -TERM $server 2>/dev/null || true
+    wait $server 2>/dev/null || true
+    # Let the listening socket go before the next run binds it
+    sleep 2
+done
+
+# Summary table: throughput and speedup over one worker
+python - "$RESULT_DIR" <<'PY' | tee "$RESULT_DIR/scaling.txt"
+import glob, json, os, sys
+
+runs = []
+for path in glob.glob(os.path.join(sys.argv[1], "throughput-*.json")):
+    with open(path) as f:
+        runs.append(json.load(f))
+runs.sort(key=lambda run: run["workers"])
+base = runs[0]["requests_per_second"] if runs else 0
+print(f"{'workers':>7} {'req/s':>10} {'speedup':>8} {'p95 ms':>8} {'errors':>7}")
+for run in runs:
+    rps = run["requests_per_second"]
+    print(f"{run['workers']:>7} {rps:>10.0f} {rps / base if base else 0:>7.2f}x "
+          f"{run['p95_latency_ms']:>8.1f} {run['error_rate']:>7.2%}")
+PY
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark
+
+Measures what a new instance pays before it can take traffic:
+
+    import      `import main` in a fresh interpreter (median and min of N runs)
+    modules     slowest modules under -X importtime (cumulative, one run)
+    serve       time from spawning the server until /health/live answers,
+                /health/ready reports ready, and the first /api/categories
+
+Usage:
+    python benchmarks/startup.py                      # all three, 10 import runs
+    python benchmarks/startup.py --runs 20 --skip-serve
+    python benchmarks/startup.py --server serve       # serve.py, one worker
+
+The database comes from the usual DB_* variables; WARMUP_BUDGET decides
+how long /health/ready waits for warm-up.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import main; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def measure_import(runs: int) -> list[float]:
+    """Seconds to import main, each in a fresh interpreter."""
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        )
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def slowest_modules(top: int) -> list[tuple[int, str]]:
+    """(cumulative microseconds, module) of the slowest imports, interpreter startup included."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return modules[:top]
+
+
+def _get(url: str) -> tuple[int, bytes]:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def _wait_for(url: str, started: float, deadline: float, accept) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            status, body = _get(url)
+            if accept(status, body):
+                return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} not ready after the timeout")
+
+
+def _is_ready(status: int, body: bytes) -> bool:
+    return status == 200 and json.loads(body).get("status") == "ready"
+
+
+def measure_serve(server: str, port: int, timeout: float) -> dict:
+    """Seconds from spawn to first live, ready and data responses."""
+    env = dict(os.environ)
+    if server == "serve":
+        env.update(SERVER_BIND=f"127.0.0.1:{port}", SERVER_WORKERS="1")
+        command = [sys.executable, "serve.py"]
+    else:
+        command = [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ]
+    base = f"http://127.0.0.1:{port}"
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=PROJECT_ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + timeout
+        live = _wait_for(f"{base}/health/live", started, deadline, lambda s, _: s == 200)
+        ready = _wait_for(f"{base}/health/ready", started, deadline, _is_ready)
+        first = _wait_for(f"{base}/api/categories", started, deadline, lambda s, _: s == 200)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {"live": live, "ready": ready, "first_response": first}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-first-response")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters for the import timing")
+    parser.add_argument("--top", type=int, default=15, help="modules listed in the breakdown")
+    parser.add_argument("--server", choices=("uvicorn", "serve"), default="uvicorn")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--skip-serve", action="store_true", help="import timings only")
+    args = parser.parse_args()
+
+    timings = measure_import(args.runs)
+    print(f"import main ({args.runs} runs)")
+    print(f"  median {statistics.median(timings) * 1000:7.1f} ms")
+    print(f"  min    {min(timings) * 1000:7.1f} ms")
+
+    print("\nslowest imports (cumulative)")
+    for micros, name in slowest_modules(args.top):
+        print(f"  {micros / 1000:7.1f} ms  {name}")
+
+    if args.skip_serve:
+        return
+    serve = measure_serve(args.server, args.port, args.timeout)
+    print(f"\n{args.server}: time from spawn")
+    print(f"  /health/live     {serve['live'] * 1000:7.1f} ms")
+    print(f"  /health/ready    {serve['ready'] * 1000:7.1f} ms")
+    print(f"  /api/categories  {serve['first_response'] * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,586 @@
+"""
+Compact catalog snapshot shared by every worker on a host.
+
+GET /api/foods, /api/categories and /api/templates/{id}/full read data that
+changes rarely, so they are served from a snapshot instead of the database.
+A snapshot is one binary buffer:
+
+    MAGIC, header offset          16 bytes
+    sections                      8-byte aligned, see _write_snapshot()
+    header                        JSON: section offsets/formats, counts, build time
+
+Food columns are typed sections (ids, category ids and portions as int64,
+macros as float64 with NaN for NULL, one flag byte per row), names live in
+UTF-8 blobs with offset arrays, filters use bitmaps (bit i = row i), and
+each template is stored as its finished JSON response. Rows are kept in the
+list order of queries.get_all_foods. CatalogSnapshot only takes memoryviews
+over the buffer; FoodItem objects are built just for the rows a response
+returns.
+
+With CATALOG_SNAPSHOT_PATH set (e.g. /dev/shm/diet_catalog.snap) the buffer
+is a file every uvicorn worker maps read-only, so its memory and build cost
+are paid once per host. One process rebuilds it at a time (flock on
+<path>.lock), writing a temp file and os.replace()-ing it; workers notice the
+new inode within CATALOG_CHECK_INTERVAL seconds and remap, while requests
+still holding the old mapping finish on it. Without a path each worker
+builds the same buffer in memory.
+
+Snapshots are rebuilt by a background thread after CATALOG_TTL seconds
+(0 disables the catalog) and shortly after a write. Writes made elsewhere
+(other workers and hosts, import jobs) are found in change_log: each
+snapshot records the change id it is current to, and a watcher thread reads
+newer changes every CATALOG_CHECK_INTERVAL seconds. Until the rebuild
+lands, changed data is read from the database. Templates nobody wrote to
+are copied from the previous snapshot instead of re-queried.
+"""
+
+import bisect
+import io
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+from typing import Optional
+
+import changes
+import metrics
+import queries
+import tracing
+from models import CategoryListResponse, FoodItem, TemplateFullResponse
+
+logger = logging.getLogger("diet_api.catalog")
+
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "30"))
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH") or None
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "1"))
+CATALOG_REBUILD_DELAY = float(os.getenv("CATALOG_REBUILD_DELAY", "0.2"))
+CATALOG_TEMPLATES = os.getenv("CATALOG_TEMPLATES", "1") == "1"
+TEMPLATE_BATCH_SIZE = 100
+# change_log rows read per query by the watcher
+CHANGE_PAGE = 1000
+
+CATALOG_ITEMS = metrics.registry.register(metrics.Gauge(
+    "catalog_items", "Rows held in the catalog snapshot", ("kind",),
+))
+CATALOG_BYTES = metrics.registry.register(metrics.Gauge(
+    "catalog_bytes", "Size of the catalog snapshot buffer",
+))
+CATALOG_RELOADS = metrics.registry.register(metrics.Counter(
+    "catalog_reloads_total", "Catalog snapshots built or mapped by this worker", ("source",),
+))
+
+MAGIC = b"DIETSNP1"
+PREAMBLE = struct.Struct("<8sQ")
+SNACK, ACTIVE, DESCRIBED = 1, 2, 4
+MACROS = ("calories_per_100g", "protein_per_100g", "carbs_per_100g", "fat_per_100g", "fiber_per_100g")
+
+# Set-bit offsets of every byte value, for walking bitmaps a byte at a time
+_BYTE_BITS = tuple(tuple(b for b in range(8) if value >> b & 1) for value in range(256))
+
+
+def _positions(bitmap: bytes):
+    """Yield the set bits of a little-endian bitmap in ascending order."""
+    for offset, byte in enumerate(bitmap):
+        if byte:
+            base = offset * 8
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+# =============================================================================
+# BUILDING
+# =============================================================================
+
+class _SnapshotWriter:
+    """Appends aligned sections to a binary file, then the JSON header."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sections: dict[str, tuple[int, int, str]] = {}
+        f.write(PREAMBLE.pack(MAGIC, 0))
+
+    def add(self, name: str, data, fmt: str = "B"):
+        self.f.write(b"\0" * (-self.f.tell() % 8))
+        offset = self.f.tell()
+        self.f.write(data)
+        self.sections[name] = (offset, self.f.tell() - offset, fmt)
+
+    def add_strings(self, name: str, values, separator: bytes = b""):
+        """A blob of UTF-8 strings plus an int64 offset array (len + 1 entries)."""
+        offsets = array("q", [0])
+        blob = bytearray()
+        for value in values:
+            blob += value.encode() + separator
+            offsets.append(len(blob))
+        self.add(name + "_offsets", offsets.tobytes(), "q")
+        self.add(name, bytes(blob))
+
+    def finish(self, meta: dict):
+        offset = self.f.tell()
+        self.f.write(json.dumps({**meta, "sections": self.sections}).encode())
+        self.f.seek(0)
+        self.f.write(PREAMBLE.pack(MAGIC, offset))
+
+
+def _template_blobs(previous: Optional["CatalogSnapshot"], dirty: set[int]):
+    """Yield (template_id, response JSON), reusing clean blobs from `previous`."""
+    ids = queries.get_template_ids()
+    missing = [t for t in ids if previous is None or t in dirty or previous.template_json(t) is None]
+    fresh = {}
+    for start in range(0, len(missing), TEMPLATE_BATCH_SIZE):
+        trees = queries.get_template_trees(missing[start:start + TEMPLATE_BATCH_SIZE])
+        for template_id, tree in trees.items():
+            fresh[template_id] = TemplateFullResponse(success=True, template=tree).model_dump_json().encode()
+    missing = set(missing)
+    for template_id in ids:
+        if template_id in missing:
+            blob = fresh.get(template_id)
+        else:
+            blob = previous.template_json(template_id)
+        if blob is not None:
+            yield template_id, blob
+
+
+def _write_snapshot(f, previous: Optional["CatalogSnapshot"] = None, dirty_templates: set[int] = frozenset()):
+    """Query the catalog and write a snapshot to the binary file `f`."""
+    # Recorded as built_at and change_cursor: everything committed before
+    # this, and every change up to the cursor, is in the snapshot
+    started = time.time()
+    change_cursor = changes.settled_cursor()
+    rows = queries.get_food_catalog()
+    categories = queries.get_all_categories()
+    size = len(rows)
+    nbytes = (size + 7) // 8
+    writer = _SnapshotWriter(f)
+
+    columns = [array("q") for _ in range(3)] + [array("d") for _ in MACROS]
+    flags = bytearray()
+    active, snack_bits = bytearray(nbytes), bytearray(nbytes)
+    by_category: dict[int, bytearray] = {}
+    category_names: dict[int, Optional[str]] = {}
+    for i, row in enumerate(rows):
+        (food_id, category_id, category_name, name, description, portion,
+         kcal, protein, carbs, fat, fiber, snack, status) = row
+        for column, value in zip(columns, (food_id, category_id, portion, kcal, protein, carbs, fat, fiber)):
+            column.append(math.nan if value is None else value)
+        byte, bit = i >> 3, 1 << (i & 7)
+        if category_id not in by_category:
+            by_category[category_id] = bytearray(nbytes)
+            category_names[category_id] = category_name
+        by_category[category_id][byte] |= bit
+        if snack:
+            snack_bits[byte] |= bit
+        if status:
+            active[byte] |= bit
+        flags.append((SNACK if snack else 0) | (ACTIVE if status else 0) | (DESCRIBED if description is not None else 0))
+
+    for name, column in zip(("ids", "category_ids", "portions", *MACROS), columns):
+        writer.add(name, column.tobytes(), column.typecode)
+    writer.add("flags", bytes(flags))
+    writer.add_strings("names", (row[3] for row in rows))
+    # Casefolded and NUL-terminated so a single find() searches every name
+    writer.add_strings("folded", (row[3].casefold() for row in rows), b"\0")
+    writer.add_strings("descriptions", (row[4] or "" for row in rows))
+    writer.add("active", bytes(active))
+    writer.add("snack", bytes(snack_bits))
+    writer.add("bitmap_categories", array("q", by_category).tobytes(), "q")
+    writer.add("category_bitmaps", b"".join(by_category.values()))
+    writer.add_strings("category_names", (n or "" for n in category_names.values()))
+
+    order = sorted(range(size), key=columns[0].__getitem__)
+    writer.add("id_order", array("q", order).tobytes(), "q")
+    writer.add("sorted_ids", array("q", (columns[0][i] for i in order)).tobytes(), "q")
+
+    writer.add("categories_json", CategoryListResponse(
+        success=True, count=len(categories), categories=categories
+    ).model_dump_json().encode())
+
+    template_ids = array("q")
+    template_offsets = array("q", [0])
+    blobs = io.BytesIO()
+    if CATALOG_TEMPLATES:
+        for template_id, blob in _template_blobs(previous, dirty_templates):
+            template_ids.append(template_id)
+            blobs.write(blob)
+            template_offsets.append(blobs.tell())
+    writer.add("template_ids", template_ids.tobytes(), "q")
+    writer.add("template_offsets", template_offsets.tobytes(), "q")
+    writer.add("templates", blobs.getbuffer())
+
+    writer.finish({
+        "foods": size, "templates": len(template_ids),
+        "built_at": started, "change_cursor": change_cursor,
+    })
+
+
+# =============================================================================
+# READING
+# =============================================================================
+
+class CatalogSnapshot:
+    """Read-only view over a snapshot buffer (bytes or a read-only mmap)."""
+
+    def __init__(self, buffer, identity=None):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, header_offset = PREAMBLE.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("Not a catalog snapshot")
+        header = json.loads(bytes(view[header_offset:]))
+        sections = header["sections"]
+        self.identity = identity
+        self.size = header["foods"]
+        self.templates = header["templates"]
+        self.built_at = header["built_at"]
+        self.change_cursor = header.get("change_cursor", 0)
+        self.nbytes = len(view)
+
+        def section(name):
+            offset, length, fmt = sections[name]
+            part = view[offset:offset + length]
+            return part if fmt == "B" else part.cast(fmt)
+
+        self.ids = section("ids")
+        self.category_ids = section("category_ids")
+        self.portions = section("portions")
+        self.macros = tuple(section(name) for name in MACROS)
+        self.flags = section("flags")
+        self._names, self._name_offsets = section("names"), section("names_offsets")
+        self._descriptions, self._description_offsets = section("descriptions"), section("descriptions_offsets")
+        # Searched in place with the buffer's own find() (bytes and mmap both have it)
+        self._folded_start = sections["folded"][0]
+        self._folded_offsets = section("folded_offsets")
+        self._id_order = section("id_order")
+        self._sorted_ids = section("sorted_ids")
+        self.categories_json = section("categories_json")
+        self._template_ids = section("template_ids")
+        self._template_offsets = section("template_offsets")
+        self._templates = section("templates")
+
+        # Small per-process copies: filter bitmaps as ints, category names as str
+        self.active = int.from_bytes(section("active"), "little")
+        self.snack = int.from_bytes(section("snack"), "little")
+        nbytes = (self.size + 7) // 8
+        bitmaps = section("category_bitmaps")
+        name_offsets = section("category_names_offsets")
+        names = bytes(section("category_names"))
+        self.by_category = {}
+        self.category_names = {}
+        for i, category_id in enumerate(section("bitmap_categories")):
+            self.by_category[category_id] = int.from_bytes(bitmaps[i * nbytes:(i + 1) * nbytes], "little")
+            self.category_names[category_id] = names[name_offsets[i]:name_offsets[i + 1]].decode() or None
+
+    def item(self, i: int) -> FoodItem:
+        """Materialize row i; values came from the database, so validation is skipped."""
+        category_id = self.category_ids[i]
+        kcal, protein, carbs, fat, fiber = (
+            None if value != value else value for value in (column[i] for column in self.macros)
+        )
+        flags = self.flags[i]
+        description = None
+        if flags & DESCRIBED:
+            description = str(self._descriptions[self._description_offsets[i]:self._description_offsets[i + 1]], "utf-8")
+        return FoodItem.model_construct(
+            id=self.ids[i],
+            category_id=category_id,
+            category_name=self.category_names.get(category_id),
+            name=str(self._names[self._name_offsets[i]:self._name_offsets[i + 1]], "utf-8"),
+            description=description,
+            default_portion_grams=self.portions[i],
+            calories_per_100g=kcal,
+            protein_per_100g=protein,
+            carbs_per_100g=carbs,
+            fat_per_100g=fat,
+            fiber_per_100g=fiber,
+            is_snack_suitable=bool(flags & SNACK),
+            status=bool(flags & ACTIVE),
+        )
+
+    def _search(self, needle: str, bitmap: bytes):
+        """Rows whose casefolded name contains `needle`, restricted to `bitmap`."""
+        pattern = needle.casefold().encode()
+        if b"\0" in pattern:
+            return
+        base = self._folded_start
+        offsets = self._folded_offsets
+        end = base + offsets[self.size]
+        find = self._buffer.find
+        found = find(pattern, base, end)
+        while found != -1:
+            i = bisect.bisect_right(offsets, found - base) - 1
+            if bitmap[i >> 3] >> (i & 7) & 1:
+                yield i
+            found = find(pattern, base + offsets[i + 1], end)
+
+    def foods(
+        self,
+        category_id: Optional[int] = None,
+        snack_only: Optional[bool] = None,
+        search: Optional[str] = None
+    ) -> list[FoodItem]:
+        """Same rows and order as queries.get_all_foods."""
+        mask = self.active
+        if category_id is not None:
+            mask &= self.by_category.get(category_id, 0)
+        if snack_only is True:
+            mask &= self.snack
+        bitmap = mask.to_bytes((self.size + 7) // 8, "little")
+        positions = self._search(search, bitmap) if search else _positions(bitmap)
+        return [self.item(i) for i in positions]
+
+    def food(self, food_id: int) -> Optional[FoodItem]:
+        j = bisect.bisect_left(self._sorted_ids, food_id)
+        if j < self.size and self._sorted_ids[j] == food_id:
+            return self.item(self._id_order[j])
+        return None
+
+    def template_json(self, template_id: int) -> Optional[memoryview]:
+        """The TemplateFullResponse body for a template, or None if not in the snapshot."""
+        j = bisect.bisect_left(self._template_ids, template_id)
+        if j < len(self._template_ids) and self._template_ids[j] == template_id:
+            return self._templates[self._template_offsets[j]:self._template_offsets[j + 1]]
+        return None
+
+
+# =============================================================================
+# LIFECYCLE
+# =============================================================================
+
+class FoodCatalog:
+    """Serves the current snapshot and keeps it fresh from a background thread.
+
+    Accessors return None when the snapshot cannot answer (none built yet,
+    or this worker changed the data since) and callers fall back to queries.py.
+    """
+
+    def __init__(self, ttl: float, path: Optional[str] = None):
+        self.ttl = ttl
+        self.path = path
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._builder: Optional[threading.Thread] = None
+        self._watcher: Optional[threading.Thread] = None
+        # Local writes not yet in a snapshot: foods/categories by version, templates by id
+        self._version = 0
+        self._built_version = 0
+        self._dirty_templates: set[int] = set()
+        self._written_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    # -------------------------------------------------------------------------
+    # Readers
+
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        if self.path and time.monotonic() - self._checked >= CATALOG_CHECK_INTERVAL:
+            self._checked = time.monotonic()
+            self._map_latest()
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot.built_at >= self.ttl:
+            self._request_build()
+        return snapshot
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        """The snapshot, if it already holds this worker's food/category writes."""
+        snapshot = self.snapshot()
+        usable = snapshot is not None and self._built_version == self._version
+        metrics.record_cache("food_catalog", usable)
+        return snapshot if usable else None
+
+    def template_json(self, template_id: int) -> Optional[memoryview]:
+        snapshot = self.snapshot()
+        body = None
+        if snapshot is not None and template_id not in self._dirty_templates:
+            body = snapshot.template_json(template_id)
+        metrics.record_cache("template_snapshot", body is not None)
+        return body
+
+    def status(self) -> dict:
+        """Snapshot age and size for readiness checks; never triggers a build."""
+        snapshot = self._snapshot
+        if not self.enabled or snapshot is None:
+            return {"enabled": self.enabled, "loaded": False}
+        return {
+            "enabled": True,
+            "loaded": True,
+            "age_seconds": round(time.time() - snapshot.built_at, 1),
+            "foods": snapshot.size,
+            "templates": snapshot.templates,
+            "pending_writes": self._built_version != self._version or bool(self._dirty_templates),
+        }
+
+    # -------------------------------------------------------------------------
+    # Writers
+
+    def invalidate(self):
+        """Foods or categories changed on this worker."""
+        self._version += 1
+        self._written_at = time.time()
+        self._request_build()
+
+    def templates_changed(self, template_ids):
+        self._dirty_templates.update(t for t in template_ids if t is not None)
+        self._written_at = time.time()
+        self._request_build()
+
+    # -------------------------------------------------------------------------
+    # Writes made elsewhere
+
+    def _watch(self):
+        """Invalidate for changes in change_log newer than the first snapshot."""
+        cursor = self._snapshot.change_cursor
+        while True:
+            time.sleep(CATALOG_CHECK_INTERVAL)
+            try:
+                cursor = self._apply_changes(cursor)
+            except Exception:
+                logger.exception("checking change_log for catalog writes failed")
+
+    def _apply_changes(self, cursor: int) -> int:
+        # One shared MAX(id) probe per worker (changes.feed) when nothing changed
+        while changes.feed.has_changes(cursor):
+            settled = changes.settled_cursor()
+            rows = queries.get_changes(cursor, CHANGE_PAGE, None, settled)
+            if not rows:
+                break
+            templates = {row["entity_id"] for row in rows if row["entity"] == "template"}
+            if templates:
+                self._dirty_templates.update(templates)
+            if len(templates) < len(rows):
+                # A food or category changed: stop serving lists until rebuilt
+                self._version += 1
+            # Committed by now, so any build started from here on includes them
+            self._written_at = time.time()
+            self._request_build()
+            cursor = rows[-1]["id"]
+            if len(rows) < CHANGE_PAGE:
+                break
+        return cursor
+
+    # -------------------------------------------------------------------------
+    # Building and mapping
+
+    def warm(self):
+        """Map or build a snapshot now, in the calling thread (startup warm-up)."""
+        if self.path:
+            self._map_latest()
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot.built_at >= self.ttl:
+            self._rebuild()
+
+    def _request_build(self):
+        if self._builder is None:
+            with self._lock:
+                if self._builder is None:
+                    self._builder = threading.Thread(target=self._run, name="catalog-builder", daemon=True)
+                    self._builder.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Let a burst of writes land in one rebuild
+            time.sleep(CATALOG_REBUILD_DELAY)
+            self._wake.clear()
+            try:
+                self._rebuild()
+            except Exception:
+                logger.exception("catalog snapshot rebuild failed")
+                time.sleep(min(self.ttl, 5.0))
+
+    def _rebuild(self):
+        version = self._version
+        dirty = set(self._dirty_templates)
+        written_at = self._written_at
+        caller = tracing.current()
+        # Reads right after this worker's writes must not go to a lagging replica
+        with tracing.capture_queries() as ctx:
+            ctx.max_statements = 0
+            ctx.primary_until = time.time() + 60
+            ctx.deadline = caller.deadline if caller is not None else None
+            if self.path:
+                self._rebuild_shared(dirty, written_at)
+            else:
+                buffer = io.BytesIO()
+                _write_snapshot(buffer, self._snapshot, dirty)
+                self._install(CatalogSnapshot(buffer.getvalue()), "built")
+        self._built_version = version
+        self._dirty_templates -= dirty
+
+    def _rebuild_shared(self, dirty: set[int], written_at: float):
+        import fcntl
+
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another worker may have rebuilt while we waited for the lock.
+                # Its build covers our food writes if it started after them,
+                # but it copied our dirty templates from the old snapshot.
+                self._map_latest()
+                latest = self._snapshot
+                if (
+                    latest is not None
+                    and not dirty
+                    and latest.built_at > written_at
+                    and time.time() - latest.built_at < self.ttl
+                ):
+                    return
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                try:
+                    with open(tmp, "w+b") as f:
+                        _write_snapshot(f, latest, dirty)
+                    os.replace(tmp, self.path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.unlink(tmp)
+                    raise
+                CATALOG_RELOADS.inc("built")
+                self._map_latest()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _map_latest(self):
+        """Map the snapshot file if it was replaced since we last looked."""
+        import mmap
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+        current = self._snapshot
+        if current is not None and current.identity == identity:
+            return
+        with open(self.path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._install(CatalogSnapshot(buffer, identity), "mapped")
+
+    def _install(self, snapshot: CatalogSnapshot, source: str):
+        # Requests still holding the previous snapshot keep it (and its
+        # mapping) alive until they finish.
+        self._snapshot = snapshot
+        if self._watcher is None:
+            with self._lock:
+                if self._watcher is None:
+                    self._watcher = threading.Thread(target=self._watch, name="catalog-watcher", daemon=True)
+                    self._watcher.start()
+        CATALOG_RELOADS.inc(source)
+        CATALOG_ITEMS.set(snapshot.size, "foods")
+        CATALOG_ITEMS.set(snapshot.templates, "templates")
+        CATALOG_BYTES.set(snapshot.nbytes)
+
+
+catalog = FoodCatalog(CATALOG_TTL, CATALOG_SNAPSHOT_PATH)
+
+
+def can_serve(search: Optional[str]) -> bool:
+    """LIKE wildcards in a search term need the database's pattern matching."""
+    return catalog.enabled and not (search and ("%" in search or "_" in search))
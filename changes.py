@@ -0,0 +1,309 @@
+"""
+Incremental change feed.
+
+Every write path (group-committed creates, upserts, write-behind batches)
+records the rows it touched in change_log inside the same transaction.
+Consumers keep the id of the last change they saw and ask for what came
+after it, so a sync costs as much as the churn since the last one instead of
+a full /api/foods + /api/templates download:
+
+    GET /api/changes                           the current cursor, to start from
+                                               after a full download
+    GET /api/changes?since=<cursor>            one page, returns immediately
+    GET /api/changes?since=<cursor>&wait=25    long-poll until something changes
+    GET /api/changes/stream                    server-sent events
+
+A page holds each entity at most once, with its current row (a template's
+header; fetch /api/templates/{id}/full for its days and meals). Meal-item
+writes appear as template updates.
+
+Cursor safety: InnoDB assigns ids at insert time but transactions commit in
+any order, so id 11 can become visible before id 10. On MySQL a page only
+includes changes logged at least CHANGES_SETTLE seconds ago; SQLite
+serializes writers and needs no delay. changed_at is stamped and aged on the
+database clock, so app hosts with skewed clocks agree on what has settled.
+
+Waiters share one MAX(id) probe per CHANGES_POLL_INTERVAL per worker, so a
+thousand idle long-polls cost a query every half second, not a thousand.
+Changes older than CHANGES_RETENTION are purged; a cursor that fell behind
+the retained range gets 410 and has to resync in full.
+
+Invalidations (GET /api/invalidations) are the cheap variant for clients
+that cache templates and the catalog: server-sent events carrying only ids
+and versions. One Broadcaster per worker reads change_log and encodes each
+batch once, then appends the same bytes to every subscriber's buffer. Each
+subscriber costs a deque and an asyncio.Event, not a query loop.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+import database
+import metrics
+import queries
+
+logger = logging.getLogger("diet_api.changes")
+
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "0.5"))
+CHANGES_RETENTION = float(os.getenv("CHANGES_RETENTION", str(7 * 86400)))
+CHANGES_SETTLE = float(os.getenv(
+    "CHANGES_SETTLE", "1" if database.pool.backend.name == "mysql" else "0"
+))
+
+INVALIDATION_BUFFER = int(os.getenv("INVALIDATION_BUFFER", "256"))
+INVALIDATION_BACKLOG = int(os.getenv("INVALIDATION_BACKLOG", "10000"))
+
+# Longest long-poll, and the SSE heartbeat that keeps proxies from timing out
+MAX_WAIT = 30.0
+HEARTBEAT = 15.0
+PURGE_INTERVAL = 3600
+
+SUBSCRIBERS = metrics.registry.register(metrics.Gauge(
+    "invalidation_subscribers", "Open /api/invalidations streams",
+))
+INVALIDATIONS = metrics.registry.register(metrics.Counter(
+    "invalidation_events_total", "Invalidation events published, by event",
+    ("event",),
+))
+
+
+def settled_cursor() -> int:
+    """Newest change id below which every change has committed."""
+    return queries.get_change_cursor(CHANGES_SETTLE)
+
+
+class CursorExpired(Exception):
+    """The cursor points before the oldest retained change."""
+
+    def __init__(self, cursor: int):
+        super().__init__("Change cursor expired; resync and continue from the returned cursor")
+        self.cursor = cursor
+
+
+class ChangeFeed:
+    """Pages of change_log after a cursor, with a shared newest-id probe."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._bounds = (0, 0)
+        self._checked_at = 0.0
+        self._purged_at = 0.0
+        self._lock = threading.Lock()
+
+    def bounds(self) -> tuple[int, int]:
+        """Oldest and newest change ids, refreshed at most once per interval."""
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.interval:
+                self._bounds = queries.get_change_bounds()
+                self._checked_at = time.monotonic()
+            return self._bounds
+
+    def has_changes(self, since: int) -> bool:
+        return self.bounds()[1] > since
+
+    def page(self, since: int | None, limit: int, entities: list[str] | None = None) -> dict:
+        """Changes after `since` (0: the oldest retained; None: none, just the cursor)."""
+        # Every change up to here has committed; pages never read past it
+        settled = settled_cursor()
+        if since is None:
+            return {"changes": [], "next": settled, "has_more": False}
+        oldest, _ = self.bounds()
+        if since and oldest > since + 1:
+            raise CursorExpired(settled)
+
+        rows = queries.get_changes(since, limit, entities, settled)
+        has_more = len(rows) == limit
+
+        # Latest change per entity wins; its row is the current one anyway
+        latest = {}
+        for row in rows:
+            latest[(row["entity"], row["entity_id"])] = row
+        changes = sorted(latest.values(), key=lambda row: row["id"])
+        by_entity: dict[str, list[int]] = {}
+        for change in changes:
+            by_entity.setdefault(change["entity"], []).append(change["entity_id"])
+        data = {
+            entity: queries.get_changed_rows(entity, ids)
+            for entity, ids in by_entity.items()
+        }
+        for change in changes:
+            change["data"] = data[change["entity"]].get(change["entity_id"])
+
+        self._purge()
+        # A short page scanned everything up to `settled`, including changes
+        # the entity filter dropped: move past them, or every poll rescans them
+        return {
+            "changes": changes,
+            "next": rows[-1]["id"] if has_more else max(since, settled),
+            "has_more": has_more,
+        }
+
+    def _purge(self):
+        if time.monotonic() - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = time.monotonic()
+        try:
+            purged = queries.purge_changes(CHANGES_RETENTION)
+            if purged:
+                logger.info("purged %d change_log rows", purged)
+        except Exception:
+            logger.exception("purging change_log failed")
+
+
+# =============================================================================
+# INVALIDATION PUSH
+# =============================================================================
+
+# Sent instead of events a subscriber can no longer get: drop every cached entry
+RESET = b"event: reset\ndata: {}\n\n"
+
+
+def _event(change: dict) -> tuple[str, bytes]:
+    """SSE bytes for one change; the change id is the version and resume cursor."""
+    if change["entity"] == "template":
+        name, data = "template", {"template_id": change["entity_id"], "version": change["id"]}
+    else:
+        name, data = "catalog", {
+            "entity": change["entity"], "id": change["entity_id"], "version": change["id"],
+        }
+    body = json.dumps(data, separators=(",", ":"))
+    return name, f"id: {change['id']}\nevent: {name}\ndata: {body}\n\n".encode()
+
+
+def _encode(rows: list[dict]) -> bytes:
+    """One chunk for a batch of changes, each entity once at its newest version."""
+    latest = {}
+    for row in rows:
+        latest[(row["entity"], row["entity_id"])] = row
+    events = []
+    for change in sorted(latest.values(), key=lambda row: row["id"]):
+        name, event = _event(change)
+        INVALIDATIONS.inc(name)
+        events.append(event)
+    return b"".join(events)
+
+
+class Subscriber:
+    """Pending chunks of one stream; a subscriber too far behind gets RESET."""
+
+    __slots__ = ("chunks", "ready")
+
+    def __init__(self):
+        self.chunks: deque[bytes] = deque()
+        self.ready = asyncio.Event()
+
+    def push(self, chunk: bytes):
+        if len(self.chunks) >= INVALIDATION_BUFFER:
+            self.chunks.clear()
+            chunk = RESET
+        self.chunks.append(chunk)
+        self.ready.set()
+
+    async def next(self, timeout: float) -> Optional[bytes]:
+        """Everything pending as one write, or None after `timeout` idle seconds."""
+        if not self.chunks:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        chunk = b"".join(self.chunks)
+        self.chunks.clear()
+        return chunk
+
+
+class Broadcaster:
+    """Polls change_log once per worker and fans batches out to subscribers.
+
+    Runs as an asyncio task while anyone is subscribed. Recent batches are
+    kept so a client reconnecting with Last-Event-ID resumes without a
+    query; older cursors are replayed from change_log, or get RESET.
+    """
+
+    def __init__(self, interval: float, backlog: int):
+        self.interval = interval
+        self.backlog = backlog
+        self.cursor: Optional[int] = None
+        self._subscribers: set[Subscriber] = set()
+        # (cursor before, cursor after, changes, chunk) per published batch
+        self._recent: deque[tuple[int, int, int, bytes]] = deque()
+        self._recent_changes = 0
+        self._task: Optional[asyncio.Task] = None
+        self._starting = asyncio.Lock()
+
+    async def subscribe(self, last_id: Optional[int]) -> Subscriber:
+        async with self._starting:
+            if self.cursor is None:
+                self.cursor = await run_in_threadpool(settled_cursor)
+            if self._task is None:
+                # Empty context: the poller's queries belong to no request
+                self._task = contextvars.Context().run(asyncio.create_task, self._run())
+        subscriber = Subscriber()
+        # Registered first: every batch published from here on is above `cursor`
+        cursor = self.cursor
+        self._subscribers.add(subscriber)
+        SUBSCRIBERS.set(len(self._subscribers))
+        if last_id is not None and last_id < cursor:
+            missed = await self._replay(last_id, cursor)
+            subscriber.chunks.extendleft(reversed(missed))
+            subscriber.ready.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        SUBSCRIBERS.set(len(self._subscribers))
+
+    async def _replay(self, last_id: int, cursor: int) -> list[bytes]:
+        """Chunks covering (last_id, cursor], oldest first."""
+        if self._recent and self._recent[0][0] <= last_id:
+            return [chunk for _, after, _, chunk in self._recent if after > last_id]
+        oldest, _ = await run_in_threadpool(feed.bounds)
+        if last_id and oldest > last_id + 1:
+            return [RESET]
+        rows = await run_in_threadpool(queries.get_changes, last_id, self.backlog + 1, None, cursor)
+        if len(rows) > self.backlog:
+            return [RESET]
+        return [_encode(rows)] if rows else []
+
+    async def _run(self):
+        try:
+            while self._subscribers:
+                await asyncio.sleep(self.interval)
+                try:
+                    if await run_in_threadpool(feed.has_changes, self.cursor):
+                        await self._publish()
+                except Exception:
+                    logger.exception("publishing invalidations failed")
+        finally:
+            # Nobody listening: the next subscriber starts from a fresh cursor
+            self._task = None
+            self.cursor = None
+            self._recent.clear()
+            self._recent_changes = 0
+
+    async def _publish(self):
+        settled = await run_in_threadpool(settled_cursor)
+        rows = await run_in_threadpool(queries.get_changes, self.cursor, 1000, None, settled)
+        if not rows:
+            return
+        chunk = _encode(rows)
+        self._recent.append((self.cursor, rows[-1]["id"], len(rows), chunk))
+        self._recent_changes += len(rows)
+        while self._recent_changes > self.backlog:
+            self._recent_changes -= self._recent.popleft()[2]
+        self.cursor = rows[-1]["id"]
+        for subscriber in self._subscribers:
+            subscriber.push(chunk)
+
+
+feed = ChangeFeed(CHANGES_POLL_INTERVAL)
+broadcaster = Broadcaster(CHANGES_POLL_INTERVAL, INVALIDATION_BACKLOG)
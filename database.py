@@ -1,9 +1,17 @@
 import os
-import mysql.connector
-from mysql.connector import Error
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
 from fastapi import HTTPException
 from dotenv import load_dotenv
 
+import backends
+import deadlines
+import metrics
+import tracing
+
 load_dotenv()
 
 DB_CONFIG = {
@@ -14,11 +22,761 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME")
 }
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Read replicas: "host[:port],host[:port]" sharing DB_USER/DB_PASSWORD/DB_NAME
+DB_REPLICAS = [r.strip() for r in os.getenv("DB_REPLICAS", "").split(",") if r.strip()]
+# Seconds a failed replica is skipped before being tried again
+DB_REPLICA_COOLDOWN = float(os.getenv("DB_REPLICA_COOLDOWN", "30"))
+# Seconds a read waits for a busy replica before trying the next one
+DB_REPLICA_WAIT = float(os.getenv("DB_REPLICA_WAIT", "0.1"))
+# Seconds after a write during which the same client reads from the primary
+DB_STICKY_SECONDS = float(os.getenv("DB_STICKY_SECONDS", "5"))
+STICKY_COOKIE = "db_primary_until"
+# Concurrent inserts into one table share a transaction (see GroupCommitter);
+# the leader waits DB_GROUP_COMMIT_WINDOW seconds for more before writing
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "1") == "1"
+DB_GROUP_COMMIT_WINDOW = float(os.getenv("DB_GROUP_COMMIT_WINDOW", "0"))
+DB_GROUP_COMMIT_MAX_ROWS = int(os.getenv("DB_GROUP_COMMIT_MAX_ROWS", "5000"))
+# Prepared statements kept per pooled connection (MySQL caps the server-wide
+# total with max_prepared_stmt_count)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "64"))
+
+backend = backends.get_backend()
+
+
+class Error(Exception):
+    """Backend-neutral database error raised by the data layer.
+
+    errno is the MySQL error number; backends.SQLiteBackend maps the
+    constraint violations the data layer distinguishes onto it.
+    """
+
+    def __init__(self, msg: str, errno: int = None):
+        super().__init__(msg)
+        self.errno = errno
+
+
+# Unique key violation: callers map it to 409 Conflict
+ER_DUP_ENTRY = 1062
+
+
+# =============================================================================
+# INSTRUMENTED CONNECTION WRAPPERS
+# =============================================================================
+
+class StatementCache:
+    """LRU of prepared cursors for one raw connection, keyed by SQL text.
+
+    A mysql.connector prepared cursor holds a single server-side statement and
+    re-prepares whenever it is given different SQL, so each distinct statement
+    gets its own cursor. Evicted cursors are closed, deallocating the statement.
+    """
+
+    def __init__(self, raw, size: int):
+        self._raw = raw
+        self._size = size
+        self._cursors: OrderedDict = OrderedDict()
+
+    def get(self, statement: str):
+        cursor = self._cursors.get(statement)
+        metrics.record_cache("prepared_statements", cursor is not None)
+        if cursor is not None:
+            self._cursors.move_to_end(statement)
+            return cursor
+        cursor = self._raw.cursor(prepared=True)
+        self._cursors[statement] = cursor
+        if len(self._cursors) > self._size:
+            _, evicted = self._cursors.popitem(last=False)
+            self._close(evicted)
+        return cursor
+
+    def discard(self, statement: str):
+        cursor = self._cursors.pop(statement, None)
+        if cursor is not None:
+            self._close(cursor)
+
+    def clear(self):
+        while self._cursors:
+            self._close(self._cursors.popitem()[1])
+
+    @staticmethod
+    def _close(cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+class TimedCursor:
+    """Cursor proxy that reports every statement, its time and row count.
+
+    Driver exceptions are re-raised as database.Error so callers do not
+    depend on the backend in use. Given a StatementCache, each execute()
+    runs on the connection's prepared cursor for that SQL text, which stays
+    open in the cache when this proxy is closed; rows come back as tuples.
+    """
+
+    def __init__(self, cursor, backend, statements: StatementCache = None):
+        self._cursor = cursor
+        self._backend = backend
+        self._statements = statements
+        self._record = None
+
+    def _finish(self):
+        if self._record is not None:
+            tracing.finish_statement(self._record)
+            self._record = None
+
+    def execute(self, operation, params=None):
+        self._finish()
+        if self._backend.supports_statement_timeout:
+            statement = deadlines.apply_statement_timeout(
+                operation, bucketed=self._statements is not None
+            )
+        else:
+            deadlines.check()
+            statement = operation
+        if self._statements is not None:
+            self._cursor = self._statements.get(statement)
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(statement, params)
+        except self._backend.errors as e:
+            if self._statements is not None:
+                # The statement or its connection may be unusable; prepare afresh next time
+                self._statements.discard(statement)
+                self._cursor = None
+            errno = self._backend.errno(e)
+            if errno == deadlines.ER_QUERY_TIMEOUT:
+                raise deadlines.DeadlineExceeded("Statement exceeded request deadline") from e
+            raise Error(str(e), errno) from e
+        finally:
+            # Writes report affected rows now; SELECT rows are counted on fetch
+            cursor = self._cursor
+            rows = 0 if cursor is None or cursor.description else max(cursor.rowcount, 0)
+            self._record = tracing.record_statement(
+                operation, params, time.perf_counter() - start, rows
+            )
+
+    def executemany(self, operation, seq_params):
+        self._finish()
+        deadlines.check()
+        if self._statements is not None:
+            self._cursor = self._statements.get(operation)
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params)
+        except self._backend.errors as e:
+            raise Error(str(e), self._backend.errno(e)) from e
+        finally:
+            self._record = tracing.record_statement(
+                operation, None, time.perf_counter() - start, max(self._cursor.rowcount, 0)
+            )
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            row = self._cursor.fetchone()
+        except self._backend.errors as e:
+            raise Error(str(e), self._backend.errno(e)) from e
+        tracing.record_fetch(self._record, time.perf_counter() - start, int(row is not None))
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            rows = self._cursor.fetchall()
+        except self._backend.errors as e:
+            raise Error(str(e), self._backend.errno(e)) from e
+        tracing.record_fetch(self._record, time.perf_counter() - start, len(rows))
+        return rows
+
+    def close(self):
+        self._finish()
+        if self._statements is None:
+            return self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Connection checked out of the pool. close() hands it back."""
+
+    def __init__(self, pool: "ConnectionPool", raw):
+        self._pool = pool
+        self._raw = raw
+
+    def cursor(self, *args, prepared: bool = False, **kwargs):
+        """Cursor over this connection; prepared=True reuses cached prepared statements."""
+        if prepared:
+            return TimedCursor(None, self._pool.backend, self._pool.statements(self._raw))
+        return TimedCursor(self._raw.cursor(*args, **kwargs), self._pool.backend)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            self._raw.commit()
+        except self._pool.backend.errors as e:
+            raise Error(str(e), self._pool.backend.errno(e)) from e
+        finally:
+            tracing.record_sql_time(time.perf_counter() - start)
+
+        if self._pool.is_primary:
+            _stick_to_primary()
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            self._raw.rollback()
+        finally:
+            tracing.record_sql_time(time.perf_counter() - start)
+
+    def close(self):
+        if self._raw is not None:
+            self._pool.release(self._raw)
+            self._raw = None
+
+    def discard(self):
+        """Drop a broken connection instead of returning it to the pool."""
+        if self._raw is not None:
+            self._pool._discard(self._raw)
+            self._raw = None
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+# =============================================================================
+# ROW MAPPING
+# =============================================================================
+
+class RowMapper:
+    """Turns tuple rows into response dicts.
+
+    `columns` names the SELECT list in order; keyword converters (e.g.
+    is_optional=bool for TINYINT flags) are resolved to column positions
+    once, so per-row work is a zip and the conversions themselves.
+    """
+
+    def __init__(self, columns: tuple[str, ...], **converters):
+        unknown = set(converters) - set(columns)
+        if unknown:
+            raise ValueError(f"Converters for unknown columns: {sorted(unknown)}")
+        self.columns = columns
+        self._named = converters
+        self._converters = [(i, converters[name]) for i, name in enumerate(columns) if name in converters]
+        self._subsets: dict[tuple[str, ...], "RowMapper"] = {}
+
+    def select(self, keep) -> "RowMapper":
+        """Mapper for the columns `keep(name)` accepts, in order (sparse fieldsets)."""
+        columns = tuple(name for name in self.columns if keep(name))
+        mapper = self._subsets.get(columns)
+        if mapper is None:
+            converters = {name: f for name, f in self._named.items() if name in columns}
+            mapper = self._subsets[columns] = RowMapper(columns, **converters)
+        return mapper
+
+    def row(self, row) -> dict:
+        if self._converters:
+            row = list(row)
+            for i, convert in self._converters:
+                row[i] = convert(row[i])
+        return dict(zip(self.columns, row))
+
+    def all(self, rows) -> list[dict]:
+        if not self._converters:
+            columns = self.columns
+            return [dict(zip(columns, row)) for row in rows]
+        return [self.row(row) for row in rows]
+
+    def first(self, rows) -> dict | None:
+        return self.row(rows[0]) if rows else None
+
+
+# =============================================================================
+# CONNECTION POOL
+# =============================================================================
+
+class ConnectionPool:
+    """Blocking, bounded pool of backend connections.
+
+    Unlike mysql.connector.pooling, checkout waits (up to `timeout`) for a
+    connection to be returned instead of failing as soon as the pool is empty.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backend,
+        config: dict,
+        size: int,
+        timeout: float,
+        is_primary: bool = True
+    ):
+        self.name = name
+        self.backend = backend
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.is_primary = is_primary
+        self._idle = deque()
+        self._created = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        # id(raw) -> StatementCache; only touched by the thread holding raw
+        self._statements: dict[int, StatementCache] = {}
+
+    @property
+    def in_use(self) -> int:
+        return self._created - len(self._idle)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._created - len(self._idle),
+                "waiting": self._waiting,
+            }
+
+    def statements(self, raw) -> StatementCache:
+        """The prepared statement cache of a checked-out raw connection."""
+        cache = self._statements.get(id(raw))
+        if cache is None:
+            cache = self._statements[id(raw)] = StatementCache(raw, DB_STATEMENT_CACHE_SIZE)
+        return cache
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check out a connection, waiting up to `timeout` (default: the pool's)."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = start + timeout
+        raw = None
+
+        # Never wait past the request's own deadline
+        left = deadlines.remaining()
+        if left is not None:
+            if left <= 0:
+                raise deadlines.DeadlineExceeded("Request deadline exceeded before checkout")
+            deadline = min(deadline, start + left)
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    if left is not None and deadline < start + timeout:
+                        raise deadlines.DeadlineExceeded("Request deadline exceeded waiting for a connection")
+                    raise HTTPException(status_code=503, detail="Database connection pool exhausted")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if raw is None:
+                raw = self.backend.connect(self.config)
+            elif not raw.is_connected():
+                # Server-side statements died with the old session
+                self._drop_statements(raw)
+                raw.reconnect()
+        except self.backend.errors as e:
+            self._discard(raw)
+            raise Error(str(e), self.backend.errno(e)) from e
+        except Exception:
+            self._discard(raw)
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            metrics.POOL_CHECKOUT_WAIT.observe(waited, self.name)
+            tracing.record_connect(waited)
+
+        return PooledConnection(self, raw)
+
+    def prewarm(self, count: int) -> int:
+        """Open up to `count` connections now so early requests skip the connect."""
+        held = []
+        try:
+            while len(held) < min(count, self.size):
+                with self._cond:
+                    if not self._idle and self._created >= self.size:
+                        break
+                held.append(self.acquire())
+        finally:
+            for connection in held:
+                connection.close()
+        return len(held)
+
+    def acquire_idle(self) -> Optional[PooledConnection]:
+        """Check out an already open connection, or None; never connects or waits."""
+        with self._cond:
+            if not self._idle:
+                return None
+            raw = self._idle.pop()
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        try:
+            # End the implicit transaction so the next user gets a fresh snapshot
+            if raw.in_transaction:
+                raw.rollback()
+        except self.backend.errors:
+            self._discard(raw)
+            return
+
+        with self._cond:
+            self._idle.append(raw)
+            self._cond.notify()
+
+    def _drop_statements(self, raw):
+        cache = self._statements.pop(id(raw), None)
+        if cache is not None:
+            cache.clear()
+
+    def _discard(self, raw=None):
+        if raw is not None:
+            self._drop_statements(raw)
+            try:
+                raw.close()
+            except self.backend.errors:
+                pass
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+
+# =============================================================================
+# READ/WRITE ROUTING
+# =============================================================================
+
+class ReplicaSet:
+    """Health-aware load balancing across read replicas.
+
+    Reads go to the healthy replica with the fewest connections in use. A
+    replica whose checkout fails is skipped for DB_REPLICA_COOLDOWN seconds;
+    when none are healthy, reads fall back to the primary.
+    """
+
+    def __init__(self, pools: list[ConnectionPool], cooldown: float):
+        self.pools = pools
+        self.cooldown = cooldown
+        self._down_until = {p.name: 0.0 for p in pools}
+        self._next = 0
+
+    def candidates(self) -> list[ConnectionPool]:
+        now = time.monotonic()
+        healthy = [p for p in self.pools if self._down_until[p.name] <= now]
+        # Rotate before sorting so ties spread across replicas
+        self._next = (self._next + 1) % max(len(healthy), 1)
+        healthy = healthy[self._next:] + healthy[:self._next]
+        return sorted(healthy, key=lambda p: p.in_use)
+
+    def mark_down(self, pool: ConnectionPool):
+        self._down_until[pool.name] = time.monotonic() + self.cooldown
+
+    def is_healthy(self, pool: ConnectionPool) -> bool:
+        return self._down_until[pool.name] <= time.monotonic()
+
+
+def _replica_config(address: str) -> dict:
+    host, _, port = address.partition(":")
+    return {**DB_CONFIG, "host": host, "port": int(port or DB_CONFIG["port"])}
+
+
+pool = ConnectionPool("primary", backend, DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+replicas = ReplicaSet(
+    [
+        ConnectionPool(
+            f"replica:{address}", backend, _replica_config(address),
+            DB_POOL_SIZE, DB_POOL_TIMEOUT, is_primary=False
+        )
+        # Replicas only make sense for a networked server
+        for address in (DB_REPLICAS if backend.name == "mysql" else [])
+    ],
+    DB_REPLICA_COOLDOWN
+)
+
+
+def _stick_to_primary():
+    """Read-your-writes: keep this client on the primary until replicas catch up."""
+    ctx = tracing.current()
+    if ctx is not None and replicas.pools:
+        ctx.primary_until = time.time() + DB_STICKY_SECONDS
+
+
+def _use_primary_for_reads() -> bool:
+    ctx = tracing.current()
+    return ctx is not None and ctx.primary_until > time.time()
+
+
+def get_db_connection(read_only: bool = False):
+    """Check out a pooled database connection. close() returns it to the pool.
+
+    read_only connections come from a replica when any are configured and
+    healthy, unless this client wrote within the last DB_STICKY_SECONDS.
+    A replica that cannot be reached is marked down; one whose pool stays
+    exhausted for DB_REPLICA_WAIT seconds is only skipped. Either way the
+    read moves on to the next replica and finally the primary.
+    """
+    if read_only and replicas.pools and not _use_primary_for_reads():
+        for replica in replicas.candidates():
+            try:
+                connection = replica.acquire(DB_REPLICA_WAIT)
+                metrics.DB_ROUTED.inc(replica.name)
+                return connection
+            except Error:
+                replicas.mark_down(replica)
+            except (HTTPException, deadlines.DeadlineExceeded):
+                # Busy, not broken: 503 pool exhausted or the wait hit the deadline
+                pass
 
-def get_db_connection():
-    """Create and return a database connection."""
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
+        connection = pool.acquire()
+        metrics.DB_ROUTED.inc(pool.name)
         return connection
     except Error as e:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
+
+
+# =============================================================================
+# GROUP COMMIT
+# =============================================================================
+
+MAX_STATEMENT_PARAMS = backend.max_statement_params
+# Errors after which InnoDB has rolled back the whole transaction (deadlock),
+# so retrying rows individually would silently lose the earlier ones
+TRANSACTION_ABORTED = {1213}
+
+
+class _PendingInsert:
+    __slots__ = ("rows", "results", "error", "wake", "lead")
+
+    def __init__(self, rows: list[tuple]):
+        self.rows = rows
+        self.results: Optional[list] = None
+        self.error: Optional[BaseException] = None
+        self.wake = threading.Event()
+        self.lead = False
+
+
+_consecutive_ids: Optional[bool] = None
+
+
+def _multirow_ids_consecutive(cursor) -> bool:
+    """Whether one multi-row INSERT gets consecutive auto-increment ids.
+
+    SQLite has a single writer. InnoDB guarantees it for lock modes 0 and 1;
+    the MySQL 8 default, 2 (interleaved), does not, so rows whose ids are
+    needed are then inserted one by one (still in the shared transaction).
+    """
+    global _consecutive_ids
+    if _consecutive_ids is None:
+        if backend.name != "mysql":
+            _consecutive_ids = True
+        else:
+            cursor.execute("SELECT @@innodb_autoinc_lock_mode")
+            _consecutive_ids = int(cursor.fetchall()[0][0]) in (0, 1)
+    return _consecutive_ids
+
+
+class GroupCommitter:
+    """Merge concurrent inserts into one table into a single transaction.
+
+    The first writer to arrive while no batch is running leads: it takes
+    every queued insert (up to DB_GROUP_COMMIT_MAX_ROWS rows), writes them
+    with multi-row INSERTs and commits once. Writers arriving meanwhile queue
+    for the next batch, which the first of them leads. A lone writer pays no
+    extra latency; concurrent ones share one commit and one log flush.
+
+    A multi-row statement the database rejects is retried row by row in the
+    same transaction, so each caller still gets its own ids and errors.
+    on_write(cursor, rows, results) runs in that transaction before commit.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        columns: tuple[str, ...],
+        returns_ids: bool = True,
+        on_write: Optional[Callable] = None
+    ):
+        self.table = table
+        self.columns = columns
+        self.returns_ids = returns_ids
+        self.on_write = on_write
+        self.rows_per_statement = max(1, MAX_STATEMENT_PARAMS // len(columns))
+        self._statements: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._pending: list[_PendingInsert] = []
+        self._leading = False
+
+    def insert(self, rows: list[tuple]) -> list:
+        """Insert rows; returns, per row, its new id (None if not returns_ids)
+        or the Error that rejected it."""
+        request = _PendingInsert(rows)
+        if not DB_GROUP_COMMIT:
+            self._write([request])
+            return request.results
+
+        with self._lock:
+            self._pending.append(request)
+            if not self._leading:
+                self._leading = request.lead = True
+        while not request.lead:
+            request.wake.wait()
+            if request.results is not None or request.error is not None:
+                break
+        else:
+            self._lead()
+
+        if request.error is not None:
+            if isinstance(request.error, Error):
+                raise Error(str(request.error), request.error.errno) from request.error
+            raise request.error
+        _stick_to_primary()
+        return request.results
+
+    def _lead(self):
+        if DB_GROUP_COMMIT_WINDOW > 0:
+            time.sleep(DB_GROUP_COMMIT_WINDOW)
+        with self._lock:
+            batch, rows = [], 0
+            while self._pending and (not batch or rows + len(self._pending[0].rows) <= DB_GROUP_COMMIT_MAX_ROWS):
+                rows += len(self._pending[0].rows)
+                batch.append(self._pending.pop(0))
+
+        # The batch carries other requests' rows: the leader's deadline must not cut it short
+        ctx = tracing.current()
+        deadline = ctx.deadline if ctx is not None else None
+        if ctx is not None:
+            ctx.deadline = None
+        try:
+            self._write(batch)
+        except BaseException as e:
+            for request in batch:
+                request.error = e
+        finally:
+            if ctx is not None:
+                ctx.deadline = deadline
+            with self._lock:
+                successor = self._pending[0] if self._pending else None
+                if successor is not None:
+                    successor.lead = True
+                else:
+                    self._leading = False
+            for request in batch:
+                request.wake.set()
+            if successor is not None:
+                successor.wake.set()
+
+    def _write(self, batch: list[_PendingInsert]):
+        rows = [row for request in batch for row in request.rows]
+        connection = get_db_connection()
+        cursor = connection.cursor()
+
+        try:
+            results = []
+            for start in range(0, len(rows), self.rows_per_statement):
+                results.extend(self._insert_chunk(cursor, rows[start:start + self.rows_per_statement]))
+            if self.on_write is not None:
+                self.on_write(cursor, rows, results)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+        metrics.GROUP_COMMIT_WRITERS.observe(len(batch), self.table)
+        offset = 0
+        for request in batch:
+            request.results = results[offset:offset + len(request.rows)]
+            offset += len(request.rows)
+
+    def _statement(self, rows: int) -> str:
+        statement = self._statements.get(rows)
+        if statement is None:
+            values = "(" + ", ".join(["%s"] * len(self.columns)) + ")"
+            statement = self._statements[rows] = (
+                f"INSERT INTO {self.table} ({', '.join(self.columns)}) "
+                f"VALUES {', '.join([values] * rows)}"
+            )
+        return statement
+
+    def _insert_chunk(self, cursor, chunk: list[tuple]) -> list:
+        if len(chunk) > 1 and (not self.returns_ids or _multirow_ids_consecutive(cursor)):
+            try:
+                cursor.execute(self._statement(len(chunk)), [value for row in chunk for value in row])
+            except Error as e:
+                if e.errno in TRANSACTION_ABORTED:
+                    raise
+            else:
+                if not self.returns_ids:
+                    return [None] * len(chunk)
+                # MySQL reports the first id of a multi-row INSERT, SQLite the last
+                first = cursor.lastrowid if backend.name == "mysql" else cursor.lastrowid - len(chunk) + 1
+                return list(range(first, first + len(chunk)))
+
+        results = []
+        for row in chunk:
+            try:
+                cursor.execute(self._statement(1), row)
+                results.append(cursor.lastrowid if self.returns_ids else None)
+            except Error as e:
+                if e.errno in TRANSACTION_ABORTED:
+                    raise
+                results.append(e)
+        return results
+
+
+# =============================================================================
+# ASGI MIDDLEWARE
+# =============================================================================
+
+class StickyPrimaryMiddleware:
+    """Carry read-your-writes stickiness across requests in a cookie.
+
+    Must run inside TracingMiddleware, which owns the request context.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        ctx = tracing.current()
+        if scope["type"] != "http" or ctx is None or not replicas.pools:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                for part in value.decode("latin-1").split(";"):
+                    key, _, until = part.strip().partition("=")
+                    if key == STICKY_COOKIE:
+                        try:
+                            ctx.primary_until = float(until)
+                        except ValueError:
+                            pass
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and ctx.primary_until > time.time():
+                cookie = (
+                    f"{STICKY_COOKIE}={ctx.primary_until:.3f}; "
+                    f"Max-Age={int(DB_STICKY_SECONDS) + 1}; Path=/; HttpOnly"
+                )
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", cookie.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
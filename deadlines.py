@@ -0,0 +1,77 @@
+"""
+Request deadlines.
+
+A request's deadline comes from the `X-Request-Timeout-Ms` header (parsed by
+TracingMiddleware) or, failing that, from the route's RequestDeadline
+dependency. The data layer checks it before every statement and connection
+checkout and pushes the remaining budget down to MySQL as a
+MAX_EXECUTION_TIME hint, so work for a client that has given up stops at the
+next query instead of running to completion.
+"""
+
+import math
+import re
+import time
+from typing import Optional
+
+import tracing
+
+# MySQL error raised when MAX_EXECUTION_TIME interrupts a statement
+ER_QUERY_TIMEOUT = 3024
+
+_SELECT_RE = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+class DeadlineExceeded(Exception):
+    """The current request ran out of time; main.py maps this to 504."""
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None if it has no deadline."""
+    ctx = tracing.current()
+    if ctx is None or ctx.deadline is None:
+        return None
+    return ctx.deadline - time.perf_counter()
+
+
+def check():
+    """Raise DeadlineExceeded if the current request's deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def _bucket_ms(ms: int) -> int:
+    """Round down to one of a few values per power of two (at most ~16% shorter)."""
+    return int(2 ** (math.floor(math.log2(ms) * 4) / 4))
+
+
+def apply_statement_timeout(operation: str, bucketed: bool = False) -> str:
+    """Check the deadline and cap a SELECT at the remaining time via an optimizer hint.
+
+    Prepared statements are cached by their SQL text, so with `bucketed` the
+    hint only takes a handful of values instead of changing on every call.
+    """
+    left = remaining()
+    if left is None:
+        return operation
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    if not _SELECT_RE.match(operation):
+        return operation
+    ms = max(1, int(left * 1000))
+    if bucketed:
+        ms = _bucket_ms(ms)
+    return _SELECT_RE.sub(f"SELECT /*+ MAX_EXECUTION_TIME({ms}) */", operation, count=1)
+
+
+class RequestDeadline:
+    """Route dependency applying a default deadline when the client sent none."""
+
+    def __init__(self, default_seconds: float):
+        self.default_seconds = default_seconds
+
+    async def __call__(self):
+        ctx = tracing.current()
+        if ctx is not None and ctx.deadline is None:
+            ctx.deadline = ctx.started + self.default_seconds
@@ -10,6 +10,9 @@ Usage:
     python diet_api_test.py                     # Run all tests
     python diet_api_test.py --benchmark         # Run benchmarks
     python diet_api_test.py --verify-db         # Verify DB connection
+    python diet_api_test.py --verify-db --db-backend sqlite --db-path diet.db
+    python diet_api_test.py --routing           # Replica routing, in-process
+    python diet_api_test.py --admission         # Admission shedding, in-process
 """
 
 import argparse
@@ -47,6 +50,10 @@ class Config:
     db_password: str = "clinic_password"
     db_name: str = "medical_clinic"
 
+    # Storage backend the server runs on: "mysql" or "sqlite" (see seed.py)
+    db_backend: str = "mysql"
+    db_path: str = "diet.db"
+
     # Benchmark Settings
     benchmark_duration: int = 30  # seconds
     benchmark_connections: int = 10
@@ -237,6 +244,33 @@ def test_health_check() -> TestResult:
         )
 
 
+def test_metrics() -> TestResult:
+    """Test /metrics endpoint"""
+    try:
+        resp, elapsed = client.timed_get("/metrics")
+
+        passed = (
+            resp.status_code == 200
+            and "http_request_duration_seconds" in resp.text
+        )
+
+        return TestResult(
+            name="GET /metrics",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else "Expected Prometheus exposition with request histograms",
+        )
+    except Exception as e:
+        return TestResult(
+            name="GET /metrics",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
 def test_list_categories() -> TestResult:
     """Test GET /api/categories"""
     try:
@@ -444,6 +478,122 @@ def test_create_food() -> TestResult:
         )
 
 
+def test_upsert_foods() -> TestResult:
+    """Test POST /api/foods/upsert is idempotent: a re-run changes nothing"""
+    payload = {"foods": [
+        {
+            "category_id": 1,
+            "name": f"Upsert Food {int(time.time())} {i}",
+            "default_portion_grams": 100,
+            "calories_per_100g": 100.0 + i,
+        }
+        for i in range(3)
+    ]}
+
+    try:
+        client.timed_post("/api/foods/upsert", json=payload)
+        resp, elapsed = client.timed_post("/api/foods/upsert", json=payload)
+        data = resp.json() if resp.text else {}
+
+        passed = (
+            resp.status_code == 200
+            and data.get("success") is True
+            and data.get("unchanged") == 3
+            and data.get("inserted") == 0
+        )
+
+        return TestResult(
+            name="POST /api/foods/upsert (re-run)",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else f"Re-run was not a no-op: {data}",
+            data=data,
+        )
+    except Exception as e:
+        return TestResult(
+            name="POST /api/foods/upsert",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
+def test_change_feed() -> TestResult:
+    """Test GET /api/changes returns a food written after the cursor"""
+    name = f"Change Feed Food {int(time.time())}"
+
+    try:
+        cursor = client.get("/api/changes").json()["next"]
+        client.timed_post("/api/foods/upsert", json={"foods": [
+            {"category_id": 1, "name": name, "default_portion_grams": 100}
+        ]})
+        resp, elapsed = client.timed_get("/api/changes", params={"since": cursor, "wait": 5})
+        data = resp.json() if resp.text else {}
+
+        names = [(c.get("data") or {}).get("name") for c in data.get("changes", [])]
+        passed = resp.status_code == 200 and name in names and data.get("next", 0) > cursor
+
+        return TestResult(
+            name="GET /api/changes?since=",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else f"Change not in feed: {data}",
+            data=data,
+        )
+    except Exception as e:
+        return TestResult(
+            name="GET /api/changes?since=",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
+def test_change_feed_entity_filter() -> TestResult:
+    """Test GET /api/changes?entity= moves the cursor past other entities' changes"""
+    name = f"Change Feed Filtered {int(time.time())}"
+
+    try:
+        cursor = client.get("/api/changes").json()["next"]
+        client.timed_post("/api/foods/upsert", json={"foods": [
+            {"category_id": 1, "name": name, "default_portion_grams": 100}
+        ]})
+        # The food change settles within CHANGES_SETTLE (1s on MySQL)
+        for _ in range(10):
+            resp, elapsed = client.timed_get("/api/changes", params={"since": cursor, "entity": "template"})
+            data = resp.json() if resp.text else {}
+            if resp.status_code != 200 or data.get("next", 0) > cursor:
+                break
+            time.sleep(0.5)
+
+        passed = (
+            resp.status_code == 200
+            and data.get("changes") == []
+            and data.get("next", 0) > cursor
+        )
+
+        return TestResult(
+            name="GET /api/changes?entity=template",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else f"Cursor did not move past the food change: {cursor} -> {data}",
+            data=data,
+        )
+    except Exception as e:
+        return TestResult(
+            name="GET /api/changes?entity=template",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
 def test_get_food(food_id: int = 1) -> TestResult:
     """Test GET /api/foods/{id}"""
     try:
@@ -578,6 +728,130 @@ def test_get_template_full(template_id: int = 1) -> TestResult:
         )
 
 
+def test_template_full_filters(template_id: int = 1) -> TestResult:
+    """Test from_day/to_day/meal_type narrow the days and meals returned"""
+    params = {"from_day": 2, "to_day": 3, "meal_type": "lunch"}
+
+    try:
+        resp, elapsed = client.timed_get(f"/api/templates/{template_id}/full", params=params)
+        data = resp.json() if resp.text else {}
+        days = data.get("template", {}).get("days", [])
+        meals = [meal for day in days for meal in day.get("meals", [])]
+
+        passed = (
+            resp.status_code == 200
+            and [day["day_number"] for day in days] == [2, 3]
+            and bool(meals)
+            and all(meal["meal_type"] == "lunch" for meal in meals)
+        )
+        if passed:
+            # An inverted range is a client error, not an empty template
+            inverted = client.get(
+                f"/api/templates/{template_id}/full", params={"from_day": 3, "to_day": 2}
+            )
+            passed = inverted.status_code == 400
+
+        return TestResult(
+            name=f"GET /api/templates/{template_id}/full?from_day=&to_day=&meal_type=",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else "Expected days 2-3 with lunch only, and 400 for from_day > to_day",
+            data=data,
+        )
+    except Exception as e:
+        return TestResult(
+            name=f"GET /api/templates/{template_id}/full?from_day=&to_day=&meal_type=",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
+def test_template_full_fieldsets(template_id: int = 1) -> TestResult:
+    """Test ?fields= returns exactly the selected fields at every level, ids included"""
+    spec = "days.meals.items(food_name,portion_grams_min)"
+
+    try:
+        resp, elapsed = client.timed_get(
+            f"/api/templates/{template_id}/full", params={"fields": spec}
+        )
+        data = resp.json() if resp.text else {}
+        template = data.get("template", {})
+        days = template.get("days", [])
+        meals = [meal for day in days for meal in day.get("meals", [])]
+        items = [item for meal in meals for item in meal.get("items", [])]
+
+        passed = (
+            resp.status_code == 200
+            and set(template) == {"days"}
+            and all(set(day) == {"meals"} for day in days)
+            and all(set(meal) == {"items"} for meal in meals)
+            and bool(items)
+            and all(set(item) == {"food_name", "portion_grams_min"} for item in items)
+        )
+        if passed:
+            # `id` is returned only where it is listed
+            resp = client.get(
+                f"/api/templates/{template_id}/full", params={"fields": "id,days(id,day_number)"}
+            )
+            selected = resp.json().get("template", {})
+            passed = (
+                resp.status_code == 200
+                and set(selected) == {"id", "days"}
+                and all(set(day) == {"id", "day_number"} for day in selected["days"])
+            )
+
+        return TestResult(
+            name=f"GET /api/templates/{template_id}/full?fields=",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else f"Unexpected shape for fields={spec}",
+            data=data,
+        )
+    except Exception as e:
+        return TestResult(
+            name=f"GET /api/templates/{template_id}/full?fields=",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
+def test_template_full_bad_fields(template_id: int = 1) -> TestResult:
+    """Test malformed or unknown ?fields= specs are rejected with 400"""
+    specs = ["days(", "days(nope)", "name(code)", "days,,meals"]
+
+    try:
+        statuses = {}
+        elapsed = 0.0
+        for spec in specs:
+            resp, ms = client.timed_get(f"/api/templates/{template_id}/full", params={"fields": spec})
+            statuses[spec] = resp.status_code
+            elapsed += ms
+
+        passed = all(status == 400 for status in statuses.values())
+
+        return TestResult(
+            name=f"GET /api/templates/{template_id}/full?fields=<bad>",
+            passed=passed,
+            status_code=400 if passed else max(statuses.values()),
+            response_time_ms=elapsed / len(specs),
+            message="" if passed else f"Expected 400 for every spec: {statuses}",
+        )
+    except Exception as e:
+        return TestResult(
+            name=f"GET /api/templates/{template_id}/full?fields=<bad>",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
 def test_create_template() -> TestResult:
     """Test POST /api/templates"""
     payload = {
@@ -689,6 +963,34 @@ def test_benchmark_complex_query() -> TestResult:
         )
 
 
+def test_request_deadline() -> TestResult:
+    """Test a request whose X-Request-Timeout-Ms budget is spent gets 504"""
+    try:
+        resp, elapsed = client.timed_get(
+            "/api/benchmark/complex-query", headers={"X-Request-Timeout-Ms": "0"}
+        )
+        data = resp.json() if resp.text else {}
+
+        passed = resp.status_code == 504 and "deadline" in data.get("detail", "").lower()
+
+        return TestResult(
+            name="GET /api/benchmark/complex-query (X-Request-Timeout-Ms: 0)",
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else f"Expected 504 for an exhausted deadline: {data}",
+            data=data,
+        )
+    except Exception as e:
+        return TestResult(
+            name="GET /api/benchmark/complex-query (X-Request-Timeout-Ms: 0)",
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
 # =============================================================================
 # BENCHMARK FUNCTIONS
 # =============================================================================
@@ -778,6 +1080,35 @@ def run_benchmark(
     return result
 
 
+def bulk_insert_payload(count: int, meal_id: int = None) -> dict:
+    return {
+        "meal_id": meal_id or random.randint(1, 10),
+        "items": [
+            {
+                "food_item_id": random.randint(1, 49),
+                "portion_grams_min": random.randint(50, 100),
+                "portion_grams_max": random.randint(150, 200),
+                "sort_order": i,
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def scrape_metrics() -> Dict[str, float]:
+    """Samples from GET /metrics keyed by name and labels, e.g. 'x_total{a="b"}'."""
+    samples = {}
+    for line in client.get("/metrics").text.splitlines():
+        if line and not line.startswith("#"):
+            key, _, value = line.rpartition(" ")
+            samples[key] = float(value)
+    return samples
+
+
+def metric_delta(before: Dict[str, float], after: Dict[str, float], key: str) -> float:
+    return after.get(key, 0.0) - before.get(key, 0.0)
+
+
 def run_benchmarks():
     """Run all benchmark tests"""
     print("\n" + "=" * 60)
@@ -808,13 +1139,69 @@ def run_benchmarks():
         lambda: client.get(f"/api/templates/{random.randint(1, 3)}/full"),
     ))
 
+    # 5. Concurrent writes - POST /api/benchmark/bulk-insert, through group commit
+    before = scrape_metrics()
+    tracker.add_benchmark(run_benchmark(
+        "POST /api/benchmark/bulk-insert",
+        lambda: client.post("/api/benchmark/bulk-insert", json=bulk_insert_payload(20)),
+    ))
+    after = scrape_metrics()
+    writers = metric_delta(before, after, 'db_group_commit_writers_sum{table="diet_meal_items"}')
+    batches = metric_delta(before, after, 'db_group_commit_writers_count{table="diet_meal_items"}')
+    shed = sum(
+        metric_delta(before, after, f'admission_rejected_total{{limiter="bulk_insert",reason="{reason}"}}')
+        for reason in ("queue_full", "deadline", "timeout")
+    )
+    if batches:
+        print(f"    → {writers / batches:.2f} requests per commit, {shed:.0f} shed with 503")
+
 
 # =============================================================================
 # DATABASE VERIFICATION
 # =============================================================================
 
+DB_TABLES = [
+    "food_categories",
+    "food_items",
+    "diet_templates",
+    "diet_days",
+    "diet_meals",
+    "diet_meal_items",
+]
+
+
+def verify_sqlite_database():
+    """Verify SQLite database file and tables"""
+    import sqlite3
+
+    print("\n" + "=" * 60)
+    print("DATABASE VERIFICATION")
+    print("=" * 60)
+
+    try:
+        conn = sqlite3.connect(f"file:{config.db_path}?mode=ro", uri=True)
+    except sqlite3.Error as e:
+        print(f"\n✗ Could not open SQLite database {config.db_path}: {e}")
+        return False
+
+    print(f"\n✓ Opened SQLite: {config.db_path}")
+    print("\nTable Status:")
+    for table in DB_TABLES:
+        try:
+            count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            print(f"  ✓ {table}: {count} rows")
+        except sqlite3.Error as e:
+            print(f"  ✗ {table}: {e}")
+
+    conn.close()
+    return True
+
+
 def verify_database_connection():
     """Verify MySQL database connection and tables"""
+    if config.db_backend == "sqlite":
+        return verify_sqlite_database()
+
     try:
         import mysql.connector
     except ImportError:
@@ -839,18 +1226,8 @@ def verify_database_connection():
 
         print(f"\n✓ Connected to MySQL: {config.db_host}:{config.db_port}/{config.db_name}")
 
-        # Check tables
-        tables = [
-            "food_categories",
-            "food_items",
-            "diet_templates",
-            "diet_days",
-            "diet_meals",
-            "diet_meal_items",
-        ]
-
         print("\nTable Status:")
-        for table in tables:
+        for table in DB_TABLES:
             try:
                 cursor.execute(f"SELECT COUNT(*) FROM {table}")
                 count = cursor.fetchone()[0]
@@ -868,6 +1245,166 @@ def verify_database_connection():
         return False
 
 
+# =============================================================================
+# READ/WRITE ROUTING
+# =============================================================================
+
+def test_replica_routing() -> TestResult:
+    """Test reads use a replica, skip it while it is busy, and stick to the primary after a write
+
+    Runs the app in-process on two SQLite files: a seeded primary and a copy
+    of it as the replica. Only the replica has the food "Replica Only", so a
+    search for it shows which database served the read.
+    """
+    import os
+    import shutil
+    import sqlite3
+    import subprocess
+    import tempfile
+
+    name = "Read/write routing (SQLite primary + replica)"
+    root = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="diet_routing_")
+    primary_path = os.path.join(workdir, "primary.db")
+    replica_path = os.path.join(workdir, "replica.db")
+    start = time.perf_counter()
+
+    try:
+        subprocess.run(
+            [sys.executable, "seed.py", "--create-schema", "--reset", "--foods", "20", "--templates", "1"],
+            cwd=root, env={**os.environ, "DB_BACKEND": "sqlite", "DB_PATH": primary_path},
+            check=True, capture_output=True,
+        )
+        shutil.copyfile(primary_path, replica_path)
+        with sqlite3.connect(replica_path) as conn:
+            conn.execute("INSERT INTO food_items (category_id, name) VALUES (1, 'Replica Only')")
+
+        # Configure the app before its modules read the environment
+        os.environ.update(DB_BACKEND="sqlite", DB_PATH=primary_path, CATALOG_TTL="0", WARMUP_BUDGET="0")
+        sys.path.insert(0, root)
+        from fastapi.testclient import TestClient
+        import backends
+        import database
+        import main
+
+        replica = database.ConnectionPool(
+            "replica:test", backends.SQLiteBackend(replica_path), {}, 1, 1.0, is_primary=False
+        )
+        database.replicas = database.ReplicaSet([replica], database.DB_REPLICA_COOLDOWN)
+
+        def served_by(http) -> str:
+            resp = http.get("/api/foods", params={"search": "Replica Only"})
+            if resp.status_code != 200:
+                return f"HTTP {resp.status_code}"
+            return "replica" if resp.json()["foods"] else "primary"
+
+        checks = {}
+        http = TestClient(main.app)
+        checks["read served by the replica"] = served_by(http) == "replica"
+
+        held = replica.acquire()
+        try:
+            checks["busy replica: read served by the primary"] = served_by(http) == "primary"
+        finally:
+            held.close()
+        checks["busy replica not marked down"] = database.replicas.is_healthy(replica)
+
+        resp = http.post("/api/foods", json={"category_id": 1, "name": "Routing Write"})
+        checks["write sets the sticky cookie"] = (
+            resp.status_code == 201 and database.STICKY_COOKIE in resp.cookies
+        )
+        checks["reads after the write stay on the primary"] = served_by(http) == "primary"
+        checks["other clients still read the replica"] = served_by(TestClient(main.app)) == "replica"
+
+        failed = [check for check, ok in checks.items() if not ok]
+        return TestResult(
+            name=name,
+            passed=not failed,
+            status_code=resp.status_code,
+            response_time_ms=(time.perf_counter() - start) * 1000,
+            message="" if not failed else f"Failed: {', '.join(failed)}",
+            data=checks,
+        )
+    except Exception as e:
+        return TestResult(
+            name=name,
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# =============================================================================
+# ADMISSION CONTROL
+# =============================================================================
+
+def test_admission_queue_full() -> TestResult:
+    """Test a request arriving at a full admission queue gets 503 with Retry-After
+
+    Runs in-process: every slot and queue place of the complex-query limiter
+    is taken directly, then one request goes through the app.
+    """
+    import asyncio
+    import os
+
+    import httpx
+
+    name = "GET /api/benchmark/complex-query (admission queue full)"
+    os.environ.setdefault("DB_BACKEND", config.db_backend)
+    os.environ.setdefault("DB_PATH", config.db_path)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    async def scenario() -> httpx.Response:
+        limiter = main.complex_query_limiter
+        for _ in range(limiter.max_concurrent):
+            await limiter.acquire()
+        queued = [asyncio.ensure_future(limiter.acquire()) for _ in range(limiter.max_queue)]
+        # Let every waiter join the queue
+        await asyncio.sleep(0)
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://diet.test") as http:
+                return await http.get("/api/benchmark/complex-query")
+        finally:
+            for waiter in queued:
+                waiter.cancel()
+            await asyncio.gather(*queued, return_exceptions=True)
+            for _ in range(limiter.max_concurrent):
+                limiter.release(0.0)
+
+    try:
+        start = time.perf_counter()
+        resp = asyncio.run(scenario())
+        elapsed = (time.perf_counter() - start) * 1000
+        retry_after = resp.headers.get("Retry-After", "")
+
+        passed = (
+            resp.status_code == 503
+            and retry_after.isdigit() and int(retry_after) >= 1
+            and "queue_full" in resp.json().get("detail", "")
+        )
+
+        return TestResult(
+            name=name,
+            passed=passed,
+            status_code=resp.status_code,
+            response_time_ms=elapsed,
+            message="" if passed else f"Expected 503 queue_full with Retry-After: {resp.text}",
+        )
+    except Exception as e:
+        return TestResult(
+            name=name,
+            passed=False,
+            status_code=0,
+            response_time_ms=0,
+            message=str(e),
+        )
+
+
 # =============================================================================
 # MAIN TEST RUNNER
 # =============================================================================
@@ -883,6 +1420,7 @@ def run_all_tests():
     # Health Check
     print("\n[Health Check]")
     tracker.add_result(test_health_check())
+    tracker.add_result(test_metrics())
 
     # Categories Tests
     print("\n[Categories API]")
@@ -897,6 +1435,9 @@ def run_all_tests():
     tracker.add_result(test_list_foods_search())
     tracker.add_result(test_get_food(1))
     tracker.add_result(test_create_food())
+    tracker.add_result(test_upsert_foods())
+    tracker.add_result(test_change_feed())
+    tracker.add_result(test_change_feed_entity_filter())
 
     # Templates Tests
     print("\n[Templates API]")
@@ -904,11 +1445,15 @@ def run_all_tests():
     tracker.add_result(test_list_templates_filtered())
     tracker.add_result(test_get_template(1))
     tracker.add_result(test_get_template_full(1))
+    tracker.add_result(test_template_full_filters(1))
+    tracker.add_result(test_template_full_fieldsets(1))
+    tracker.add_result(test_template_full_bad_fields(1))
     tracker.add_result(test_create_template())
 
     # Benchmark Endpoints Tests
     print("\n[Benchmark Endpoints]")
     tracker.add_result(test_benchmark_complex_query())
+    tracker.add_result(test_request_deadline())
     tracker.add_result(test_benchmark_bulk_insert())
 
 
@@ -930,6 +1475,27 @@ def main():
         action="store_true",
         help="Verify database connection",
     )
+    parser.add_argument(
+        "--db-backend",
+        choices=["mysql", "sqlite"],
+        default=config.db_backend,
+        help=f"Backend checked by --verify-db (default: {config.db_backend})",
+    )
+    parser.add_argument(
+        "--db-path",
+        default=config.db_path,
+        help=f"SQLite database file for --verify-db (default: {config.db_path})",
+    )
+    parser.add_argument(
+        "--routing",
+        action="store_true",
+        help="Check replica routing in-process on two SQLite files (no server needed)",
+    )
+    parser.add_argument(
+        "--admission",
+        action="store_true",
+        help="Check admission shedding in-process (no server needed)",
+    )
     parser.add_argument(
         "--benchmark-only",
         action="store_true",
@@ -954,13 +1520,21 @@ def main():
     config.base_url = args.url
     config.benchmark_duration = args.duration
     config.benchmark_connections = args.connections
+    config.db_backend = args.db_backend
+    config.db_path = args.db_path
     client.base_url = args.url
 
     # Run tests
     if args.verify_db:
         verify_database_connection()
 
-    if not args.benchmark_only:
+    if args.routing:
+        print("\n[Read/Write Routing]")
+        tracker.add_result(test_replica_routing())
+    if args.admission:
+        print("\n[Admission Control]")
+        tracker.add_result(test_admission_queue_full())
+    if not (args.routing or args.admission or args.benchmark_only):
         run_all_tests()
 
     if args.benchmark or args.benchmark_only:
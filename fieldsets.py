@@ -0,0 +1,118 @@
+"""
+Sparse fieldsets for nested responses.
+
+`?fields=` names the fields to return at each level of a nested model:
+
+    name,days(day_number,meals(meal_type,items(food_name,portion_grams_min)))
+    days.meals.items(food_name,portion_grams_min)
+
+`a.b` is shorthand for `a(b)`. A level that appears in the spec returns only
+the fields listed for it (`id` too only if listed); a nested field listed
+without parentheses is returned whole. Repeated paths merge, so `days.day_number,
+days.meals` keeps both. parse() turns the spec into a tree of
+{field: subtree or None}, validated against the pydantic model, which
+queries.py uses to prune its SELECT lists and skip whole levels.
+"""
+
+import re
+import typing
+from typing import Optional
+
+from pydantic import BaseModel
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class FieldsetError(ValueError):
+    """Malformed spec or unknown field; main.py maps this to 400."""
+
+
+def _merge(tree: dict, name: str, subtree: Optional[dict]):
+    if name not in tree:
+        tree[name] = subtree
+    elif tree[name] is None or subtree is None:
+        # A whole subtree wins over any partial selection of it
+        tree[name] = None
+    else:
+        for child, grandchild in subtree.items():
+            _merge(tree[name], child, grandchild)
+
+
+class _Parser:
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.pos = 0
+
+    def error(self, message: str) -> FieldsetError:
+        return FieldsetError(f"{message} at position {self.pos} of fields={self.spec!r}")
+
+    def peek(self) -> str:
+        return self.spec[self.pos] if self.pos < len(self.spec) else ""
+
+    def fields(self) -> dict:
+        tree = {}
+        while True:
+            name, subtree = self.field()
+            _merge(tree, name, subtree)
+            if self.peek() != ",":
+                return tree
+            self.pos += 1
+
+    def field(self) -> tuple[str, Optional[dict]]:
+        match = _NAME.match(self.spec, self.pos)
+        if not match:
+            raise self.error("Expected a field name")
+        self.pos = match.end()
+        if self.peek() == ".":
+            self.pos += 1
+            name, subtree = self.field()
+            return match.group(), {name: subtree}
+        if self.peek() == "(":
+            self.pos += 1
+            subtree = self.fields()
+            if self.peek() != ")":
+                raise self.error("Expected ')'")
+            self.pos += 1
+            return match.group(), subtree
+        return match.group(), None
+
+
+def _nested_model(model: type[BaseModel], name: str) -> Optional[type[BaseModel]]:
+    """The model of a nested field (list[Model] or Model), or None for scalars."""
+    annotation = model.model_fields[name].annotation
+    for candidate in (annotation, *typing.get_args(annotation)):
+        if isinstance(candidate, type) and issubclass(candidate, BaseModel):
+            return candidate
+    return None
+
+
+def _validate(tree: dict, model: type[BaseModel], path: str):
+    for name, subtree in tree.items():
+        if name not in model.model_fields:
+            raise FieldsetError(f"Unknown field {path}{name}")
+        nested = _nested_model(model, name)
+        if subtree is not None:
+            if nested is None:
+                raise FieldsetError(f"{path}{name} has no fields to select")
+            _validate(subtree, nested, f"{path}{name}.")
+
+
+def parse(spec: Optional[str], model: type[BaseModel]) -> Optional[dict]:
+    """Selection tree for `spec`, or None (everything) when it is empty."""
+    if not spec or not spec.strip():
+        return None
+    parser = _Parser(spec.replace(" ", ""))
+    tree = parser.fields()
+    if parser.pos != len(parser.spec):
+        raise parser.error("Unexpected character")
+    _validate(tree, model, "")
+    return tree
+
+
+def keeps(selection: Optional[dict], name: str) -> bool:
+    return selection is None or name in selection
+
+
+def child(selection: Optional[dict], name: str) -> Optional[dict]:
+    """Selection for a nested field (None: all of it); check keeps() first."""
+    return None if selection is None else selection[name]
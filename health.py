@@ -0,0 +1,146 @@
+"""
+Liveness and readiness checks.
+
+/health/live only proves the event loop answers. /health/ready (and /health)
+decides whether this worker should get traffic, from in-memory state:
+
+    warmup      startup warm-up finished (warmup.py)
+    database    last ping per pool; pings reuse an idle pooled connection at
+                most once per HEALTH_PING_INTERVAL seconds and never open one
+                (a pool with nothing idle is busy, which proves it works)
+    pools       size, open, in use and waiting checkouts per pool
+    replicas    replication lag from SHOW REPLICA STATUS; a replica lagging
+                more than DB_MAX_REPLICA_LAG seconds is taken out of read
+                rotation like a failing one
+    catalog     snapshot age and pending local writes (catalog.py)
+    errors      share of 5xx responses over the last minute
+
+The worker is not ready while warming, when the primary ping fails, or when
+more than HEALTH_MAX_ERROR_RATE of at least HEALTH_MIN_REQUESTS recent
+requests failed. Saturated pools and lagging replicas are reported only:
+admission control and replica fallback already handle them, and pulling a
+busy worker out of rotation would push its load onto the others.
+"""
+
+import os
+import threading
+import time
+
+import catalog
+import database
+import metrics
+import warmup
+
+HEALTH_PING_INTERVAL = float(os.getenv("HEALTH_PING_INTERVAL", "5"))
+HEALTH_MAX_ERROR_RATE = float(os.getenv("HEALTH_MAX_ERROR_RATE", "0.5"))
+HEALTH_MIN_REQUESTS = int(os.getenv("HEALTH_MIN_REQUESTS", "20"))
+DB_MAX_REPLICA_LAG = float(os.getenv("DB_MAX_REPLICA_LAG", "30"))
+
+
+def _replica_lag(cursor):
+    """Seconds behind the source, or None if unknown (not a replica, no privilege)."""
+    for statement, column in (
+        ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+        ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),  # MySQL < 8.0.22
+    ):
+        try:
+            cursor.execute(statement)
+        except database.Error:
+            continue
+        row = cursor.fetchone()
+        return row.get(column) if row else None
+    return None
+
+
+class HealthMonitor:
+    """Caches one ping result per pool so probes cost no database round-trip."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pings: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _ping(self, pool: database.ConnectionPool) -> dict:
+        connection = pool.acquire_idle()
+        if connection is None:
+            status = "busy" if pool.in_use else "no connections"
+            return {"status": status, "checked_at": time.time()}
+        start = time.perf_counter()
+        try:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                lag = None
+                if not pool.is_primary and pool.backend.name == "mysql":
+                    lag = _replica_lag(cursor)
+            finally:
+                cursor.close()
+        except Exception as e:
+            connection.discard()
+            return {"status": "error", "error": str(e), "checked_at": time.time()}
+        connection.close()
+        return {
+            "status": "ok",
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            "lag_seconds": lag,
+            "checked_at": time.time(),
+        }
+
+    def pings(self) -> dict[str, dict]:
+        """Latest ping per pool, refreshed when older than the interval.
+
+        Only one probe refreshes at a time; concurrent ones get cached results.
+        """
+        pools = [database.pool, *database.replicas.pools]
+        stale = [p for p in pools if time.time() - self._pings.get(p.name, {}).get("checked_at", 0) >= self.interval]
+        if stale and self._lock.acquire(blocking=False):
+            try:
+                for pool in stale:
+                    result = self._ping(pool)
+                    self._pings[pool.name] = result
+                    lag = result.get("lag_seconds")
+                    if not pool.is_primary and (
+                        result["status"] == "error" or (lag is not None and lag > DB_MAX_REPLICA_LAG)
+                    ):
+                        database.replicas.mark_down(pool)
+            finally:
+                self._lock.release()
+        return {p.name: self._pings.get(p.name, {"status": "unknown"}) for p in pools}
+
+    def readiness(self) -> tuple[bool, dict]:
+        reasons = []
+        if not warmup.warmup.ready:
+            reasons.append("warming up")
+
+        pings = self.pings()
+        if pings[database.pool.name]["status"] == "error":
+            reasons.append("primary database ping failed")
+
+        requests, error_rate = metrics.RECENT_REQUESTS.rate()
+        if requests >= HEALTH_MIN_REQUESTS and error_rate > HEALTH_MAX_ERROR_RATE:
+            reasons.append(f"error rate {error_rate:.0%} over the last {metrics.RECENT_REQUESTS.window}s")
+
+        pools = {}
+        for pool in [database.pool, *database.replicas.pools]:
+            stats = pool.stats()
+            stats["saturated"] = stats["in_use"] >= stats["size"] and stats["waiting"] > 0
+            if not pool.is_primary:
+                stats["in_rotation"] = database.replicas.is_healthy(pool)
+            pools[pool.name] = {**stats, "ping": {
+                k: v for k, v in pings[pool.name].items() if k != "checked_at"
+            }}
+
+        ready = not reasons
+        body = {
+            "status": "ready" if ready else ("warming" if not warmup.warmup.ready else "not ready"),
+            "reasons": reasons,
+            "warmup": warmup.warmup.status(),
+            "pools": pools,
+            "catalog": catalog.catalog.status(),
+            "errors": {"requests": requests, "error_rate": round(error_rate, 4)},
+        }
+        return ready, body
+
+
+monitor = HealthMonitor(HEALTH_PING_INTERVAL)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Index advisor: EXPLAIN every statement queries.py issues and flag bad plans.
+
+Each WORKLOAD entry calls a read function from queries.py under
+tracing.capture_queries(), so dynamically built statements (every filter
+combination of get_all_foods, every level of get_template_full) are
+explained exactly as the API sends them. Plans are reduced to findings:
+
+    full scan <table>   - the table is read without an index
+    filesort            - rows are sorted after reading (MySQL "Using filesort",
+                          SQLite "USE TEMP B-TREE FOR ORDER BY")
+    temporary           - an intermediate temporary table is built
+
+Findings are compared against explain_baseline.json (per backend). --check
+fails when a hot workload gains a finding the baseline does not accept, so
+a dropped index or a rewritten query shows up before it ships. Plans depend
+on table sizes; run against a seeded dataset such as `seed.py --scale medium`.
+
+Usage:
+    python index_advisor.py                     # report
+    python index_advisor.py --check             # exit 1 on hot-query regressions
+    python index_advisor.py --update-baseline   # accept the current plans
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import queries
+import tracing
+from database import backend, get_db_connection
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "explain_baseline.json")
+
+# (name, hot, call). Hot workloads fail --check on regressions; the rest are
+# reported only.
+WORKLOAD = [
+    ("foods_all", True, lambda: queries.get_all_foods()),
+    ("foods_by_category", True, lambda: queries.get_all_foods(category_id=1)),
+    ("foods_snacks_by_category", True, lambda: queries.get_all_foods(category_id=1, snack_only=True)),
+    ("foods_search", False, lambda: queries.get_all_foods(search="chicken")),
+    ("food_by_id", True, lambda: queries.get_food_by_id(1)),
+    ("categories_all", False, lambda: queries.get_all_categories()),
+    ("category_by_id", False, lambda: queries.get_category_by_id(1)),
+    ("templates_all", False, lambda: queries.get_all_templates()),
+    ("templates_by_segment_type", False, lambda: queries.get_all_templates(segment="A", type="SCR")),
+    ("template_by_id", True, lambda: queries.get_template_by_id(1)),
+    ("template_full", True, lambda: queries.get_template_full(1)),
+    ("template_full_day_meal", False, lambda: queries.get_template_full(1, 1, 1, ["breakfast", "lunch"])),
+    ("nutritional_stats", False, lambda: queries.get_nutritional_stats_by_category()),
+]
+
+
+# =============================================================================
+# PLAN ANALYSIS
+# =============================================================================
+
+def _mysql_findings(plan: list[dict]) -> set[str]:
+    findings = set()
+    for row in plan:
+        extra = row.get("Extra") or ""
+        if row.get("type") == "ALL":
+            findings.add(f"full scan {row.get('table')}")
+        if "Using filesort" in extra:
+            findings.add("filesort")
+        if "Using temporary" in extra:
+            findings.add("temporary")
+    return findings
+
+
+def _sqlite_findings(plan: list[dict]) -> set[str]:
+    findings = set()
+    for row in plan:
+        detail = row["detail"]
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            findings.add(f"full scan {detail.split()[1]}")
+        if detail.startswith("USE TEMP B-TREE FOR ORDER BY"):
+            findings.add("filesort")
+        elif detail.startswith("USE TEMP B-TREE"):
+            findings.add("temporary")
+    return findings
+
+
+def explain(cursor, sql: str, params) -> tuple[list[dict], set[str]]:
+    """Return (plan rows, findings) for one statement on the configured backend."""
+    if backend.name == "mysql":
+        cursor.execute("EXPLAIN " + sql, params)
+        plan = cursor.fetchall()
+        return plan, _mysql_findings(plan)
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    plan = cursor.fetchall()
+    return plan, _sqlite_findings(plan)
+
+
+def analyze() -> list[dict]:
+    """Run the workload and EXPLAIN each distinct SELECT it issued."""
+    captured = []
+    for name, hot, call in WORKLOAD:
+        with tracing.capture_queries() as ctx:
+            call()
+        captured.append((name, hot, ctx.statements))
+
+    results = []
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(dictionary=True)
+    try:
+        for name, hot, statements in captured:
+            seen = set()
+            for record in statements:
+                normalized, _ = tracing.fingerprint(record.sql)
+                if normalized in seen or not normalized.upper().startswith("SELECT"):
+                    continue
+                seen.add(normalized)
+                plan, findings = explain(cursor, record.sql, record.params)
+                results.append({
+                    "workload": name,
+                    "hot": hot,
+                    "sql": normalized,
+                    "plan": plan,
+                    "findings": sorted(findings),
+                })
+        return results
+    finally:
+        cursor.close()
+        connection.close()
+
+
+# =============================================================================
+# BASELINE
+# =============================================================================
+
+def _key(result: dict) -> str:
+    return f"{result['workload']}: {result['sql']}"
+
+
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results: list[dict]):
+    baseline = load_baseline()
+    baseline[backend.name] = {_key(r): r["findings"] for r in results}
+    with open(BASELINE_PATH, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def regressions(results: list[dict], accepted: dict) -> list[tuple[dict, list[str]]]:
+    """Hot statements with findings the baseline does not accept.
+
+    A statement missing from the baseline (new or rewritten SQL) must be
+    clean to pass.
+    """
+    failed = []
+    for result in results:
+        if not result["hot"]:
+            continue
+        new = sorted(set(result["findings"]) - set(accepted.get(_key(result), ())))
+        if new:
+            failed.append((result, new))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN the queries.py workload and flag bad plans")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--check", action="store_true", help="Exit 1 if a hot query regressed")
+    group.add_argument("--update-baseline", action="store_true", help="Accept the current findings")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Print full plans")
+    args = parser.parse_args()
+
+    results = analyze()
+    accepted = load_baseline().get(backend.name, {})
+
+    print(f"EXPLAIN on {backend.name}: {len(results)} statements from {len(WORKLOAD)} workloads\n")
+    for result in results:
+        status = "ok" if not result["findings"] else ", ".join(result["findings"])
+        marker = "*" if result["hot"] else " "
+        print(f"{marker} {result['workload']:<28} {status}")
+        print(f"    {result['sql'][:120]}")
+        if args.verbose:
+            for row in result["plan"]:
+                print(f"      {json.dumps(row, default=str)}")
+    print("\n(* = hot query, checked against the baseline)")
+
+    if args.update_baseline:
+        save_baseline(results)
+        print(f"Baseline for {backend.name} written to {BASELINE_PATH}")
+        return
+
+    failed = regressions(results, accepted)
+    if failed:
+        print(f"\n{len(failed)} hot statement(s) regressed:")
+        for result, new in failed:
+            print(f"  {result['workload']}: {', '.join(new)}")
+            print(f"    {result['sql'][:120]}")
+    if args.check:
+        if not accepted:
+            print(f"\nNo {backend.name} baseline; run with --update-baseline first")
+            sys.exit(2)
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
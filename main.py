@@ -1,20 +1,126 @@
-from fastapi import FastAPI, HTTPException, Query
-from mysql.connector import Error
+import asyncio
+import json
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Path, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from typing import Optional
 
+import admission
+import catalog
+import changes
+import database
+import deadlines
+import fieldsets
+import health
+import metrics
 import queries
+import tracing
+import warmup
+from database import Error
 from models import (
     FoodListResponse, FoodItemResponse,
     CategoryListResponse, CategoryResponse,
-    TemplateListResponse, TemplateResponse, TemplateFullResponse,
-    CategoryCreate, FoodCreate, TemplateCreate, BulkInsertRequest
+    TemplateListResponse, TemplateResponse, TemplateFull, TemplateFullResponse,
+    CategoryCreate, FoodCreate, TemplateCreate, BulkInsertRequest,
+    FoodUpsertRequest, MealItemUpsertRequest, UpsertResponse
 )
 
+
+# The write-behind queue once the lifespan starts it (WRITE_BEHIND=1);
+# writebehind.py and its journal are not even imported otherwise.
+write_queue = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm pools and caches in the background; /health/ready reports when done."""
+    global write_queue
+    warmup.warmup.start()
+    if os.getenv("WRITE_BEHIND", "0") == "1":
+        import writebehind
+        writebehind.queue.start()
+        write_queue = writebehind.queue
+    yield
+    if write_queue is not None:
+        write_queue.drain(timeout=5.0)
+
+
 app = FastAPI(
     title="Diet Simulator API",
     description="API for managing diet plans and food items",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
+app.add_middleware(database.StickyPrimaryMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Default deadlines for heavy routes; clients can send X-Request-Timeout-Ms.
+template_full_deadline = deadlines.RequestDeadline(5.0)
+complex_query_deadline = deadlines.RequestDeadline(5.0)
+bulk_insert_deadline = deadlines.RequestDeadline(10.0)
+
+# Admission control: heavy routes get a concurrency cap and a short queue so
+# they cannot take every worker thread (40 by default) and pooled connection,
+# leaving room for cheap endpoints.
+template_full_limiter = admission.AdmissionLimiter.from_env(
+    "template_full", max_concurrent=4, max_queue=16, max_wait=2.0
+)
+complex_query_limiter = admission.AdmissionLimiter.from_env(
+    "complex_query", max_concurrent=2, max_queue=8, max_wait=2.0
+)
+# With group commit a bulk insert waits in the committer without a pooled
+# connection (only each batch's leader holds one), and a cap of 2 would leave
+# it nothing to merge; the limit then only bounds worker threads.
+bulk_insert_limiter = admission.AdmissionLimiter.from_env(
+    "bulk_insert",
+    max_concurrent=16 if database.DB_GROUP_COMMIT else 2,
+    max_queue=64 if database.DB_GROUP_COMMIT else 8,
+    max_wait=5.0,
+)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Guard for /admin endpoints. Disabled entirely unless ADMIN_TOKEN is set."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def catalog_snapshot():
+    """The catalog snapshot if it is enabled and current, else None (use queries.py)."""
+    return catalog.catalog.current() if catalog.catalog.enabled else None
+
+
+def json_body(body) -> Response:
+    """Response for a pre-serialized snapshot body."""
+    return Response(content=bytes(body), media_type="application/json")
+
+
+def queue_write(operation: str, kwargs: dict) -> JSONResponse:
+    """Accept a write into the write-behind queue: 202 with a ticket to poll."""
+    ticket = write_queue.submit(operation, kwargs)
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "queued": True,
+        "ticket": ticket,
+        "status_url": f"/api/writes/{ticket}",
+    })
+
+
+@app.exception_handler(deadlines.DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc):
+    """The client can no longer use the answer; work was abandoned at the last query."""
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 
 # =============================================================================
@@ -29,20 +135,38 @@ def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "liveness": "/health/live",
+            "readiness": "/health/ready",
             "foods": "/api/foods",
             "categories": "/api/categories",
             "templates": "/api/templates",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
 
 
+@app.get("/health/live")
+def liveness():
+    """Liveness probe: the worker is up. Never touches the database."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
 @app.get("/health")
-def health_check():
-    """Health check endpoint."""
-    if queries.check_db_connection():
-        return {"status": "healthy", "database": "connected"}
-    return {"status": "unhealthy", "database": "disconnected"}
+def readiness():
+    """Readiness probe from in-memory state; 503 while warming or failing."""
+    ready, body = health.monitor.readiness()
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 # =============================================================================
@@ -57,7 +181,11 @@ def list_foods(
 ):
     """Get all food items with optional filters."""
     try:
-        foods = queries.get_all_foods(category_id, snack_only, search)
+        snapshot = catalog_snapshot() if catalog.can_serve(search) else None
+        if snapshot is not None:
+            foods = snapshot.foods(category_id, snack_only, search)
+        else:
+            foods = queries.get_all_foods(category_id, snack_only, search)
         return FoodListResponse(success=True, count=len(foods), foods=foods)
     except Error as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -67,7 +195,11 @@ def list_foods(
 def get_food(food_id: int):
     """Get a specific food item by ID."""
     try:
-        food = queries.get_food_by_id(food_id)
+        snapshot = catalog_snapshot()
+        food = snapshot.food(food_id) if snapshot is not None else None
+        if not food:
+            # Not in the snapshot yet (e.g. created on another worker)
+            food = queries.get_food_by_id(food_id)
         if not food:
             raise HTTPException(status_code=404, detail="Food item not found")
         return FoodItemResponse(success=True, data=food)
@@ -78,6 +210,8 @@ def get_food(food_id: int):
 @app.post("/api/foods", status_code=201)
 def create_food(food: FoodCreate):
     """Create a new food item."""
+    if write_queue is not None:
+        return queue_write("create_food", food.model_dump())
     try:
         new_id = queries.create_food(
             category_id=food.category_id,
@@ -91,8 +225,15 @@ def create_food(food: FoodCreate):
             fiber_per_100g=food.fiber_per_100g,
             is_snack_suitable=food.is_snack_suitable
         )
+        catalog.catalog.invalidate()
         return {"success": True, "data": {"id": new_id, **food.model_dump()}}
     except Error as e:
+        if e.errno == database.ER_DUP_ENTRY:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Category {food.category_id} already has a food named {food.name!r}; "
+                       "use POST /api/foods/upsert to update it"
+            )
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -104,6 +245,9 @@ def create_food(food: FoodCreate):
 def list_categories():
     """Get all food categories."""
     try:
+        snapshot = catalog_snapshot()
+        if snapshot is not None:
+            return json_body(snapshot.categories_json)
         categories = queries.get_all_categories()
         return CategoryListResponse(success=True, count=len(categories), categories=categories)
     except Error as e:
@@ -125,6 +269,8 @@ def get_category(category_id: int):
 @app.post("/api/categories", status_code=201)
 def create_category(category: CategoryCreate):
     """Create a new food category."""
+    if write_queue is not None:
+        return queue_write("create_category", category.model_dump())
     try:
         new_id = queries.create_category(
             name=category.name,
@@ -132,6 +278,7 @@ def create_category(category: CategoryCreate):
             color=category.color,
             sort_order=category.sort_order
         )
+        catalog.catalog.invalidate()
         return {"success": True, "data": {"id": new_id, **category.model_dump()}}
     except Error as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -166,13 +313,43 @@ def get_template(template_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/templates/{template_id}/full", response_model=TemplateFullResponse)
-def get_template_full(template_id: int):
-    """Get full diet template with days, meals, and food items."""
+@app.get(
+    "/api/templates/{template_id}/full",
+    response_model=TemplateFullResponse,
+    dependencies=[Depends(template_full_deadline), Depends(template_full_limiter)]
+)
+def get_template_full(
+    template_id: int,
+    from_day: Optional[int] = Query(None, ge=1, description="First day_number to include"),
+    to_day: Optional[int] = Query(None, ge=1, description="Last day_number to include"),
+    meal_type: Optional[list[str]] = Query(None, description="Only meals of these types"),
+    fields: Optional[str] = Query(
+        None, max_length=1000, description="Sparse fieldset, e.g. days.meals.items(food_name,portion_grams_min)"
+    )
+):
+    """Get full diet template with days, meals, and food items.
+
+    Filtered or sparse requests skip the catalog snapshot, which holds whole
+    templates, and read only the selected days, meals and columns.
+    """
+    if from_day is not None and to_day is not None and from_day > to_day:
+        raise HTTPException(status_code=400, detail="from_day must not be after to_day")
+    try:
+        selection = fieldsets.parse(fields, TemplateFull)
+    except fieldsets.FieldsetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filtered = from_day is not None or to_day is not None or bool(meal_type)
     try:
-        template = queries.get_template_full(template_id)
+        if catalog.catalog.enabled and not filtered and selection is None:
+            body = catalog.catalog.template_json(template_id)
+            if body is not None:
+                return json_body(body)
+        template = queries.get_template_full(template_id, from_day, to_day, meal_type, selection)
         if not template:
             raise HTTPException(status_code=404, detail="Template not found")
+        if selection is not None:
+            # Pruned dicts do not satisfy the response model's required fields
+            return JSONResponse(content=jsonable_encoder({"success": True, "template": template}))
         return TemplateFullResponse(success=True, template=template)
     except Error as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -181,6 +358,8 @@ def get_template_full(template_id: int):
 @app.post("/api/templates", status_code=201)
 def create_template(template: TemplateCreate):
     """Create a new diet template."""
+    if write_queue is not None:
+        return queue_write("create_template", template.model_dump())
     try:
         new_id = queries.create_template(
             code=template.code,
@@ -192,16 +371,242 @@ def create_template(template: TemplateCreate):
             calories_target=template.calories_target,
             notes=template.notes
         )
+        catalog.catalog.templates_changed([new_id])
         return {"success": True, "data": {"id": new_id, **template.model_dump()}}
     except Error as e:
+        if e.errno == database.ER_DUP_ENTRY:
+            raise HTTPException(status_code=409, detail=f"Template code {template.code!r} already exists")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# =============================================================================
+# BULK UPSERTS
+# =============================================================================
+
+@app.post("/api/foods/upsert", response_model=UpsertResponse)
+def upsert_foods(request: FoodUpsertRequest):
+    """Insert or update foods by (category_id, name); safe to re-run."""
+    try:
+        counts = queries.upsert_foods([food.model_dump() for food in request.foods])
+        if counts["inserted"] or counts["updated"]:
+            catalog.catalog.invalidate()
+        return UpsertResponse(success=True, **counts)
+    except Error as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/meal-items/upsert", response_model=UpsertResponse)
+def upsert_meal_items(request: MealItemUpsertRequest):
+    """Insert or update meal items by (meal_id, food_item_id, sort_order); safe to re-run."""
+    try:
+        counts, meal_ids = queries.upsert_meal_items([item.model_dump() for item in request.items])
+        if meal_ids and catalog.catalog.enabled:
+            catalog.catalog.templates_changed(queries.get_meal_template_ids(sorted(meal_ids)))
+        return UpsertResponse(success=True, **counts)
+    except Error as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# =============================================================================
+# CHANGE FEED
+# =============================================================================
+
+def change_entities(entity: Optional[list[str]] = Query(None, description="Only these entity types")):
+    if entity:
+        unknown = set(entity) - set(queries.CHANGE_ENTITIES)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown entity: {', '.join(sorted(unknown))}")
+    return entity
+
+
+async def wait_for_changes(since: int, until: float) -> bool:
+    """Sleep until the shared probe sees a change after `since`, or until `until`."""
+    while time.monotonic() < until:
+        pause = min(changes.CHANGES_POLL_INTERVAL, max(until - time.monotonic(), 0))
+        await asyncio.sleep(pause)
+        tracing.record_idle(pause)
+        if await run_in_threadpool(changes.feed.has_changes, since):
+            return True
+    return False
+
+
+@app.get("/api/changes")
+async def list_changes(
+    since: Optional[int] = Query(None, ge=0, description="Cursor from the previous page; 0 for the oldest retained change"),
+    limit: int = Query(500, ge=1, le=5000),
+    wait: float = Query(0, ge=0, le=changes.MAX_WAIT, description="Long-poll up to this many seconds"),
+    entities: Optional[list[str]] = Depends(change_entities)
+):
+    """Foods, categories and templates changed after a cursor, with their current rows.
+
+    Without `since`, returns only the current cursor: download in full, then
+    follow the feed from there.
+    """
+    left = deadlines.remaining()
+    if left is not None:
+        wait = min(wait, max(left - 1, 0))
+    until = time.monotonic() + wait
+    try:
+        while True:
+            page = await run_in_threadpool(changes.feed.page, since, limit, entities)
+            if page["changes"] or since is None:
+                return {"success": True, **page}
+            # Changes the entity filter dropped still move the cursor
+            since = page["next"]
+            if not await wait_for_changes(since, until):
+                return {"success": True, **page}
+    except changes.CursorExpired as e:
+        return JSONResponse(status_code=410, content={"detail": str(e), "next": e.cursor})
+    except Error as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="Cursor to resume from; default: now"),
+    entities: Optional[list[str]] = Depends(change_entities),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-sent events: one `change` event per changed entity; the event id is the cursor."""
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def events():
+        tracing.expect_repeated_statements()
+        cursor = since
+        try:
+            if cursor is None:
+                cursor = (await run_in_threadpool(changes.feed.page, None, 1))["next"]
+            yield f"retry: 2000\nid: {cursor}\n\n"
+            sent_at = time.monotonic()
+            while not await request.is_disconnected():
+                page = await run_in_threadpool(changes.feed.page, cursor, 500, entities)
+                for change in page["changes"]:
+                    data = json.dumps(jsonable_encoder(change), separators=(",", ":"))
+                    yield f"id: {change['id']}\nevent: change\ndata: {data}\n\n"
+                    sent_at = time.monotonic()
+                if not page["changes"] and page["next"] != cursor:
+                    # Only filtered-out changes: a reconnect resumes past them
+                    yield f"id: {page['next']}\n\n"
+                cursor = page["next"]
+                if page["has_more"]:
+                    continue
+                # Changes filtered out by `entities` wake us without an event
+                if time.monotonic() - sent_at >= changes.HEARTBEAT:
+                    yield ": keep-alive\n\n"
+                    sent_at = time.monotonic()
+                await wait_for_changes(cursor, sent_at + changes.HEARTBEAT)
+        except changes.CursorExpired as e:
+            yield f"event: expired\ndata: {json.dumps({'detail': str(e), 'next': e.cursor})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.get("/api/invalidations")
+async def stream_invalidations(
+    since: Optional[int] = Query(None, ge=0, description="Version to resume after; default: now"),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-sent events naming templates (`template`) and foods or categories
+    (`catalog`) that changed, with their new version; `reset` means drop everything."""
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    subscriber = await changes.broadcaster.subscribe(since)
+
+    async def events():
+        try:
+            yield f"retry: 2000\nid: {since if since is not None else changes.broadcaster.cursor}\n\n"
+            while True:
+                waited = time.monotonic()
+                chunk = await subscriber.next(changes.HEARTBEAT)
+                tracing.record_idle(time.monotonic() - waited)
+                yield chunk if chunk is not None else b": keep-alive\n\n"
+        finally:
+            changes.broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+# =============================================================================
+# WRITE-BEHIND
+# =============================================================================
+
+@app.get("/api/writes/{ticket}")
+def get_write_status(ticket: str = Path(..., pattern="^[0-9a-f]{32}$")):
+    """Status of a write accepted with 202: queued, pending, done or failed."""
+    import writebehind
+
+    try:
+        # Tickets from an earlier run are in the ledger even with the queue off
+        status = writebehind.queue.status(ticket)
+    except Error as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    code = 200 if status["status"] in ("done", "failed") else 202
+    return JSONResponse(status_code=code, content={"success": True, **status})
+
+
+# =============================================================================
+# ADMIN
+# =============================================================================
+
+@app.post(
+    "/admin/profile",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_admin)],
+    include_in_schema=False
+)
+async def profile_worker(
+    mode: str = Query("wall", description="Sampling mode: wall or cpu"),
+    duration: float = Query(10.0, gt=0, description="Maximum seconds to sample"),
+    requests: Optional[int] = Query(None, ge=1, description="Stop after this many requests"),
+    interval_ms: float = Query(10.0, ge=1, le=1000, description="Sampling interval")
+):
+    """Sample this worker and return a flamegraph-compatible collapsed-stack file."""
+    import profiler
+
+    try:
+        session = profiler.start_session(
+            mode=mode,
+            duration=duration,
+            max_requests=requests,
+            interval=interval_ms / 1000
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    try:
+        while not session.finished:
+            await asyncio.sleep(0.05)
+    finally:
+        profiler.end_session(session)
+
+    return PlainTextResponse(
+        session.collapsed(),
+        headers={
+            "X-Profile-Mode": session.mode,
+            "X-Profile-Samples": str(session.samples),
+            "X-Profile-Requests": str(session.requests_seen),
+        }
+    )
+
+
 # =============================================================================
 # BENCHMARK ENDPOINTS
 # =============================================================================
 
-@app.get("/api/benchmark/complex-query")
+@app.get(
+    "/api/benchmark/complex-query",
+    dependencies=[Depends(complex_query_deadline), Depends(complex_query_limiter)]
+)
 def benchmark_complex_query():
     """Complex query for benchmarking - aggregates nutritional data by category."""
     try:
@@ -211,12 +616,20 @@ def benchmark_complex_query():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/benchmark/bulk-insert", status_code=201)
+@app.post(
+    "/api/benchmark/bulk-insert",
+    status_code=201,
+    dependencies=[Depends(bulk_insert_deadline), Depends(bulk_insert_limiter)]
+)
 def benchmark_bulk_insert(request: BulkInsertRequest):
     """Bulk insert meal items for benchmarking."""
+    items = [item.model_dump() for item in request.items]
+    if write_queue is not None:
+        return queue_write("bulk_insert_meal_items", {"meal_id": request.meal_id, "items": items})
     try:
-        items = [item.model_dump() for item in request.items]
         inserted = queries.bulk_insert_meal_items(request.meal_id, items)
+        if inserted and catalog.catalog.enabled:
+            catalog.catalog.templates_changed([queries.get_meal_template_id(request.meal_id)])
         return {
             "success": True,
             "inserted_count": inserted,
@@ -227,5 +640,6 @@ def benchmark_bulk_insert(request: BulkInsertRequest):
 
 
 if __name__ == "__main__":
+    # Single-process dev server; serve.py runs one worker per CPU
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
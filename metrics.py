@@ -0,0 +1,283 @@
+"""
+Server-side metrics in the Prometheus text exposition format.
+
+A deliberately small registry (no prometheus_client dependency) tuned for the
+request hot path: one lock per metric, label values as plain tuples, and
+histogram buckets located with bisect.
+"""
+
+import bisect
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+# =============================================================================
+# METRIC TYPES
+# =============================================================================
+
+class Counter:
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def get(self, *label_values) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}"
+            for k, v in items
+        ]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, *label_values, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+
+        lines = []
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class RecentRate:
+    """Requests and server errors over the last `window` seconds.
+
+    Not exported; readiness checks read it to notice a worker that is up but
+    failing. One bucket per second, reused round-robin.
+    """
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._seconds = [0] * window
+        self._totals = [0] * window
+        self._errors = [0] * window
+        self._lock = threading.Lock()
+
+    def record(self, error: bool):
+        now = int(time.monotonic())
+        i = now % self.window
+        with self._lock:
+            if self._seconds[i] != now:
+                self._seconds[i], self._totals[i], self._errors[i] = now, 0, 0
+            self._totals[i] += 1
+            if error:
+                self._errors[i] += 1
+
+    def rate(self) -> tuple[int, float]:
+        """(requests, error fraction) within the window."""
+        oldest = int(time.monotonic()) - self.window
+        with self._lock:
+            live = [i for i in range(self.window) if self._seconds[i] > oldest]
+            total = sum(self._totals[i] for i in live)
+            errors = sum(self._errors[i] for i in live)
+        return total, (errors / total if total else 0.0)
+
+
+class Registry:
+    """Collection of metrics rendered together on /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status code",
+    ("method", "route", "status"),
+))
+HTTP_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route"),
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served",
+))
+QUERY_DURATION = registry.register(Histogram(
+    "db_function_duration_seconds",
+    "Time spent in queries.py functions, split into connect, db and python phases",
+    ("function", "phase"),
+))
+QUERY_ERRORS = registry.register(Counter(
+    "db_function_errors_total", "queries.py calls that raised", ("function",),
+))
+STATEMENT_DURATION = registry.register(Histogram(
+    "db_statement_duration_seconds",
+    "Execute plus fetch time per SQL statement, labelled by verb and table",
+    ("statement",),
+))
+STATEMENT_ROWS = registry.register(Counter(
+    "db_statement_rows_total", "Rows fetched or affected per SQL statement", ("statement",),
+))
+QUERIES_PER_REQUEST = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements issued per HTTP request",
+    ("route",), buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+))
+N_PLUS_ONE = registry.register(Counter(
+    "db_n_plus_one_total",
+    "Requests that repeated one statement more than N_PLUS_ONE_THRESHOLD times",
+    ("route", "statement"),
+))
+POOL_CHECKOUT_WAIT = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    ("pool",),
+))
+DB_ROUTED = registry.register(Counter(
+    "db_connections_routed_total", "Connection checkouts by target (primary or replica)",
+    ("pool",),
+))
+GROUP_COMMIT_WRITERS = registry.register(Histogram(
+    "db_group_commit_writers", "Concurrent inserts merged into one transaction",
+    ("table",), buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+))
+CACHE_REQUESTS = registry.register(Counter(
+    "cache_requests_total", "Cache lookups by result (hit/miss)", ("cache", "result"),
+))
+RECENT_REQUESTS = RecentRate()
+
+
+def route_label(scope) -> str:
+    """Route template of a handled request, e.g. /api/foods/{food_id}."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup; hit ratio is hits / (hits + misses)."""
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+# =============================================================================
+# ASGI MIDDLEWARE
+# =============================================================================
+
+class MetricsMiddleware:
+    """Record latency, status and in-flight count for every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            # Label by route template, not raw path, to keep cardinality bounded
+            path = route_label(scope)
+            method = scope["method"]
+            HTTP_DURATION.observe(elapsed, method, path)
+            HTTP_REQUESTS.inc(method, path, str(status[0]))
+            # Probes answering 503 must not count towards their own error rate
+            if not path.startswith("/health"):
+                RECENT_REQUESTS.record(status[0] >= 500)
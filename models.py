@@ -157,3 +157,23 @@ class BulkInsertItem(BaseModel):
 class BulkInsertRequest(BaseModel):
     meal_id: int
     items: list[BulkInsertItem]
+
+
+# Bulk upsert models
+class FoodUpsertRequest(BaseModel):
+    foods: list[FoodCreate]
+
+
+class MealItemUpsert(BulkInsertItem):
+    meal_id: int
+
+
+class MealItemUpsertRequest(BaseModel):
+    items: list[MealItemUpsert]
+
+
+class UpsertResponse(BaseModel):
+    success: bool
+    inserted: int
+    updated: int
+    unchanged: int
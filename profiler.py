@@ -0,0 +1,142 @@
+"""
+On-demand sampling profiler for a running worker.
+
+A session samples the Python stacks of every thread in this process from a
+background thread and aggregates them into the "collapsed stack" format used
+by flamegraph.pl, speedscope and friends:
+
+    thread;outer_func (file.py:10);inner_func (file.py:42) 17
+
+Modes:
+    wall - every sample counts 1, so idle/blocked stacks show up too
+    cpu  - each sample is weighted by the microseconds of CPU the thread
+           consumed since the previous sample (per-thread CPU clocks, Linux/Unix)
+
+Nothing runs while no session is active; the request path only checks
+whether `active` is None.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+MAX_DURATION_SECONDS = float(os.getenv("PROFILER_MAX_DURATION", "300"))
+
+
+class ProfileSession:
+    """A single profiling run, bounded by duration and/or request count."""
+
+    def __init__(
+        self,
+        mode: str = "wall",
+        duration: float = 10.0,
+        max_requests: Optional[int] = None,
+        interval: float = 0.01,
+    ):
+        if mode not in ("wall", "cpu"):
+            raise ValueError("mode must be 'wall' or 'cpu'")
+        if mode == "cpu" and not hasattr(time, "pthread_getcpuclockid"):
+            raise ValueError("cpu mode requires per-thread CPU clocks (Unix only)")
+
+        self.mode = mode
+        self.duration = min(duration, MAX_DURATION_SECONDS)
+        self.max_requests = max_requests
+        self.interval = interval
+        self.samples = 0
+        self.requests_seen = 0
+        self.stacks: Counter = Counter()
+        self._done = threading.Event()
+        self._cpu_clocks: dict[int, float] = {}
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    # -------------------------------------------------------------------------
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+
+    def request_done(self):
+        self.requests_seen += 1
+        if self.max_requests is not None and self.requests_seen >= self.max_requests:
+            self._done.set()
+
+    @property
+    def finished(self) -> bool:
+        return not self._thread.is_alive()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    # -------------------------------------------------------------------------
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+
+        while not self._done.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                weight = self._weight(ident)
+                if weight:
+                    self.stacks[self._collapse(names.get(ident, str(ident)), frame)] += weight
+            self.samples += 1
+            self._done.wait(self.interval)
+
+        self._done.set()
+
+    def _weight(self, ident: int) -> int:
+        if self.mode == "wall":
+            return 1
+        try:
+            cpu = time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (OSError, OverflowError):
+            return 0
+        previous = self._cpu_clocks.get(ident)
+        self._cpu_clocks[ident] = cpu
+        if previous is None:
+            return 0
+        return int((cpu - previous) * 1_000_000)
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        parts.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(parts))
+
+
+active: Optional[ProfileSession] = None
+_lock = threading.Lock()
+
+
+def start_session(**kwargs) -> ProfileSession:
+    """Start a session; raises RuntimeError if one is already running."""
+    global active
+
+    with _lock:
+        if active is not None and not active.finished:
+            raise RuntimeError("A profiling session is already running")
+        session = ProfileSession(**kwargs)
+        active = session
+    session.start()
+    return session
+
+
+def end_session(session: ProfileSession):
+    """Stop sampling and detach the session from the request path."""
+    global active
+
+    session.stop()
+    with _lock:
+        if active is session:
+            active = None
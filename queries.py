@@ -1,19 +1,110 @@
+import json
+import math
+import time
+import unicodedata
+from decimal import Decimal
 from typing import Optional
-from database import get_db_connection
+
+import database
+import fieldsets
+import schema
+from database import Error, GroupCommitter, RowMapper, get_db_connection
+import tracing
+from tracing import instrument_query
+
+# Reads use prepared statements (cached per pooled connection) returning
+# tuples; these mappers build the response dicts, coercing TINYINT flags.
+FOOD_ROW = RowMapper(
+    (
+        "id", "category_id", "category_name", "name", "description",
+        "default_portion_grams", "calories_per_100g", "protein_per_100g",
+        "carbs_per_100g", "fat_per_100g", "fiber_per_100g",
+        "is_snack_suitable", "status",
+    ),
+    is_snack_suitable=bool, status=bool,
+)
+CATEGORY_ROW = RowMapper(("id", "name", "icon", "color", "sort_order"))
+TEMPLATE_ROW = RowMapper(
+    (
+        "id", "code", "name", "description", "segment", "type",
+        "duration_days", "calories_target", "notes", "status",
+    ),
+    status=bool,
+)
+DAY_ROW = RowMapper(("id", "day_number", "day_name", "notes"))
+MEAL_ROW = RowMapper(("id", "meal_type", "meal_order", "time_suggestion", "notes"))
+MEAL_ITEM_ROW = RowMapper(
+    (
+        "id", "food_item_id", "food_name", "portion_grams_min", "portion_grams_max",
+        "portion_description", "preparation_notes", "is_optional", "sort_order",
+    ),
+    is_optional=bool,
+)
+# SELECT expressions for MEAL_ITEM_ROW in get_template_full
+MEAL_ITEM_SQL = {
+    "id": "dmi.id", "food_item_id": "dmi.food_item_id", "food_name": "fi.name",
+    "portion_grams_min": "dmi.portion_grams_min", "portion_grams_max": "dmi.portion_grams_max",
+    "portion_description": "dmi.portion_description", "preparation_notes": "dmi.preparation_notes",
+    "is_optional": "dmi.is_optional", "sort_order": "dmi.sort_order",
+}
+NUTRITION_ROW = RowMapper(
+    ("category", "food_count", "avg_calories", "avg_protein", "avg_carbs", "avg_fat")
+)
+
+
+def _load_json(value):
+    return json.loads(value) if value is not None else None
+
+
+WRITE_RESULT_ROW = RowMapper(
+    ("ticket", "operation", "result", "error", "completed_at"),
+    result=_load_json,
+)
+
+# Request-path inserts go through group commit: concurrent callers share a
+# transaction and multi-row INSERTs (database.GroupCommitter). Each batch
+# records its changes in change_log before committing.
+FOOD_INSERTS = GroupCommitter("food_items", (
+    "category_id", "name", "description", "default_portion_grams",
+    "calories_per_100g", "protein_per_100g", "carbs_per_100g",
+    "fat_per_100g", "fiber_per_100g", "is_snack_suitable",
+), on_write=lambda cursor, rows, results: _log_inserted(cursor, "food", results))
+CATEGORY_INSERTS = GroupCommitter(
+    "food_categories", ("name", "icon", "color", "sort_order"),
+    on_write=lambda cursor, rows, results: _log_inserted(cursor, "category", results),
+)
+TEMPLATE_INSERTS = GroupCommitter("diet_templates", (
+    "code", "name", "description", "segment", "type",
+    "duration_days", "calories_target", "notes",
+), on_write=lambda cursor, rows, results: _log_inserted(cursor, "template", results))
+MEAL_ITEM_INSERTS = GroupCommitter("diet_meal_items", (
+    "meal_id", "food_item_id", "portion_grams_min", "portion_grams_max",
+    "portion_description", "is_optional", "sort_order",
+), returns_ids=False, on_write=lambda cursor, rows, results: _log_meal_changes(
+    cursor, {row[0] for row, result in zip(rows, results) if not isinstance(result, Error)}
+))
+
+
+def _insert_one(inserts: GroupCommitter, row: tuple) -> int:
+    new_id = inserts.insert([row])[0]
+    if isinstance(new_id, Error):
+        raise new_id
+    return new_id
 
 
 # =============================================================================
 # FOOD QUERIES
 # =============================================================================
 
+@instrument_query
 def get_all_foods(
     category_id: Optional[int] = None,
     snack_only: Optional[bool] = None,
     search: Optional[str] = None
 ) -> list[dict]:
     """Get all food items with optional filters."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -51,23 +142,55 @@ def get_all_foods(
         query += " ORDER BY fc.sort_order, fi.name"
 
         cursor.execute(query, params)
-        foods = cursor.fetchall()
+        return FOOD_ROW.all(cursor.fetchall())
 
-        for food in foods:
-            food["is_snack_suitable"] = bool(food["is_snack_suitable"])
-            food["status"] = bool(food["status"])
+    finally:
+        cursor.close()
+        connection.close()
 
-        return foods
+
+@instrument_query
+def get_food_catalog() -> list[tuple]:
+    """Every food item (any status) as FOOD_ROW tuples, in get_all_foods order.
+
+    Feeds catalog.py, which keeps the rows in columnar form instead of dicts.
+    """
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
+
+    try:
+        query = """
+            SELECT
+                fi.id,
+                fi.category_id,
+                fc.name as category_name,
+                fi.name,
+                fi.description,
+                fi.default_portion_grams,
+                fi.calories_per_100g,
+                fi.protein_per_100g,
+                fi.carbs_per_100g,
+                fi.fat_per_100g,
+                fi.fiber_per_100g,
+                fi.is_snack_suitable,
+                fi.status
+            FROM food_items fi
+            LEFT JOIN food_categories fc ON fi.category_id = fc.id
+            ORDER BY fc.sort_order, fi.name
+        """
+        cursor.execute(query)
+        return cursor.fetchall()
 
     finally:
         cursor.close()
         connection.close()
 
 
+@instrument_query
 def get_food_by_id(food_id: int) -> dict | None:
     """Get a specific food item by ID."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -90,19 +213,36 @@ def get_food_by_id(food_id: int) -> dict | None:
             WHERE fi.id = %s
         """
         cursor.execute(query, (food_id,))
-        food = cursor.fetchone()
-
-        if food:
-            food["is_snack_suitable"] = bool(food["is_snack_suitable"])
-            food["status"] = bool(food["status"])
-
-        return food
+        # fetchall drains the result so the prepared cursor can be reused
+        return FOOD_ROW.first(cursor.fetchall())
 
     finally:
         cursor.close()
         connection.close()
 
 
+def _insert_food(
+    cursor, category_id, name, description, default_portion_grams,
+    calories_per_100g, protein_per_100g, carbs_per_100g,
+    fat_per_100g, fiber_per_100g, is_snack_suitable
+) -> int:
+    query = """
+        INSERT INTO food_items (
+            category_id, name, description, default_portion_grams,
+            calories_per_100g, protein_per_100g, carbs_per_100g,
+            fat_per_100g, fiber_per_100g, is_snack_suitable
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    cursor.execute(query, (
+        category_id, name, description, default_portion_grams,
+        calories_per_100g, protein_per_100g, carbs_per_100g,
+        fat_per_100g, fiber_per_100g, is_snack_suitable
+    ))
+    return cursor.lastrowid
+
+
+@instrument_query
 def create_food(
     category_id: int,
     name: str,
@@ -116,43 +256,22 @@ def create_food(
     is_snack_suitable: bool
 ) -> int:
     """Create a new food item. Returns the new ID."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-
-    try:
-        query = """
-            INSERT INTO food_items (
-                category_id, name, description, default_portion_grams,
-                calories_per_100g, protein_per_100g, carbs_per_100g,
-                fat_per_100g, fiber_per_100g, is_snack_suitable
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (
-            category_id, name, description, default_portion_grams,
-            calories_per_100g, protein_per_100g, carbs_per_100g,
-            fat_per_100g, fiber_per_100g, is_snack_suitable
-        ))
-        connection.commit()
-        return cursor.lastrowid
-
-    except Exception:
-        connection.rollback()
-        raise
-
-    finally:
-        cursor.close()
-        connection.close()
+    return _insert_one(FOOD_INSERTS, (
+        category_id, name, description, default_portion_grams,
+        calories_per_100g, protein_per_100g, carbs_per_100g,
+        fat_per_100g, fiber_per_100g, is_snack_suitable
+    ))
 
 
 # =============================================================================
 # CATEGORY QUERIES
 # =============================================================================
 
+@instrument_query
 def get_all_categories() -> list[dict]:
     """Get all food categories."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -161,17 +280,18 @@ def get_all_categories() -> list[dict]:
             ORDER BY sort_order
         """
         cursor.execute(query)
-        return cursor.fetchall()
+        return CATEGORY_ROW.all(cursor.fetchall())
 
     finally:
         cursor.close()
         connection.close()
 
 
+@instrument_query
 def get_category_by_id(category_id: int) -> dict | None:
     """Get a specific category by ID."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -180,13 +300,23 @@ def get_category_by_id(category_id: int) -> dict | None:
             WHERE id = %s
         """
         cursor.execute(query, (category_id,))
-        return cursor.fetchone()
+        return CATEGORY_ROW.first(cursor.fetchall())
 
     finally:
         cursor.close()
         connection.close()
 
 
+def _insert_category(cursor, name, icon, color, sort_order) -> int:
+    query = """
+        INSERT INTO food_categories (name, icon, color, sort_order)
+        VALUES (%s, %s, %s, %s)
+    """
+    cursor.execute(query, (name, icon, color, sort_order))
+    return cursor.lastrowid
+
+
+@instrument_query
 def create_category(
     name: str,
     icon: Optional[str],
@@ -194,38 +324,21 @@ def create_category(
     sort_order: int
 ) -> int:
     """Create a new food category. Returns the new ID."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-
-    try:
-        query = """
-            INSERT INTO food_categories (name, icon, color, sort_order)
-            VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query, (name, icon, color, sort_order))
-        connection.commit()
-        return cursor.lastrowid
-
-    except Exception:
-        connection.rollback()
-        raise
-
-    finally:
-        cursor.close()
-        connection.close()
+    return _insert_one(CATEGORY_INSERTS, (name, icon, color, sort_order))
 
 
 # =============================================================================
 # TEMPLATE QUERIES
 # =============================================================================
 
+@instrument_query
 def get_all_templates(
     segment: Optional[str] = None,
     type: Optional[str] = None
 ) -> list[dict]:
     """Get all diet templates with optional filters."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -247,22 +360,18 @@ def get_all_templates(
         query += " ORDER BY id"
 
         cursor.execute(query, params)
-        templates = cursor.fetchall()
-
-        for t in templates:
-            t["status"] = bool(t["status"])
-
-        return templates
+        return TEMPLATE_ROW.all(cursor.fetchall())
 
     finally:
         cursor.close()
         connection.close()
 
 
+@instrument_query
 def get_template_by_id(template_id: int) -> dict | None:
     """Get a specific diet template by ID."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -272,10 +381,136 @@ def get_template_by_id(template_id: int) -> dict | None:
             WHERE id = %s
         """
         cursor.execute(query, (template_id,))
-        template = cursor.fetchone()
+        return TEMPLATE_ROW.first(cursor.fetchall())
+
+    finally:
+        cursor.close()
+        connection.close()
 
-        if template:
-            template["status"] = bool(template["status"])
+
+def _keyed(columns: tuple) -> tuple[tuple, int]:
+    """Select list led by `id`, and the index the mapped columns start at.
+
+    The row mappers list `id` first; when a fieldset keeps it, the selected
+    column doubles as the key instead of being selected twice.
+    """
+    return (columns, 0) if columns[:1] == ("id",) else (("id",) + columns, 1)
+
+
+def _in_list(values) -> tuple[str, list]:
+    """Placeholders and parameters for `IN (...)`, padded to a bucketed length.
+
+    Statement text is the prepared-statement cache key (and the key of
+    explain_baseline.json), so the list only takes a few lengths per power
+    of two, like the MAX_EXECUTION_TIME hints of deadlines.py. Padding
+    repeats the last value, which IN ignores.
+    """
+    values = list(values)
+    size = math.ceil(2 ** (math.ceil(math.log2(len(values)) * 4) / 4))
+    values += values[-1:] * (size - len(values))
+    return ", ".join(["%s"] * size), values
+
+
+@instrument_query
+def get_template_full(
+    template_id: int,
+    from_day: Optional[int] = None,
+    to_day: Optional[int] = None,
+    meal_types: Optional[list[str]] = None,
+    fields: Optional[dict] = None
+) -> dict | None:
+    """Get full diet template with days, meals, and food items.
+
+    from_day/to_day (inclusive) and meal_types narrow the days and meals
+    fetched; the template header is returned in full either way. `fields`
+    is a fieldsets.parse() tree: only those columns are selected, and
+    levels it leaves out are not queried. Days, meals and items take one
+    query each; child rows carry their parent id first, as in
+    get_template_trees, so `id` is only returned where it was selected.
+    """
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
+
+    try:
+        template_row = TEMPLATE_ROW.select(lambda name: fieldsets.keeps(fields, name))
+        columns, start = _keyed(template_row.columns)
+        cursor.execute(f"""
+            SELECT {", ".join(columns)}
+            FROM diet_templates WHERE id = %s
+        """, (template_id,))
+        rows = cursor.fetchall()
+
+        if not rows:
+            return None
+        template = template_row.row(rows[0][start:])
+        if not fieldsets.keeps(fields, "days"):
+            return template
+        day_fields = fieldsets.child(fields, "days")
+
+        day_filter, day_params = "", [template_id]
+        if from_day is not None:
+            day_filter += " AND day_number >= %s"
+            day_params.append(from_day)
+        if to_day is not None:
+            day_filter += " AND day_number <= %s"
+            day_params.append(to_day)
+        day_row = DAY_ROW.select(lambda name: fieldsets.keeps(day_fields, name))
+        columns, start = _keyed(day_row.columns)
+        cursor.execute(f"""
+            SELECT {", ".join(columns)}
+            FROM diet_days WHERE template_id = %s{day_filter} ORDER BY day_number
+        """, day_params)
+        days = {}
+        template["days"] = []
+        for row in cursor.fetchall():
+            day = days[row[0]] = day_row.row(row[start:])
+            template["days"].append(day)
+        if not fieldsets.keeps(day_fields, "meals"):
+            return template
+        meal_fields = fieldsets.child(day_fields, "meals")
+        for day in days.values():
+            day["meals"] = []
+        if not days:
+            return template
+
+        day_ids, meal_params = _in_list(days)
+        meal_filter = ""
+        if meal_types:
+            meal_type_list, meal_type_params = _in_list(meal_types)
+            meal_filter = f" AND meal_type IN ({meal_type_list})"
+            meal_params += meal_type_params
+        meal_row = MEAL_ROW.select(lambda name: fieldsets.keeps(meal_fields, name))
+        columns, start = _keyed(meal_row.columns)
+        cursor.execute(f"""
+            SELECT {", ".join(("day_id",) + columns)}
+            FROM diet_meals
+            WHERE day_id IN ({day_ids}){meal_filter}
+            ORDER BY day_id, meal_order
+        """, meal_params)
+        meals = {}
+        for row in cursor.fetchall():
+            meal = meals[row[1]] = meal_row.row(row[1 + start:])
+            days[row[0]]["meals"].append(meal)
+        if not fieldsets.keeps(meal_fields, "items"):
+            return template
+        item_fields = fieldsets.child(meal_fields, "items")
+        for meal in meals.values():
+            meal["items"] = []
+        if not meals:
+            return template
+
+        item_row = MEAL_ITEM_ROW.select(lambda name: fieldsets.keeps(item_fields, name))
+        meal_ids, item_params = _in_list(meals)
+        # food_items is only joined for food_name
+        cursor.execute(f"""
+            SELECT {", ".join(("dmi.meal_id",) + tuple(MEAL_ITEM_SQL[name] for name in item_row.columns))}
+            FROM diet_meal_items dmi
+            {"JOIN food_items fi ON dmi.food_item_id = fi.id" if "food_name" in item_row.columns else ""}
+            WHERE dmi.meal_id IN ({meal_ids})
+            ORDER BY dmi.meal_id, dmi.sort_order
+        """, item_params)
+        for row in cursor.fetchall():
+            meals[row[0]]["items"].append(item_row.row(row[1:]))
 
         return template
 
@@ -284,61 +519,152 @@ def get_template_by_id(template_id: int) -> dict | None:
         connection.close()
 
 
-def get_template_full(template_id: int) -> dict | None:
-    """Get full diet template with days, meals, and food items."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+@instrument_query
+def get_template_ids() -> list[int]:
+    """IDs of every diet template, any status."""
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
-        cursor.execute("""
+        cursor.execute("SELECT id FROM diet_templates ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@instrument_query
+def get_template_trees(template_ids: list[int]) -> dict[int, dict]:
+    """Full templates for a batch of IDs in four queries, one per level.
+
+    Each child query carries its parent id first so rows can be attached
+    without per-parent round trips. Used to build catalog snapshots.
+    """
+    if not template_ids:
+        return {}
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
+    ids = ", ".join(["%s"] * len(template_ids))
+
+    try:
+        cursor.execute(f"""
             SELECT id, code, name, description, segment, type,
                    duration_days, calories_target, notes, status
-            FROM diet_templates WHERE id = %s
-        """, (template_id,))
-        template = cursor.fetchone()
+            FROM diet_templates WHERE id IN ({ids})
+        """, template_ids)
+        templates = {t["id"]: t for t in TEMPLATE_ROW.all(cursor.fetchall())}
+        days = {}
+        for template in templates.values():
+            template["days"] = []
+
+        cursor.execute(f"""
+            SELECT template_id, id, day_number, day_name, notes
+            FROM diet_days WHERE template_id IN ({ids})
+            ORDER BY template_id, day_number
+        """, template_ids)
+        for row in cursor.fetchall():
+            day = DAY_ROW.row(row[1:])
+            day["meals"] = []
+            days[day["id"]] = day
+            templates[row[0]]["days"].append(day)
+
+        meals = {}
+        cursor.execute(f"""
+            SELECT dm.day_id, dm.id, dm.meal_type, dm.meal_order, dm.time_suggestion, dm.notes
+            FROM diet_meals dm
+            JOIN diet_days dd ON dm.day_id = dd.id
+            WHERE dd.template_id IN ({ids})
+            ORDER BY dm.day_id, dm.meal_order
+        """, template_ids)
+        for row in cursor.fetchall():
+            meal = MEAL_ROW.row(row[1:])
+            meal["items"] = []
+            meals[meal["id"]] = meal
+            days[row[0]]["meals"].append(meal)
+
+        cursor.execute(f"""
+            SELECT dmi.meal_id, dmi.id, dmi.food_item_id, fi.name as food_name,
+                   dmi.portion_grams_min, dmi.portion_grams_max,
+                   dmi.portion_description, dmi.preparation_notes,
+                   dmi.is_optional, dmi.sort_order
+            FROM diet_meal_items dmi
+            JOIN food_items fi ON dmi.food_item_id = fi.id
+            JOIN diet_meals dm ON dmi.meal_id = dm.id
+            JOIN diet_days dd ON dm.day_id = dd.id
+            WHERE dd.template_id IN ({ids})
+            ORDER BY dmi.meal_id, dmi.sort_order
+        """, template_ids)
+        for row in cursor.fetchall():
+            meals[row[0]]["items"].append(MEAL_ITEM_ROW.row(row[1:]))
 
-        if not template:
-            return None
+        return templates
+
+    finally:
+        cursor.close()
+        connection.close()
 
-        template["status"] = bool(template["status"])
 
+@instrument_query
+def get_meal_template_id(meal_id: int) -> int | None:
+    """The template a meal belongs to (for invalidating cached templates)."""
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
+
+    try:
         cursor.execute("""
-            SELECT id, day_number, day_name, notes
-            FROM diet_days WHERE template_id = %s ORDER BY day_number
-        """, (template_id,))
-        days = cursor.fetchall()
-
-        for day in days:
-            cursor.execute("""
-                SELECT id, meal_type, meal_order, time_suggestion, notes
-                FROM diet_meals WHERE day_id = %s ORDER BY meal_order
-            """, (day["id"],))
-            meals = cursor.fetchall()
-
-            for meal in meals:
-                cursor.execute("""
-                    SELECT dmi.id, dmi.food_item_id, fi.name as food_name,
-                           dmi.portion_grams_min, dmi.portion_grams_max,
-                           dmi.portion_description, dmi.preparation_notes,
-                           dmi.is_optional, dmi.sort_order
-                    FROM diet_meal_items dmi
-                    JOIN food_items fi ON dmi.food_item_id = fi.id
-                    WHERE dmi.meal_id = %s ORDER BY dmi.sort_order
-                """, (meal["id"],))
-                meal["items"] = cursor.fetchall()
-                for item in meal["items"]:
-                    item["is_optional"] = bool(item["is_optional"])
-
-            day["meals"] = meals
-
-        template["days"] = days
-        return template
+            SELECT dd.template_id
+            FROM diet_meals dm
+            JOIN diet_days dd ON dm.day_id = dd.id
+            WHERE dm.id = %s
+        """, (meal_id,))
+        rows = cursor.fetchall()
+        return rows[0][0] if rows else None
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@instrument_query
+def get_meal_template_ids(meal_ids: list[int]) -> set[int]:
+    """Templates the given meals belong to."""
+    if not meal_ids:
+        return set()
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute(f"""
+            SELECT DISTINCT dd.template_id
+            FROM diet_meals dm
+            JOIN diet_days dd ON dm.day_id = dd.id
+            WHERE dm.id IN ({", ".join(["%s"] * len(meal_ids))})
+        """, list(meal_ids))
+        return {row[0] for row in cursor.fetchall()}
 
     finally:
         cursor.close()
         connection.close()
 
 
+def _insert_template(
+    cursor, code, name, description, segment,
+    type, duration_days, calories_target, notes
+) -> int:
+    query = """
+        INSERT INTO diet_templates (code, name, description, segment, type,
+                                    duration_days, calories_target, notes)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    cursor.execute(query, (
+        code, name, description, segment,
+        type, duration_days, calories_target, notes
+    ))
+    return cursor.lastrowid
+
+
+@instrument_query
 def create_template(
     code: str,
     name: str,
@@ -350,39 +676,21 @@ def create_template(
     notes: Optional[str]
 ) -> int:
     """Create a new diet template. Returns the new ID."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-
-    try:
-        query = """
-            INSERT INTO diet_templates (code, name, description, segment, type,
-                                        duration_days, calories_target, notes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (
-            code, name, description, segment,
-            type, duration_days, calories_target, notes
-        ))
-        connection.commit()
-        return cursor.lastrowid
-
-    except Exception:
-        connection.rollback()
-        raise
-
-    finally:
-        cursor.close()
-        connection.close()
+    return _insert_one(TEMPLATE_INSERTS, (
+        code, name, description, segment,
+        type, duration_days, calories_target, notes
+    ))
 
 
 # =============================================================================
 # BENCHMARK QUERIES
 # =============================================================================
 
+@instrument_query
 def get_nutritional_stats_by_category() -> list[dict]:
     """Complex query - aggregates nutritional data by category."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
 
     try:
         query = """
@@ -399,40 +707,419 @@ def get_nutritional_stats_by_category() -> list[dict]:
             ORDER BY fc.sort_order
         """
         cursor.execute(query)
-        return cursor.fetchall()
+        return NUTRITION_ROW.all(cursor.fetchall())
 
     finally:
         cursor.close()
         connection.close()
 
 
+def _insert_meal_items(cursor, meal_id: int, items: list[dict]) -> int:
+    """Insert items one by one, skipping any the database rejects."""
+    query = """
+        INSERT INTO diet_meal_items
+        (meal_id, food_item_id, portion_grams_min, portion_grams_max,
+         portion_description, is_optional, sort_order)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """
+
+    inserted = 0
+    for item in items:
+        try:
+            cursor.execute(query, (
+                meal_id, item["food_item_id"], item["portion_grams_min"],
+                item["portion_grams_max"], item.get("portion_description"),
+                item.get("is_optional", False), item.get("sort_order", 0)
+            ))
+            inserted += 1
+        except Error:
+            continue
+    return inserted
+
+
+@instrument_query
 def bulk_insert_meal_items(meal_id: int, items: list[dict]) -> int:
     """Bulk insert meal items. Returns count of inserted items."""
-    connection = get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+    results = MEAL_ITEM_INSERTS.insert([
+        (
+            meal_id, item["food_item_id"], item["portion_grams_min"],
+            item["portion_grams_max"], item.get("portion_description"),
+            item.get("is_optional", False), item.get("sort_order", 0)
+        )
+        for item in items
+    ])
+    # Rows the database rejected are skipped, as before
+    return sum(1 for result in results if not isinstance(result, Error))
+
 
+# =============================================================================
+# UPSERTS
+# =============================================================================
+
+# Rows per upsert transaction: keeps lock time and undo short on big imports
+UPSERT_CHUNK_ROWS = 1000
+# (table, natural key, updatable columns). Foods have a unique key on theirs
+# (schema.UNIQUE_INDEXES); meal items do not, see _upsert.
+FOOD_UNIQUE_INDEX = "ux_food_items_category_name"
+FOOD_UPSERT = ("food_items", ("category_id", "name"), (
+    "description", "default_portion_grams", "calories_per_100g", "protein_per_100g",
+    "carbs_per_100g", "fat_per_100g", "fiber_per_100g", "is_snack_suitable",
+))
+MEAL_ITEM_UPSERT = ("diet_meal_items", ("meal_id", "food_item_id", "sort_order"), (
+    "portion_grams_min", "portion_grams_max", "portion_description", "is_optional",
+))
+
+
+def _comparable(value):
+    """Normalize stored and incoming values (DECIMAL(x,2), TINYINT flags) for equality."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (float, Decimal)):
+        return round(float(value), 2)
+    return value
+
+
+def _collated(key: tuple) -> tuple:
+    """A natural key as the database compares it.
+
+    MySQL's default utf8mb4 collations ignore case and accents, so "Apple",
+    "apple" and "Äpple" are one row there; SQLite compares bytes.
+    """
+    if database.backend.name != "mysql":
+        return key
+    return tuple(
+        "".join(c for c in unicodedata.normalize("NFKD", v) if not unicodedata.combining(c)).casefold()
+        if isinstance(v, str) else v
+        for v in key
+    )
+
+
+def _upsert_statement(table: str, key: tuple, values: tuple, rows: int) -> str:
+    columns = key + values
+    row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row] * rows)}"
+    if database.backend.name == "mysql":
+        return statement + " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in values)
+    return (
+        statement + f" ON CONFLICT ({', '.join(key)}) DO UPDATE SET "
+        + ", ".join(f"{c} = excluded.{c}" for c in values)
+    )
+
+
+def _upsert(spec: tuple, rows: list[dict], unique_key: bool, log) -> tuple[dict, list[dict]]:
+    """Insert or update rows by natural key, in chunks of one transaction each.
+
+    Each chunk reads the matching rows in one SELECT and only writes rows
+    that are new or differ, so a resync of unchanged data issues no writes.
+    With a unique key, new and changed rows go out as one multi-row upsert.
+    Without one (meal items), the SELECT locks the key range (FOR UPDATE, or
+    BEGIN IMMEDIATE on SQLite) and rows are inserted or updated by id.
+    log(cursor, new, changed) records the chunk in change_log before commit,
+    with changed as (id, row) pairs. Returns counts and the rows written.
+    """
+    table, key, values = spec
+    tracing.expect_repeated_statements()
+    # Within one request the last row for a key wins
+    rows = list({_collated(tuple(row[c] for c in key)): row for row in rows}.values())
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    written = []
+    chunk_size = min(UPSERT_CHUNK_ROWS, database.MAX_STATEMENT_PARAMS // (len(key) + len(values)))
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        connection = get_db_connection()
+        cursor = connection.cursor()
+
+        try:
+            if not unique_key and database.backend.name != "mysql":
+                cursor.execute("BEGIN IMMEDIATE")
+            where = " AND ".join(
+                f"{c} IN ({', '.join(['%s'] * len({row[c] for row in chunk}))})" for c in key
+            )
+            query = f"SELECT id, {', '.join(key + values)} FROM {table} WHERE {where}"
+            if not unique_key and database.backend.name == "mysql":
+                query += " FOR UPDATE"
+            cursor.execute(query, [v for c in key for v in {row[c] for row in chunk}])
+            existing = {
+                _collated(tuple(found[1:1 + len(key)])): (
+                    found[0], tuple(_comparable(v) for v in found[1 + len(key):])
+                )
+                for found in cursor.fetchall()
+            }
+
+            new, changed = [], []
+            for row in chunk:
+                current = existing.get(_collated(tuple(row[c] for c in key)))
+                if current is None:
+                    new.append(row)
+                elif current[1] != tuple(_comparable(row[c]) for c in values):
+                    changed.append((current[0], row))
+                else:
+                    counts["unchanged"] += 1
+
+            if unique_key and (new or changed):
+                batch = new + [row for _, row in changed]
+                cursor.execute(
+                    _upsert_statement(table, key, values, len(batch)),
+                    [row[c] for row in batch for c in key + values]
+                )
+            else:
+                if new:
+                    placeholders = "(" + ", ".join(["%s"] * len(key + values)) + ")"
+                    cursor.execute(
+                        f"INSERT INTO {table} ({', '.join(key + values)}) "
+                        f"VALUES {', '.join([placeholders] * len(new))}",
+                        [row[c] for row in new for c in key + values]
+                    )
+                if changed:
+                    cursor.executemany(
+                        f"UPDATE {table} SET {', '.join(f'{c} = %s' for c in values)} WHERE id = %s",
+                        [[row[c] for c in values] + [row_id] for row_id, row in changed]
+                    )
+            if new or changed:
+                log(cursor, new, changed)
+            connection.commit()
+
+        except Exception:
+            connection.rollback()
+            raise
+
+        finally:
+            cursor.close()
+            connection.close()
+
+        counts["inserted"] += len(new)
+        counts["updated"] += len(changed)
+        written.extend(new)
+        written.extend(row for _, row in changed)
+
+    return counts, written
+
+
+def _log_food_upserts(cursor, new: list[dict], changed: list[tuple[int, dict]]):
+    _log_changes(cursor, "food", [row_id for row_id, _ in changed], "update")
+    if not new:
+        return
+    # ON DUPLICATE KEY UPDATE does not report the ids of inserted rows
+    names = sorted({row["name"] for row in new})
+    categories = sorted({row["category_id"] for row in new})
+    cursor.execute(
+        f"SELECT id, category_id, name FROM food_items "
+        f"WHERE category_id IN ({', '.join(['%s'] * len(categories))}) "
+        f"AND name IN ({', '.join(['%s'] * len(names))})",
+        categories + names
+    )
+    keys = {_collated((row["category_id"], row["name"])) for row in new}
+    _log_changes(
+        cursor, "food", [found[0] for found in cursor.fetchall() if _collated(tuple(found[1:])) in keys], "insert"
+    )
+
+
+# Set once the unique key upsert_foods relies on has been seen
+_food_key_present = False
+
+
+def _require_food_key():
+    """Refuse to upsert foods without their unique key.
+
+    MySQL's ON DUPLICATE KEY UPDATE would insert a second row for every
+    existing food (and count it as updated); SQLite's ON CONFLICT fails.
+    """
+    global _food_key_present
+    if _food_key_present:
+        return
+    connection = get_db_connection()
+    cursor = connection.cursor()
     try:
-        query = """
-            INSERT INTO diet_meal_items
-            (meal_id, food_item_id, portion_grams_min, portion_grams_max,
-             portion_description, is_optional, sort_order)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
+        present = schema.has_index(cursor, database.backend.name, FOOD_UNIQUE_INDEX)
+    finally:
+        cursor.close()
+        connection.close()
+    if not present:
+        raise Error(
+            f"food_items has no unique index {FOOD_UNIQUE_INDEX}; "
+            "run `python schema.py` to merge duplicates and create it"
+        )
+    _food_key_present = True
 
-        inserted = 0
-        for item in items:
-            try:
-                cursor.execute(query, (
-                    meal_id, item["food_item_id"], item["portion_grams_min"],
-                    item["portion_grams_max"], item.get("portion_description"),
-                    item.get("is_optional", False), item.get("sort_order", 0)
-                ))
-                inserted += 1
-            except Exception:
+
+@instrument_query
+def upsert_foods(foods: list[dict]) -> dict:
+    """Insert or update foods keyed on (category_id, name). Returns counts."""
+    _require_food_key()
+    counts, _ = _upsert(FOOD_UPSERT, foods, unique_key=True, log=_log_food_upserts)
+    return counts
+
+
+@instrument_query
+def upsert_meal_items(items: list[dict]) -> tuple[dict, set[int]]:
+    """Insert or update meal items keyed on (meal_id, food_item_id, sort_order).
+
+    Returns counts and the ids of the meals that changed.
+    """
+    counts, written = _upsert(
+        MEAL_ITEM_UPSERT, items, unique_key=False,
+        log=lambda cursor, new, changed: _log_meal_changes(
+            cursor, {row["meal_id"] for row in new} | {row["meal_id"] for _, row in changed}
+        ),
+    )
+    return counts, {row["meal_id"] for row in written}
+
+
+# =============================================================================
+# WRITE-BEHIND
+# =============================================================================
+
+# Operation name -> (insert helper, result key). writebehind.py journals these
+# names with the keyword arguments of the matching create_* function.
+WRITERS = {
+    "create_food": (_insert_food, "id"),
+    "create_category": (_insert_category, "id"),
+    "create_template": (_insert_template, "id"),
+    "bulk_insert_meal_items": (_insert_meal_items, "inserted_count"),
+}
+
+
+@instrument_query
+def apply_writes(writes: list[tuple[str, str, dict]]) -> dict[str, dict]:
+    """Apply queued writes (ticket, operation, kwargs) in one transaction.
+
+    Each write runs under its own savepoint, so one rejected write is
+    recorded as failed without aborting the rest. Results go into
+    write_behind_results in the same transaction: a batch replayed after a
+    crash skips tickets that already committed. Returns ticket -> result
+    row for every ticket in the batch.
+    """
+    connection = get_db_connection()
+    control = connection.cursor()
+    cursor = connection.cursor(prepared=True)
+
+    try:
+        placeholders = ", ".join(["%s"] * len(writes))
+        control.execute(
+            f"SELECT ticket, operation, result, error, completed_at FROM write_behind_results "
+            f"WHERE ticket IN ({placeholders})",
+            [ticket for ticket, _, _ in writes]
+        )
+        results = {row[0]: WRITE_RESULT_ROW.row(row) for row in control.fetchall()}
+
+        control.execute("BEGIN")
+        completed_at = time.time()
+        ledger = []
+        for ticket, operation, kwargs in writes:
+            if ticket in results:
                 continue
+            insert, key = WRITERS[operation]
+            control.execute("SAVEPOINT write_behind")
+            try:
+                result, error = json.dumps({key: insert(cursor, **kwargs)}), None
+                control.execute("RELEASE SAVEPOINT write_behind")
+            except Error as e:
+                control.execute("ROLLBACK TO SAVEPOINT write_behind")
+                result, error = None, str(e)
+            ledger.append((ticket, operation, result, error, completed_at))
+            results[ticket] = WRITE_RESULT_ROW.row(ledger[-1])
+
+        _log_applied(control, writes, results, ledger)
+        if ledger:
+            control.executemany(
+                "INSERT INTO write_behind_results (ticket, operation, result, error, completed_at) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                ledger
+            )
+        connection.commit()
+        return results
+
+    except Exception:
+        connection.rollback()
+        raise
 
+    finally:
+        cursor.close()
+        control.close()
+        connection.close()
+
+
+def _log_applied(cursor, writes: list, results: dict, ledger: list):
+    """change_log rows for the writes of this batch that succeeded."""
+    applied = {entry[0] for entry in ledger if entry[3] is None}
+    meals = set()
+    for ticket, operation, kwargs in writes:
+        if ticket not in applied:
+            continue
+        if operation == "bulk_insert_meal_items":
+            if results[ticket]["result"]["inserted_count"]:
+                meals.add(kwargs["meal_id"])
+        else:
+            entity = operation.removeprefix("create_")
+            _log_changes(cursor, entity, [results[ticket]["result"]["id"]], "insert")
+    _log_meal_changes(cursor, meals)
+
+
+@instrument_query
+def record_write_failures(results: list[dict]) -> int:
+    """Ledger rows for write-behind tickets given up on; tickets already there are kept."""
+    connection = get_db_connection()
+    cursor = connection.cursor()
+
+    try:
+        placeholders = ", ".join(["%s"] * len(results))
+        cursor.execute(
+            f"SELECT ticket FROM write_behind_results WHERE ticket IN ({placeholders})",
+            [result["ticket"] for result in results]
+        )
+        known = {row[0] for row in cursor.fetchall()}
+        ledger = [
+            (r["ticket"], r["operation"], None, r["error"], r["completed_at"])
+            for r in results if r["ticket"] not in known
+        ]
+        if ledger:
+            cursor.executemany(
+                "INSERT INTO write_behind_results (ticket, operation, result, error, completed_at) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                ledger
+            )
         connection.commit()
-        return inserted
+        return len(ledger)
+
+    except Exception:
+        connection.rollback()
+        raise
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@instrument_query
+def get_write_result(ticket: str) -> dict | None:
+    """Ledger row of a flushed write-behind ticket (read from the primary)."""
+    connection = get_db_connection()
+    cursor = connection.cursor(prepared=True)
+
+    try:
+        cursor.execute("""
+            SELECT ticket, operation, result, error, completed_at
+            FROM write_behind_results
+            WHERE ticket = %s
+        """, (ticket,))
+        return WRITE_RESULT_ROW.first(cursor.fetchall())
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@instrument_query
+def purge_write_results(older_than: float) -> int:
+    """Delete ledger rows completed before the given epoch time."""
+    connection = get_db_connection()
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute("DELETE FROM write_behind_results WHERE completed_at < %s", (older_than,))
+        connection.commit()
+        return cursor.rowcount
 
     except Exception:
         connection.rollback()
@@ -444,14 +1131,180 @@ def bulk_insert_meal_items(meal_id: int, items: list[dict]) -> int:
 
 
 # =============================================================================
-# HEALTH CHECK
+# CHANGE FEED
 # =============================================================================
 
-def check_db_connection() -> bool:
-    """Check if database connection is working."""
+# Every write path records (entity, id) in change_log inside its own
+# transaction; /api/changes pages through it by id. Meal-item writes show up
+# as updates of the templates they belong to.
+CHANGE_ROW = RowMapper(("id", "entity", "entity_id", "operation", "changed_at"))
+
+CHANGE_ENTITIES = ("food", "category", "template")
+
+
+def _log_changes(cursor, entity: str, ids: list[int], operation: str):
+    if ids:
+        cursor.executemany(
+            "INSERT INTO change_log (entity, entity_id, operation, changed_at) "
+            f"VALUES (%s, %s, %s, {schema.EPOCH_NOW[database.backend.name]})",
+            [(entity, entity_id, operation) for entity_id in ids]
+        )
+
+
+def _log_inserted(cursor, entity: str, results: list):
+    _log_changes(cursor, entity, [r for r in results if not isinstance(r, Error)], "insert")
+
+
+def _log_meal_changes(cursor, meal_ids: set[int]):
+    if meal_ids:
+        cursor.execute(f"""
+            INSERT INTO change_log (entity, entity_id, operation, changed_at)
+            SELECT DISTINCT 'template', dd.template_id, 'update', {schema.EPOCH_NOW[database.backend.name]}
+            FROM diet_meals dm
+            JOIN diet_days dd ON dm.day_id = dd.id
+            WHERE dm.id IN ({", ".join(["%s"] * len(meal_ids))})
+        """, sorted(meal_ids))
+
+
+@instrument_query
+def get_changes(
+    since: int,
+    limit: int,
+    entities: Optional[list[str]] = None,
+    upto: Optional[int] = None
+) -> list[dict]:
+    """change_log rows after the cursor id, oldest first.
+
+    upto bounds the scan to ids known to have settled (see changes.py).
+    """
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor()
+
     try:
-        connection = get_db_connection()
+        conditions, params = ["id > %s"], [since]
+        if entities:
+            conditions.append(f"entity IN ({', '.join(['%s'] * len(entities))})")
+            params.extend(entities)
+        if upto is not None:
+            conditions.append("id <= %s")
+            params.append(upto)
+        cursor.execute(f"""
+            SELECT id, entity, entity_id, operation, changed_at
+            FROM change_log
+            WHERE {" AND ".join(conditions)}
+            ORDER BY id
+            LIMIT %s
+        """, params + [limit])
+        return CHANGE_ROW.all(cursor.fetchall())
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@instrument_query
+def get_change_bounds() -> tuple[int, int]:
+    """Oldest and newest change_log ids (0, 0 when empty)."""
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(prepared=True)
+
+    try:
+        cursor.execute("SELECT MIN(id), MAX(id) FROM change_log")
+        oldest, newest = cursor.fetchall()[0]
+        return oldest or 0, newest or 0
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@instrument_query
+def get_change_cursor(settle: float = 0) -> int:
+    """Newest change id, ignoring changes logged less than `settle` seconds ago.
+
+    Ages are measured on the database clock, the one changed_at was stamped with.
+    """
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor()
+
+    try:
+        if settle <= 0:
+            cursor.execute("SELECT MAX(id) FROM change_log")
+        else:
+            # Walks back from the newest id; only the last few are unsettled
+            cursor.execute(
+                "SELECT id FROM change_log "
+                f"WHERE changed_at <= {schema.EPOCH_NOW[database.backend.name]} - %s "
+                "ORDER BY id DESC LIMIT 1", (settle,)
+            )
+        row = cursor.fetchone()
+        return (row[0] if row else None) or 0
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+CHANGED_ROWS = {
+    "food": (FOOD_ROW, """
+        SELECT fi.id, fi.category_id, fc.name, fi.name, fi.description,
+               fi.default_portion_grams, fi.calories_per_100g, fi.protein_per_100g,
+               fi.carbs_per_100g, fi.fat_per_100g, fi.fiber_per_100g,
+               fi.is_snack_suitable, fi.status
+        FROM food_items fi
+        LEFT JOIN food_categories fc ON fi.category_id = fc.id
+        WHERE fi.id IN ({ids})
+    """),
+    "category": (CATEGORY_ROW, """
+        SELECT id, name, icon, color, sort_order
+        FROM food_categories
+        WHERE id IN ({ids})
+    """),
+    "template": (TEMPLATE_ROW, """
+        SELECT id, code, name, description, segment, type,
+               duration_days, calories_target, notes, status
+        FROM diet_templates
+        WHERE id IN ({ids})
+    """),
+}
+
+
+@instrument_query
+def get_changed_rows(entity: str, ids: list[int]) -> dict[int, dict]:
+    """Current rows of one entity type by id, for change feed pages."""
+    if not ids:
+        return {}
+    mapper, query = CHANGED_ROWS[entity]
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute(query.format(ids=", ".join(["%s"] * len(ids))), list(ids))
+        return {row[0]: mapper.row(row) for row in cursor.fetchall()}
+
+    finally:
+        cursor.close()
         connection.close()
-        return True
+
+
+@instrument_query
+def purge_changes(retention: float) -> int:
+    """Delete change_log rows logged more than `retention` seconds ago (database clock)."""
+    connection = get_db_connection()
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute(
+            f"DELETE FROM change_log WHERE changed_at < {schema.EPOCH_NOW[database.backend.name]} - %s",
+            (retention,)
+        )
+        connection.commit()
+        return cursor.rowcount
+
     except Exception:
-        return False
+        connection.rollback()
+        raise
+
+    finally:
+        cursor.close()
+        connection.close()
@@ -0,0 +1,294 @@
+"""
+Table definitions for the diet database.
+
+The DDL is written once and rendered per backend: the only dialect
+differences are the auto-increment primary key and MySQL's table options.
+SQLite accepts the MySQL column types through type affinity.
+
+INDEXES serve the access paths of queries.py; each one is ordered
+(equality columns, then the ORDER BY column) so lookups avoid both a scan
+and a filesort. index_advisor.py checks the plans actually stay that way.
+
+Usage:
+    python schema.py            # create missing tables and indexes on the configured backend
+"""
+
+import logging
+
+logger = logging.getLogger("diet_api.schema")
+
+TABLES = {
+    "food_categories": """
+        CREATE TABLE IF NOT EXISTS food_categories (
+            id {pk},
+            name VARCHAR(100) NOT NULL,
+            icon VARCHAR(50),
+            color VARCHAR(20),
+            sort_order INT NOT NULL DEFAULT 0
+        ){options}
+    """,
+    "food_items": """
+        CREATE TABLE IF NOT EXISTS food_items (
+            id {pk},
+            category_id INT NOT NULL,
+            name VARCHAR(150) NOT NULL,
+            description TEXT,
+            default_portion_grams INT NOT NULL DEFAULT 100,
+            calories_per_100g DECIMAL(7,2),
+            protein_per_100g DECIMAL(6,2),
+            carbs_per_100g DECIMAL(6,2),
+            fat_per_100g DECIMAL(6,2),
+            fiber_per_100g DECIMAL(6,2),
+            is_snack_suitable TINYINT(1) NOT NULL DEFAULT 0,
+            status TINYINT(1) NOT NULL DEFAULT 1,
+            FOREIGN KEY (category_id) REFERENCES food_categories(id)
+        ){options}
+    """,
+    "diet_templates": """
+        CREATE TABLE IF NOT EXISTS diet_templates (
+            id {pk},
+            code VARCHAR(30) NOT NULL UNIQUE,
+            name VARCHAR(150) NOT NULL,
+            description TEXT,
+            segment VARCHAR(5) NOT NULL,
+            type VARCHAR(10) NOT NULL,
+            duration_days INT NOT NULL DEFAULT 30,
+            calories_target INT,
+            notes TEXT,
+            status TINYINT(1) NOT NULL DEFAULT 1
+        ){options}
+    """,
+    "diet_days": """
+        CREATE TABLE IF NOT EXISTS diet_days (
+            id {pk},
+            template_id INT NOT NULL,
+            day_number INT NOT NULL,
+            day_name VARCHAR(50),
+            notes TEXT,
+            FOREIGN KEY (template_id) REFERENCES diet_templates(id)
+        ){options}
+    """,
+    "diet_meals": """
+        CREATE TABLE IF NOT EXISTS diet_meals (
+            id {pk},
+            day_id INT NOT NULL,
+            meal_type VARCHAR(30) NOT NULL,
+            meal_order INT NOT NULL DEFAULT 0,
+            time_suggestion VARCHAR(20),
+            notes TEXT,
+            FOREIGN KEY (day_id) REFERENCES diet_days(id)
+        ){options}
+    """,
+    "diet_meal_items": """
+        CREATE TABLE IF NOT EXISTS diet_meal_items (
+            id {pk},
+            meal_id INT NOT NULL,
+            food_item_id INT NOT NULL,
+            portion_grams_min INT NOT NULL,
+            portion_grams_max INT NOT NULL,
+            portion_description VARCHAR(100),
+            preparation_notes TEXT,
+            is_optional TINYINT(1) NOT NULL DEFAULT 0,
+            sort_order INT NOT NULL DEFAULT 0,
+            FOREIGN KEY (meal_id) REFERENCES diet_meals(id),
+            FOREIGN KEY (food_item_id) REFERENCES food_items(id)
+        ){options}
+    """,
+    # Outcome of each write-behind ticket (writebehind.py), written in the
+    # same transaction as the write itself
+    "write_behind_results": """
+        CREATE TABLE IF NOT EXISTS write_behind_results (
+            ticket CHAR(32) NOT NULL PRIMARY KEY,
+            operation VARCHAR(40) NOT NULL,
+            result TEXT,
+            error TEXT,
+            completed_at DOUBLE NOT NULL
+        ){options}
+    """,
+    "change_log": """
+        CREATE TABLE IF NOT EXISTS change_log (
+            id {pk},
+            entity VARCHAR(20) NOT NULL,
+            entity_id INT NOT NULL,
+            operation VARCHAR(10) NOT NULL,
+            changed_at DOUBLE NOT NULL
+        ){options}
+    """,
+}
+
+# Epoch seconds on the database clock, per dialect. change_log.changed_at is
+# stamped and compared with it, never with an app host's clock, so hosts with
+# skewed clocks agree on which changes have settled.
+EPOCH_NOW = {
+    "mysql": "UNIX_TIMESTAMP(NOW(6))",
+    "sqlite": "((julianday('now') - 2440587.5) * 86400.0)",
+}
+
+# (name, table, columns). InnoDB secondary indexes carry the primary key, so
+# `id` never needs listing; TEXT notes columns keep the child lookups from
+# being fully covering, but they no longer scan or sort.
+INDEXES = [
+    # get_all_foods: WHERE status = 1 [AND category_id = ?] ORDER BY ..., name
+    ("ix_food_items_status_category_name", "food_items", ("status", "category_id", "name")),
+    ("ix_food_categories_sort_order", "food_categories", ("sort_order",)),
+    # get_all_templates: WHERE status = 1 [AND segment = ?] [AND type = ?] ORDER BY id
+    ("ix_diet_templates_status_segment_type", "diet_templates", ("status", "segment", "type")),
+    # get_template_full: one lookup per level, each ordered within its parent
+    ("ix_diet_days_template_day", "diet_days", ("template_id", "day_number")),
+    ("ix_diet_meals_day_order", "diet_meals", ("day_id", "meal_order")),
+    ("ix_diet_meal_items_meal_sort", "diet_meal_items", ("meal_id", "sort_order")),
+    ("ix_diet_meal_items_food", "diet_meal_items", ("food_item_id",)),
+    # purge_write_results: DELETE ... WHERE completed_at < ?
+    ("ix_write_behind_results_completed", "write_behind_results", ("completed_at",)),
+    # purge_changes: DELETE ... WHERE changed_at < ?
+    ("ix_change_log_changed_at", "change_log", ("changed_at",)),
+]
+
+# Natural keys for upsert_foods (ON DUPLICATE KEY UPDATE / ON CONFLICT); the
+# category_id prefix also serves category joins and the nutritional GROUP BY.
+# diet_meal_items has none: the bulk-insert benchmark inserts repeats.
+UNIQUE_INDEXES = [
+    ("ux_food_items_category_name", "food_items", ("category_id", "name")),
+]
+
+
+# Duplicate ids per IN list when logging the templates a merge touches
+DEDUPE_CHUNK = 500
+
+
+def dedupe_foods(cursor, dialect: str) -> int:
+    """Merge food_items rows sharing (category_id, name); returns rows removed.
+
+    The lowest id of each group survives and meal items pointing at the
+    others are moved to it. Grouping follows the column collation, as the
+    unique index will, so MySQL merges names differing only in case. The
+    merge is recorded in change_log: the removed foods as deletes, the
+    templates whose items moved as updates.
+    """
+    cursor.execute("""
+        SELECT fi.id, k.keep_id
+        FROM food_items fi
+        JOIN (
+            SELECT category_id, name, MIN(id) AS keep_id
+            FROM food_items
+            GROUP BY category_id, name
+            HAVING COUNT(*) > 1
+        ) k ON k.category_id = fi.category_id AND k.name = fi.name
+        WHERE fi.id <> k.keep_id
+    """)
+    merged = cursor.fetchall()
+    if not merged:
+        return 0
+    now = EPOCH_NOW[dialect]
+    for start in range(0, len(merged), DEDUPE_CHUNK):
+        chunk = merged[start:start + DEDUPE_CHUNK]
+        cursor.execute(f"""
+            INSERT INTO change_log (entity, entity_id, operation, changed_at)
+            SELECT DISTINCT 'template', dd.template_id, 'update', {now}
+            FROM diet_meal_items dmi
+            JOIN diet_meals dm ON dmi.meal_id = dm.id
+            JOIN diet_days dd ON dm.day_id = dd.id
+            WHERE dmi.food_item_id IN ({", ".join(["%s"] * len(chunk))})
+        """, [duplicate for duplicate, _ in chunk])
+    cursor.executemany(
+        "UPDATE diet_meal_items SET food_item_id = %s WHERE food_item_id = %s",
+        [(keep, duplicate) for duplicate, keep in merged]
+    )
+    cursor.executemany("DELETE FROM food_items WHERE id = %s", [(duplicate,) for duplicate, _ in merged])
+    cursor.executemany(
+        f"INSERT INTO change_log (entity, entity_id, operation, changed_at) VALUES ('food', %s, 'delete', {now})",
+        [(duplicate,) for duplicate, _ in merged]
+    )
+    return len(merged)
+
+
+# Run before creating a unique index: rows it would reject are merged first
+DEDUPE = {
+    "ux_food_items_category_name": dedupe_foods,
+}
+
+DIALECTS = {
+    "mysql": {
+        "pk": "INT AUTO_INCREMENT PRIMARY KEY",
+        "options": " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+    },
+    "sqlite": {
+        "pk": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "options": "",
+    },
+}
+
+
+def render(dialect: str) -> list[str]:
+    """CREATE TABLE statements for a dialect, parents before children."""
+    tokens = DIALECTS[dialect]
+    return [ddl.format(**tokens) for ddl in TABLES.values()]
+
+
+def _existing_indexes(cursor, dialect: str) -> set[str]:
+    if dialect == "mysql":
+        cursor.execute(
+            "SELECT DISTINCT index_name FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE()"
+        )
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def has_index(cursor, dialect: str, name: str) -> bool:
+    return name in _existing_indexes(cursor, dialect)
+
+
+def create_indexes(cursor, dialect: str) -> list[str]:
+    """Create the INDEXES missing from the database; returns their names.
+
+    MySQL has no CREATE INDEX IF NOT EXISTS, so existing names are looked up
+    first on both backends, and a rerun picks up where a failed one stopped
+    (MySQL commits each CREATE INDEX on its own). Duplicates a unique index
+    would reject are merged by its DEDUPE step first; on MySQL the DDL
+    commits the merge.
+    """
+    existing = _existing_indexes(cursor, dialect)
+    created = []
+    for kind, indexes in (("INDEX", INDEXES), ("UNIQUE INDEX", UNIQUE_INDEXES)):
+        for name, table, columns in indexes:
+            if name in existing:
+                continue
+            if name in DEDUPE:
+                merged = DEDUPE[name](cursor, dialect)
+                if merged:
+                    logger.warning("merged %d duplicate %s rows before creating %s", merged, table, name)
+            cursor.execute(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})")
+            created.append(name)
+    return created
+
+
+def create_schema(connection, dialect: str) -> list[str]:
+    """Create any missing tables and indexes over an open connection.
+
+    Returns the names of the indexes that had to be created.
+    """
+    cursor = connection.cursor()
+    try:
+        for statement in render(dialect):
+            cursor.execute(statement)
+        created = create_indexes(cursor, dialect)
+        connection.commit()
+        return created
+    finally:
+        cursor.close()
+
+
+if __name__ == "__main__":
+    from database import backend, get_db_connection
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    connection = get_db_connection()
+    try:
+        created = create_schema(connection, backend.name)
+        print(f"Schema ready on {backend.name}: {', '.join(TABLES)}")
+        if created:
+            print(f"Created indexes: {', '.join(created)}")
+    finally:
+        connection.close()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Seed the diet database with a realistic catalog and diet templates.
+
+Works against whichever backend database.py is configured for, so the API,
+k6 scripts and diet_api_test.py can be run without a MySQL server:
+
+    DB_BACKEND=sqlite DB_PATH=diet.db python seed.py --create-schema --reset
+    DB_BACKEND=sqlite DB_PATH=diet.db uvicorn main:app
+
+Generation is streamed template by template and deterministic for a given
+--seed, so millions of rows load in bounded memory and benchmark datasets
+are reproducible.
+
+Usage:
+    python seed.py                                  # 49 foods, 3 templates x 7 days
+    python seed.py --scale large --reset            # ~1M meal items
+    python seed.py --foods 500 --templates 50       # custom sizes
+    python seed.py --scale xlarge --method load-data --progress 500   # MySQL
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from database import DB_CONFIG, backend
+from schema import create_schema
+
+# (name, icon, color, snack_suitable, [(food, kcal, protein, carbs, fat, fiber), ...])
+CATEGORIES = [
+    ("Proteins", "fa-drumstick-bite", "#E74C3C", False, [
+        ("Chicken breast", 165, 31.0, 0.0, 3.6, 0.0),
+        ("Turkey breast", 135, 30.0, 0.0, 1.0, 0.0),
+        ("Salmon fillet", 208, 20.0, 0.0, 13.0, 0.0),
+        ("Tuna", 132, 28.0, 0.0, 1.3, 0.0),
+        ("Lean beef", 187, 26.0, 0.0, 9.0, 0.0),
+        ("Eggs", 155, 13.0, 1.1, 11.0, 0.0),
+        ("Cod", 82, 18.0, 0.0, 0.7, 0.0),
+    ]),
+    ("Vegetables", "fa-carrot", "#27AE60", True, [
+        ("Broccoli", 34, 2.8, 7.0, 0.4, 2.6),
+        ("Spinach", 23, 2.9, 3.6, 0.4, 2.2),
+        ("Zucchini", 17, 1.2, 3.1, 0.3, 1.0),
+        ("Bell pepper", 31, 1.0, 6.0, 0.3, 2.1),
+        ("Cucumber", 15, 0.7, 3.6, 0.1, 0.5),
+        ("Carrot", 41, 0.9, 10.0, 0.2, 2.8),
+        ("Tomato", 18, 0.9, 3.9, 0.2, 1.2),
+    ]),
+    ("Fruits", "fa-apple-alt", "#F39C12", True, [
+        ("Apple", 52, 0.3, 14.0, 0.2, 2.4),
+        ("Banana", 89, 1.1, 23.0, 0.3, 2.6),
+        ("Blueberries", 57, 0.7, 14.0, 0.3, 2.4),
+        ("Orange", 47, 0.9, 12.0, 0.1, 2.4),
+        ("Strawberries", 32, 0.7, 7.7, 0.3, 2.0),
+        ("Kiwi", 61, 1.1, 15.0, 0.5, 3.0),
+    ]),
+    ("Grains", "fa-bread-slice", "#D35400", False, [
+        ("Oats", 389, 16.9, 66.0, 6.9, 10.6),
+        ("Brown rice", 111, 2.6, 23.0, 0.9, 1.8),
+        ("Quinoa", 120, 4.4, 21.0, 1.9, 2.8),
+        ("Whole wheat bread", 247, 13.0, 41.0, 3.4, 7.0),
+        ("Buckwheat", 92, 3.4, 20.0, 0.6, 2.7),
+        ("Whole wheat pasta", 124, 5.3, 27.0, 0.5, 4.5),
+    ]),
+    ("Dairy", "fa-cheese", "#3498DB", True, [
+        ("Greek yogurt", 59, 10.0, 3.6, 0.4, 0.0),
+        ("Cottage cheese", 98, 11.0, 3.4, 4.3, 0.0),
+        ("Skim milk", 34, 3.4, 5.0, 0.1, 0.0),
+        ("Mozzarella", 280, 28.0, 3.1, 17.0, 0.0),
+        ("Kefir", 41, 3.3, 4.5, 1.0, 0.0),
+    ]),
+    ("Legumes", "fa-seedling", "#8E44AD", False, [
+        ("Lentils", 116, 9.0, 20.0, 0.4, 7.9),
+        ("Chickpeas", 164, 8.9, 27.0, 2.6, 7.6),
+        ("Black beans", 132, 8.9, 24.0, 0.5, 8.7),
+        ("Green peas", 81, 5.4, 14.0, 0.4, 5.1),
+    ]),
+    ("Fats & Nuts", "fa-seedling", "#795548", True, [
+        ("Almonds", 579, 21.0, 22.0, 50.0, 12.5),
+        ("Walnuts", 654, 15.0, 14.0, 65.0, 6.7),
+        ("Avocado", 160, 2.0, 8.5, 14.7, 6.7),
+        ("Olive oil", 884, 0.0, 0.0, 100.0, 0.0),
+        ("Chia seeds", 486, 17.0, 42.0, 31.0, 34.4),
+    ]),
+    ("Beverages", "fa-mug-hot", "#16A085", True, [
+        ("Green tea", 1, 0.2, 0.0, 0.0, 0.0),
+        ("Black coffee", 2, 0.3, 0.0, 0.0, 0.0),
+        ("Vegetable juice", 19, 0.6, 4.0, 0.1, 0.4),
+    ]),
+]
+
+PREPARATIONS = ["grilled", "steamed", "baked", "raw", "organic", "roasted", "boiled", "fresh"]
+PORTIONS = {"Proteins": 150, "Vegetables": 200, "Fruits": 150, "Grains": 80,
+            "Dairy": 150, "Legumes": 120, "Fats & Nuts": 20, "Beverages": 250}
+
+SEGMENTS = {"A": 1200, "B": 1500, "C": 1800, "D": 2200}
+TYPES = {"SCR": "Calorie restriction", "LGI": "Low glycemic index", "KTP": "Ketogenic"}
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MEALS = [
+    ("breakfast", "08:00"),
+    ("morning_snack", "10:30"),
+    ("lunch", "13:00"),
+    ("afternoon_snack", "16:30"),
+    ("dinner", "19:30"),
+]
+
+# Children first, so --reset never violates a foreign key
+TABLE_ORDER = [
+    "diet_meal_items", "diet_meals", "diet_days", "diet_templates",
+    "food_items", "food_categories",
+]
+
+
+# =============================================================================
+# GENERATORS
+# =============================================================================
+
+def generate_categories(count: int) -> list[tuple]:
+    rows = []
+    for i in range(count):
+        name, icon, color, _, _ = CATEGORIES[i % len(CATEGORIES)]
+        if i >= len(CATEGORIES):
+            name = f"{name} {i // len(CATEGORIES) + 1}"
+        rows.append((i + 1, name, icon, color, i + 1))
+    return rows
+
+
+def generate_foods(rng: random.Random, count: int, categories: int) -> list[tuple]:
+    rows = []
+    for i in range(count):
+        category_id = i % categories + 1
+        category, _, _, snack, bases = CATEGORIES[(category_id - 1) % len(CATEGORIES)]
+        nth = i // categories
+        base, kcal, protein, carbs, fat, fiber = bases[nth % len(bases)]
+        round_ = nth // len(bases)
+        name = base if round_ == 0 else f"{base}, {PREPARATIONS[(round_ - 1) % len(PREPARATIONS)]}"
+        if round_ > len(PREPARATIONS):
+            name = f"{name} #{round_}"
+
+        def jitter(value):
+            return round(value * rng.uniform(0.9, 1.1), 2)
+
+        rows.append((
+            i + 1, category_id, name, f"{name} ({category.lower()})",
+            PORTIONS.get(category, 100),
+            jitter(kcal), jitter(protein), jitter(carbs), jitter(fat), jitter(fiber),
+            int(snack and rng.random() < 0.8), 1,
+        ))
+    return rows
+
+
+def generate_templates(count: int, days: int) -> list[tuple]:
+    rows = []
+    segments = list(SEGMENTS)
+    types = list(TYPES)
+    for i in range(count):
+        segment = segments[i % len(segments)]
+        type_ = types[(i // len(segments)) % len(types)]
+        rows.append((
+            i + 1, f"{segment}-{type_}-{i + 1:03d}",
+            f"{TYPES[type_]} plan {segment}{i + 1}",
+            f"{TYPES[type_]} diet for segment {segment}",
+            segment, type_, days, SEGMENTS[segment], None, 1,
+        ))
+    return rows
+
+
+def generate_plan(
+    seed: int,
+    templates: int,
+    days: int,
+    meals: int,
+    items: int,
+    foods: list[tuple],
+):
+    """Yield (days, meals, items) row lists, one template at a time.
+
+    Each template draws from its own RNG seeded by (seed, template_id), so a
+    given template's plan is identical across runs and batch sizes.
+    """
+    snack_foods = [f[0] for f in foods if f[10]] or [f[0] for f in foods]
+    all_foods = [f[0] for f in foods]
+    day_id = meal_id = item_id = 0
+
+    for template_id in range(1, templates + 1):
+        rng = random.Random(f"{seed}:{template_id}")
+        day_rows, meal_rows, item_rows = [], [], []
+        for day_number in range(1, days + 1):
+            day_id += 1
+            day_rows.append((day_id, template_id, day_number, DAY_NAMES[(day_number - 1) % 7], None))
+            for meal_order in range(1, meals + 1):
+                meal_id += 1
+                meal_type, time_suggestion = MEALS[(meal_order - 1) % len(MEALS)]
+                meal_rows.append((meal_id, day_id, meal_type, meal_order, time_suggestion, None))
+                pool = snack_foods if "snack" in meal_type else all_foods
+                for sort_order, food_id in enumerate(rng.sample(pool, min(items, len(pool)))):
+                    item_id += 1
+                    low = rng.randrange(50, 150, 10)
+                    item_rows.append((
+                        item_id, meal_id, food_id, low, low + rng.randrange(20, 100, 10),
+                        f"{rng.randint(1, 3)} serving(s)", None,
+                        int(rng.random() < 0.15), sort_order,
+                    ))
+        yield day_rows, meal_rows, item_rows
+
+
+# =============================================================================
+# LOADING
+# =============================================================================
+
+COLUMNS = {
+    "food_categories": ("id", "name", "icon", "color", "sort_order"),
+    "food_items": (
+        "id", "category_id", "name", "description", "default_portion_grams",
+        "calories_per_100g", "protein_per_100g", "carbs_per_100g",
+        "fat_per_100g", "fiber_per_100g", "is_snack_suitable", "status",
+    ),
+    "diet_templates": (
+        "id", "code", "name", "description", "segment", "type",
+        "duration_days", "calories_target", "notes", "status",
+    ),
+    "diet_days": ("id", "template_id", "day_number", "day_name", "notes"),
+    "diet_meals": ("id", "day_id", "meal_type", "meal_order", "time_suggestion", "notes"),
+    "diet_meal_items": (
+        "id", "meal_id", "food_item_id", "portion_grams_min", "portion_grams_max",
+        "portion_description", "preparation_notes", "is_optional", "sort_order",
+    ),
+}
+
+# Named scales; explicit --foods/--templates/... flags override them.
+# "small" matches what the k6 scripts assumed before they were parameterized.
+SCALES = {
+    "small": dict(categories=8, foods=49, templates=3, days=7, meals=5, items=4),
+    "medium": dict(categories=12, foods=1_000, templates=100, days=30, meals=5, items=5),
+    "large": dict(categories=20, foods=10_000, templates=1_000, days=30, meals=5, items=6),
+    "xlarge": dict(categories=40, foods=50_000, templates=5_000, days=30, meals=6, items=6),
+}
+
+# SQLite caps bound variables per statement (32766 since 3.32, 999 before)
+SQLITE_MAX_VARIABLES = 999
+
+
+class InsertLoader:
+    """Buffers rows per table and writes them as multi-row INSERT statements."""
+
+    def __init__(self, connection, batch_rows: int, commit_every: int, max_variables: int = None):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.batch_rows = batch_rows
+        self.commit_every = commit_every
+        self.max_variables = max_variables
+        self._buffers = {table: [] for table in COLUMNS}
+        self._statements: dict[tuple, str] = {}
+        self._uncommitted = 0
+
+    def _statement(self, table: str, rows: int) -> str:
+        key = (table, rows)
+        statement = self._statements.get(key)
+        if statement is None:
+            columns = COLUMNS[table]
+            values = "(" + ", ".join(["%s"] * len(columns)) + ")"
+            statement = self._statements[key] = (
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+                + ", ".join([values] * rows)
+            )
+        return statement
+
+    def add(self, table: str, rows: list[tuple]):
+        buffer = self._buffers[table]
+        buffer.extend(rows)
+        if len(buffer) >= self._batch_limit(table):
+            self._flush(table)
+
+    def _batch_limit(self, table: str) -> int:
+        if self.max_variables:
+            return max(1, min(self.batch_rows, self.max_variables // len(COLUMNS[table])))
+        return self.batch_rows
+
+    def _flush(self, table: str):
+        buffer = self._buffers[table]
+        limit = self._batch_limit(table)
+        while buffer:
+            batch, buffer[:limit] = buffer[:limit], []
+            self.cursor.execute(
+                self._statement(table, len(batch)),
+                [value for row in batch for value in row]
+            )
+            self._uncommitted += len(batch)
+        if self._uncommitted >= self.commit_every:
+            self.connection.commit()
+            self._uncommitted = 0
+
+    def finish(self):
+        # Parents before children so foreign keys resolve if checks are on
+        for table in reversed(TABLE_ORDER):
+            self._flush(table)
+        self.connection.commit()
+        self.cursor.close()
+
+
+class LoadDataLoader:
+    """Streams rows to per-table TSV files, then bulk-loads them with LOAD DATA LOCAL INFILE (MySQL)."""
+
+    def __init__(self, connection, directory: str):
+        self.connection = connection
+        self.directory = directory
+        self._files = {}
+        for table in COLUMNS:
+            path = os.path.join(directory, f"{table}.tsv")
+            self._files[table] = (path, open(path, "w", newline="", encoding="utf-8"))
+
+    @staticmethod
+    def _encode(value) -> str:
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+    def add(self, table: str, rows: list[tuple]):
+        handle = self._files[table][1]
+        handle.writelines("\t".join(map(self._encode, row)) + "\n" for row in rows)
+
+    def finish(self):
+        cursor = self.connection.cursor()
+        try:
+            for table in reversed(TABLE_ORDER):
+                path, handle = self._files[table]
+                handle.close()
+                cursor.execute(
+                    f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+                    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                    f"({', '.join(COLUMNS[table])})",
+                    (path,)
+                )
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+
+def _open_connection(method: str):
+    """Dedicated loader connection (bypasses the pool and per-statement tracing)."""
+    config = dict(DB_CONFIG)
+    if method == "load-data":
+        config["allow_local_infile"] = True
+    return backend.connect(config)
+
+
+def _tune_session(cursor, loading: bool):
+    """Skip per-row constraint checks while bulk loading generated, consistent data."""
+    if backend.name == "mysql":
+        flag = 0 if loading else 1
+        cursor.execute(f"SET foreign_key_checks = {flag}, unique_checks = {flag}")
+    else:
+        cursor.execute(f"PRAGMA foreign_keys = {'OFF' if loading else 'ON'}")
+        cursor.execute(f"PRAGMA synchronous = {'OFF' if loading else 'NORMAL'}")
+
+
+def seed(args) -> dict:
+    counts = dict.fromkeys(TABLE_ORDER, 0)
+    connection = _open_connection(args.method)
+    cursor = connection.cursor()
+    tmpdir = None
+
+    try:
+        if args.create_schema:
+            create_schema(connection, backend.name)
+        _tune_session(cursor, loading=True)
+        if args.reset:
+            for table in TABLE_ORDER:
+                cursor.execute(f"DELETE FROM {table}")
+            connection.commit()
+
+        if args.method == "load-data":
+            tmpdir = tempfile.mkdtemp(prefix="diet_seed_")
+            loader = LoadDataLoader(connection, tmpdir)
+        else:
+            loader = InsertLoader(
+                connection, args.batch_size, args.commit_every,
+                max_variables=SQLITE_MAX_VARIABLES if backend.name == "sqlite" else None
+            )
+
+        foods = generate_foods(random.Random(f"{args.seed}:foods"), args.foods, args.categories)
+        for table, rows in (
+            ("food_categories", generate_categories(args.categories)),
+            ("food_items", foods),
+            ("diet_templates", generate_templates(args.templates, args.days)),
+        ):
+            loader.add(table, rows)
+            counts[table] = len(rows)
+
+        started = time.perf_counter()
+        for template_id, (day_rows, meal_rows, item_rows) in enumerate(generate_plan(
+            args.seed, args.templates, args.days, args.meals, args.items, foods
+        ), start=1):
+            loader.add("diet_days", day_rows)
+            loader.add("diet_meals", meal_rows)
+            loader.add("diet_meal_items", item_rows)
+            counts["diet_days"] += len(day_rows)
+            counts["diet_meals"] += len(meal_rows)
+            counts["diet_meal_items"] += len(item_rows)
+            if args.progress and template_id % args.progress == 0:
+                rate = sum(counts.values()) / (time.perf_counter() - started)
+                print(f"  {template_id}/{args.templates} templates, {rate:,.0f} rows/s", flush=True)
+
+        loader.finish()
+        _tune_session(cursor, loading=False)
+        return counts
+
+    except Exception:
+        connection.rollback()
+        raise
+
+    finally:
+        cursor.close()
+        connection.close()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the diet database")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Preset sizes (default: small)")
+    parser.add_argument("--categories", type=int, help="Food categories")
+    parser.add_argument("--foods", type=int, help="Food items")
+    parser.add_argument("--templates", type=int, help="Diet templates")
+    parser.add_argument("--days", type=int, help="Days per template")
+    parser.add_argument("--meals", type=int, help="Meals per day")
+    parser.add_argument("--items", type=int, help="Items per meal")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument(
+        "--method", choices=["insert", "load-data"], default="insert",
+        help="insert: multi-row INSERT batches; load-data: MySQL LOAD DATA LOCAL INFILE"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per INSERT (default: 1000)")
+    parser.add_argument("--commit-every", type=int, default=50_000, help="Rows per transaction (default: 50000)")
+    parser.add_argument("--progress", type=int, default=0, help="Report every N templates")
+    parser.add_argument("--reset", action="store_true", help="Delete existing rows first")
+    parser.add_argument("--create-schema", action="store_true", help="Create missing tables first")
+    args = parser.parse_args()
+
+    for key, value in SCALES[args.scale].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    if args.method == "load-data" and backend.name != "mysql":
+        parser.error("--method load-data requires DB_BACKEND=mysql")
+
+    start = time.perf_counter()
+    counts = seed(args)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+
+    print(f"Seeded {backend.name} in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s, seed {args.seed})")
+    for table in reversed(TABLE_ORDER):
+        print(f"  {table}: {counts[table]:,} rows")
+    print("\nk6 sizing for this dataset:")
+    print(
+        f"  export CATEGORY_COUNT={args.categories} FOOD_COUNT={args.foods} "
+        f"TEMPLATE_COUNT={args.templates} MEAL_COUNT={counts['diet_meals']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Production server: gunicorn managing uvicorn worker processes.
+
+    python serve.py                    # one worker per usable CPU
+    SERVER_WORKERS=4 python serve.py
+    SERVER_PROFILE=gateway python serve.py
+
+`python main.py` stays the single-process dev server with --reload.
+
+Workers: SERVER_WORKERS, else the CPUs this process may use: the
+scheduler affinity mask, capped by the cgroup CPU quota inside containers.
+Each worker runs its own event loop, connection pools, catalog mapping and
+write-behind journal, so the database sees up to workers x DB_POOL_SIZE
+connections per pool; the total is logged at startup.
+
+Preload (SERVER_PRELOAD=1): the master imports main before forking, so an
+import error fails the deploy once instead of crash-looping every worker,
+and workers share the imported modules copy-on-write. Importing opens no
+connections and starts no threads; each worker's lifespan hook does that.
+gc.freeze() keeps the collector from touching, and so copying, those pages.
+
+Signals to the master:
+
+    TERM        stop accepting, finish in-flight requests within
+                SERVER_GRACEFUL_TIMEOUT, run each worker's lifespan shutdown
+    HUP         replace workers gracefully with re-read configuration; with
+                preload the code itself is not reloaded
+    USR2        start a new master on the current code (then WINCH and QUIT
+                the old one): zero-downtime deploy with preload
+    TTIN/TTOU   one worker more / fewer
+
+Profiles (SERVER_PROFILE) bundle the HTTP parser, idle keep-alive and
+accept backlog for a kind of client; SERVER_HTTP, SERVER_KEEPALIVE and
+SERVER_BACKLOG set explicitly override the profile. SERVER_HTTP=h2 runs
+hypercorn instead of gunicorn, since uvicorn speaks only HTTP/1.1. Its
+workers are spawned, not forked, so there is no preload; TERM and HUP
+still stop and reload them.
+"""
+
+import gc
+import logging
+import math
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger("diet_api.serve")
+
+SERVER_BIND = os.getenv("SERVER_BIND", "0.0.0.0:8000")
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+
+PROFILES = {
+    # uvicorn's pick of parser (httptools when installed), short idle timeout
+    "default": {"http": "auto", "keepalive": 5, "backlog": 2048},
+    # Behind a load balancer that pools connections: outlive its idle
+    # timeout (60 s on most), or the server closes a connection the balancer
+    # is about to reuse and the request fails with a 502
+    "gateway": {"http": "httptools", "keepalive": 75, "backlog": 2048},
+    # Many clients each opening a fresh connection: a deep accept queue for
+    # bursts of handshakes, idle sockets released quickly
+    "churn": {"http": "httptools", "keepalive": 2, "backlog": 8192},
+    # HTTP/2 through hypercorn: concurrent requests share one connection
+    "h2": {"http": "h2", "keepalive": 75, "backlog": 2048},
+}
+HTTP_IMPLEMENTATIONS = ("auto", "h11", "httptools", "h2")
+
+SERVER_PROFILE = os.getenv("SERVER_PROFILE", "default")
+_profile = PROFILES.get(SERVER_PROFILE, PROFILES["default"])
+SERVER_HTTP = os.getenv("SERVER_HTTP", _profile["http"])
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", str(_profile["backlog"])))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", str(_profile["keepalive"])))
+SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "60"))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "1") == "1"
+# TLS; browsers and k6 negotiate HTTP/2 only over TLS
+SERVER_CERTFILE = os.getenv("SERVER_CERTFILE")
+SERVER_KEYFILE = os.getenv("SERVER_KEYFILE")
+
+
+def _cgroup_cpu_quota() -> float | None:
+    """CPUs allowed by the cgroup CPU quota, or None when unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:  # cgroup v2
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:  # cgroup v1
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def usable_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        # A fractional quota still gets a worker for its remainder
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+def _worker_class(http: str):
+    try:
+        from uvicorn_worker import UvicornWorker  # uvicorn >= 0.30 moved the worker here
+    except ImportError:
+        from uvicorn.workers import UvicornWorker
+    if http == "auto":
+        return UvicornWorker
+    # The worker reads its uvicorn settings from this class attribute
+    return type(f"UvicornWorker_{http}", (UvicornWorker,), {
+        "CONFIG_KWARGS": {**UvicornWorker.CONFIG_KWARGS, "http": http},
+    })
+
+
+def when_ready(server):
+    """Master hook, after preload and before the first fork."""
+    gc.freeze()
+    import database
+    logger.info(
+        "serving on %s with %d workers: up to %d connections to the primary and to each of %d replicas",
+        SERVER_BIND, server.num_workers, server.num_workers * database.DB_POOL_SIZE,
+        len(database.replicas.pools),
+    )
+
+
+class Server(BaseApplication):
+    """gunicorn configured from SERVER_* variables instead of a config file."""
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import main
+        return main.app
+
+
+def options(workers: int) -> dict:
+    return {
+        "bind": SERVER_BIND,
+        "workers": workers,
+        "worker_class": _worker_class(SERVER_HTTP),
+        "backlog": SERVER_BACKLOG,
+        "keepalive": SERVER_KEEPALIVE,
+        "timeout": SERVER_TIMEOUT,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "preload_app": SERVER_PRELOAD,
+        "when_ready": when_ready,
+        "proc_name": "diet-api",
+        "certfile": SERVER_CERTFILE,
+        "keyfile": SERVER_KEYFILE,
+    }
+
+
+def run_hypercorn(workers: int):
+    """HTTP/2 (and HTTP/1.1) through hypercorn; each worker imports main itself."""
+    try:
+        from hypercorn.config import Config
+        from hypercorn.run import run as hypercorn_run
+    except ImportError:
+        sys.exit("SERVER_HTTP=h2 needs hypercorn: pip install hypercorn")
+    config = Config()
+    config.application_path = "main:app"
+    config.bind = [SERVER_BIND]
+    config.workers = workers
+    config.backlog = SERVER_BACKLOG
+    config.keep_alive_timeout = SERVER_KEEPALIVE
+    config.graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+    config.certfile = SERVER_CERTFILE
+    config.keyfile = SERVER_KEYFILE
+    try:
+        import uvloop  # noqa: F401
+        config.worker_class = "uvloop"
+    except ImportError:
+        config.worker_class = "asyncio"
+    logger.info(
+        "serving HTTP/2 on %s with %d hypercorn workers (%s)",
+        SERVER_BIND, workers, "TLS" if SERVER_CERTFILE else "cleartext h2c",
+    )
+    sys.exit(hypercorn_run(config))
+
+
+def run():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    workers = SERVER_WORKERS or usable_cpus()
+    if workers > 1 and os.getenv("DB_BACKEND") == "sqlite" and os.getenv("DB_PATH", ":memory:") == ":memory:":
+        sys.exit("DB_PATH=:memory: would give every worker its own empty database; use a file")
+    if SERVER_PROFILE not in PROFILES:
+        sys.exit(f"SERVER_PROFILE must be one of: {', '.join(PROFILES)}")
+    if SERVER_HTTP not in HTTP_IMPLEMENTATIONS:
+        sys.exit(f"SERVER_HTTP must be one of: {', '.join(HTTP_IMPLEMENTATIONS)}")
+    logger.info(
+        "profile %s: http=%s keepalive=%ds backlog=%d",
+        SERVER_PROFILE, SERVER_HTTP, SERVER_KEEPALIVE, SERVER_BACKLOG,
+    )
+    if SERVER_HTTP == "h2":
+        run_hypercorn(workers)
+    Server(options(workers)).run()
+
+
+if __name__ == "__main__":
+    run()
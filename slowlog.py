@@ -0,0 +1,93 @@
+"""
+Slow-request log with EXPLAIN plans.
+
+tracing.TracingMiddleware hands sampled slow requests (SLOW_REQUEST_MS) to
+submit(), which queues them for a background thread; the thread runs EXPLAIN
+(EXPLAIN QUERY PLAN on SQLite) once per distinct SELECT and logs the entry as
+JSON on "diet_api.slow". The module is imported on the first slow request, so
+a worker that never sees one never loads it.
+"""
+
+import json
+import logging
+import queue
+import threading
+from typing import Optional
+
+from tracing import RequestContext, StatementRecord
+
+logger = logging.getLogger("diet_api.slow")
+
+_slow_queue: queue.Queue = queue.Queue(maxsize=100)
+_slow_worker: Optional[threading.Thread] = None
+_slow_worker_lock = threading.Lock()
+
+
+def _explain(statements: list[StatementRecord]) -> list[dict]:
+    """Run EXPLAIN once per distinct SELECT statement."""
+    from database import backend, get_db_connection
+
+    # Plain EXPLAIN on SQLite lists VDBE bytecode, not the plan
+    explain = "EXPLAIN " if backend.name == "mysql" else "EXPLAIN QUERY PLAN "
+    plans = []
+    seen = set()
+    connection = get_db_connection(read_only=True)
+    cursor = connection.cursor(dictionary=True)
+
+    try:
+        for record in statements:
+            sql = " ".join(record.sql.split())
+            if sql in seen or not sql.upper().startswith("SELECT"):
+                continue
+            seen.add(sql)
+            cursor.execute(explain + record.sql, record.params)
+            plans.append({"sql": sql, "plan": cursor.fetchall()})
+        return plans
+
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def _slow_log_worker():
+    while True:
+        entry, statements = _slow_queue.get()
+        if statements:
+            try:
+                entry["plans"] = _explain(statements)
+            except Exception as e:
+                entry["plans_error"] = str(e)
+        logger.warning("slow request %s", json.dumps(entry, default=str))
+
+
+def submit(ctx: RequestContext, status: int, total: float):
+    global _slow_worker
+
+    if _slow_worker is None:
+        with _slow_worker_lock:
+            if _slow_worker is None:
+                _slow_worker = threading.Thread(
+                    target=_slow_log_worker, name="slow-request-log", daemon=True
+                )
+                _slow_worker.start()
+
+    entry = {
+        "method": ctx.method,
+        "path": ctx.path,
+        "status": status,
+        "total_ms": round(total * 1000, 2),
+        "connect_ms": round(ctx.connect * 1000, 2),
+        "sql_ms": round(ctx.sql * 1000, 2),
+        "assembly_ms": round(ctx.assembly * 1000, 2),
+        "query_count": ctx.query_count,
+        "statements": [
+            {"sql": " ".join(r.sql.split()), "ms": round(r.seconds * 1000, 2), "rows": r.rows}
+            for r in ctx.statements
+        ],
+        "repeated": ctx.repeated_statements(),
+    }
+    try:
+        _slow_queue.put_nowait((entry, list(ctx.statements)))
+    except queue.Full:
+        # Never let the log back-pressure requests
+        pass
@@ -0,0 +1,338 @@
+"""
+Per-request tracing: SQL statement log, Server-Timing breakdown, N+1 detection
+and the slow-request log.
+
+Each HTTP request gets a RequestContext stored in a ContextVar. The data layer
+(database.TimedCursor, ConnectionPool, instrument_query) reports every
+statement, its duration and row count here; the middleware turns the totals
+into a `Server-Timing` header, flags repeated statements, and hands sampled
+slow requests to slowlog.py, which logs them with their EXPLAIN plans.
+"""
+
+import logging
+import os
+import random
+import re
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+import metrics
+
+query_logger = logging.getLogger("diet_api.queries")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv("SLOW_REQUEST_SAMPLE_RATE", "1.0"))
+MAX_RECORDED_STATEMENTS = int(os.getenv("SLOW_LOG_MAX_STATEMENTS", "50"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+
+
+# =============================================================================
+# STATEMENT FINGERPRINTS
+# =============================================================================
+
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b|%s|\?")
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+`?(\w+)", re.IGNORECASE)
+_fingerprints: dict[str, tuple[str, str]] = {}
+
+
+def fingerprint(operation: str) -> tuple[str, str]:
+    """Return (normalized SQL, short label) for a statement.
+
+    Statements differing only in literals or bound parameters share a
+    fingerprint. The label ("SELECT diet_meals") is used for metrics so
+    cardinality stays bounded by the number of tables.
+    """
+    cached = _fingerprints.get(operation)
+    if cached is not None:
+        return cached
+
+    normalized = _LITERAL_RE.sub("?", " ".join(operation.split()))
+    verb = normalized.split(" ", 1)[0].upper()
+    table = _TABLE_RE.search(normalized)
+    label = f"{verb} {table.group(1)}" if table else verb
+
+    # queries.py uses a fixed set of statement strings; the cap only guards
+    # against ad-hoc SQL growing the cache forever.
+    if len(_fingerprints) < 1024:
+        _fingerprints[operation] = (normalized, label)
+    return normalized, label
+
+
+class StatementRecord:
+    """One executed statement: execute plus fetch time and row count."""
+
+    __slots__ = ("sql", "params", "label", "seconds", "rows")
+
+    def __init__(self, sql: str, params, label: str, seconds: float, rows: int):
+        self.sql = sql
+        self.params = params
+        self.label = label
+        self.seconds = seconds
+        self.rows = rows
+
+
+# =============================================================================
+# REQUEST CONTEXT
+# =============================================================================
+
+class RequestContext:
+    """Timings and statements accumulated while serving a single request."""
+
+    __slots__ = (
+        "method", "path", "started", "connect", "sql", "query_count",
+        "assembly", "statements", "fingerprints", "max_statements", "deadline",
+        "primary_until", "bulk", "idle",
+    )
+
+    def __init__(self, method: str, path: str, max_statements: Optional[int] = MAX_RECORDED_STATEMENTS):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.connect = 0.0
+        self.sql = 0.0
+        self.query_count = 0
+        self.assembly = 0.0
+        self.statements: list[StatementRecord] = []
+        self.fingerprints: dict[str, int] = {}
+        self.max_statements = max_statements
+        # perf_counter() value after which results are useless (see deadlines.py)
+        self.deadline: Optional[float] = None
+        # Epoch seconds until which reads must go to the primary (read-your-writes)
+        self.primary_until = 0.0
+        # Set by expect_repeated_statements(): chunked bulk work, not N+1
+        self.bulk = False
+        # Set by record_idle(): seconds spent waiting on purpose (long-poll)
+        self.idle = 0.0
+
+    def add_statement(self, record: StatementRecord, normalized: str):
+        self.sql += record.seconds
+        self.query_count += 1
+        self.fingerprints[normalized] = self.fingerprints.get(normalized, 0) + 1
+        if self.max_statements is None or len(self.statements) < self.max_statements:
+            self.statements.append(record)
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        """Statements issued more than `threshold` times, most frequent first."""
+        repeated = [(sql, n) for sql, n in self.fingerprints.items() if n > threshold]
+        return sorted(repeated, key=lambda item: item[1], reverse=True)
+
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.started
+        # Whatever is not connect/SQL/row assembly is model validation,
+        # JSON serialization and framework overhead.
+        serialize = max(total - self.connect - self.sql - self.assembly, 0.0)
+        return ", ".join((
+            f"connect;dur={self.connect * 1000:.2f}",
+            f'sql;dur={self.sql * 1000:.2f};desc="{self.query_count} queries"',
+            f"assembly;dur={self.assembly * 1000:.2f}",
+            f"serialize;dur={serialize * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ))
+
+
+_current: ContextVar = ContextVar("request_context", default=None)
+
+
+def current() -> Optional[RequestContext]:
+    """Return the context of the request being served, if any."""
+    return _current.get()
+
+
+@contextmanager
+def capture_queries():
+    """Record every statement issued inside the block.
+
+        with tracing.capture_queries() as ctx:
+            queries.get_template_full(1)
+        assert not ctx.repeated_statements()
+    """
+    ctx = RequestContext("CAPTURE", "", max_statements=None)
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
+
+
+# =============================================================================
+# DATA LAYER HOOKS
+# =============================================================================
+
+class _QueryTimer:
+    __slots__ = ("db", "connect")
+
+    def __init__(self):
+        self.db = 0.0
+        self.connect = 0.0
+
+
+_query_timer: ContextVar = ContextVar("query_timer", default=None)
+
+
+def record_statement(operation: str, params, seconds: float, rows: int) -> StatementRecord:
+    """Called by the cursor wrapper after each execute()."""
+    timer = _query_timer.get()
+    if timer is not None:
+        timer.db += seconds
+
+    normalized, label = fingerprint(operation)
+    record = StatementRecord(operation, params, label, seconds, rows)
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.add_statement(record, normalized)
+    return record
+
+
+def record_sql_time(seconds: float):
+    """Attribute driver time that is not a statement (commit, rollback)."""
+    timer = _query_timer.get()
+    if timer is not None:
+        timer.db += seconds
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.sql += seconds
+
+
+def record_fetch(record: Optional[StatementRecord], seconds: float, rows: int):
+    """Attribute fetch time and rows to the statement that produced them."""
+    record_sql_time(seconds)
+    if record is not None:
+        record.seconds += seconds
+        record.rows += rows
+
+
+def finish_statement(record: StatementRecord):
+    """Publish a completed statement to the metrics registry."""
+    metrics.STATEMENT_DURATION.observe(record.seconds, record.label)
+    if record.rows:
+        metrics.STATEMENT_ROWS.inc(record.label, amount=record.rows)
+
+
+def record_connect(seconds: float):
+    """Called by the pool after each checkout."""
+    timer = _query_timer.get()
+    if timer is not None:
+        timer.connect += seconds
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.connect += seconds
+
+
+def instrument_query(func):
+    """Record connect, DB and Python assembly time for a queries.py function."""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        timer = _QueryTimer()
+        token = _query_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            metrics.QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            total = time.perf_counter() - start
+            _query_timer.reset(token)
+            python = max(total - timer.db - timer.connect, 0.0)
+            metrics.QUERY_DURATION.observe(timer.connect, name, "connect")
+            metrics.QUERY_DURATION.observe(timer.db, name, "db")
+            metrics.QUERY_DURATION.observe(python, name, "python")
+            ctx = _current.get()
+            if ctx is not None:
+                ctx.assembly += python
+
+    return wrapper
+
+
+# =============================================================================
+# REQUEST HINTS
+# =============================================================================
+
+def expect_repeated_statements():
+    """Mark the current request as chunked bulk work so its repeats are not reported as N+1."""
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.bulk = True
+
+
+def record_idle(seconds: float):
+    """Time the current request waited on purpose; it does not make the request slow."""
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.idle += seconds
+
+
+def _check_n_plus_one(ctx: RequestContext, route: str):
+    if ctx.bulk:
+        return
+    for sql, count in ctx.repeated_statements():
+        metrics.N_PLUS_ONE.inc(route, fingerprint(sql)[1])
+        query_logger.warning(
+            "possible N+1: %s %s issued %d times: %s", ctx.method, route, count, sql
+        )
+
+
+# =============================================================================
+# ASGI MIDDLEWARE
+# =============================================================================
+
+class TracingMiddleware:
+    """Attach a RequestContext, emit Server-Timing, and sample slow requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        ctx = RequestContext(scope["method"], scope["path"])
+        for name, value in scope["headers"]:
+            if name == TIMEOUT_HEADER:
+                try:
+                    ctx.deadline = ctx.started + max(int(value), 0) / 1000
+                except ValueError:
+                    pass
+                break
+        token = _current.set(ctx)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ctx.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            total = time.perf_counter() - ctx.started
+            # No session can be running before /admin/profile imports profiler
+            profiler = sys.modules.get("profiler")
+            session = profiler.active if profiler is not None else None
+            if session is not None:
+                session.request_done()
+
+            if ctx.query_count:
+                route = metrics.route_label(scope)
+                metrics.QUERIES_PER_REQUEST.observe(ctx.query_count, route)
+                if ctx.query_count > N_PLUS_ONE_THRESHOLD:
+                    _check_n_plus_one(ctx, route)
+
+            if (
+                (total - ctx.idle) * 1000 >= SLOW_REQUEST_MS
+                and random.random() < SLOW_REQUEST_SAMPLE_RATE
+            ):
+                import slowlog
+                slowlog.submit(ctx, status[0], total)
@@ -0,0 +1,142 @@
+"""
+Startup warm-up.
+
+Right after a deploy every cache is cold: the pool has no connections, the
+catalog snapshot is unbuilt and MySQL's buffer pool has not seen the hot
+pages. main.py's lifespan hook starts a WarmUp in a background thread, and
+/health answers 503 "warming" until it finishes, so load balancers and
+run-benchmark.sh wait instead of sending the first requests into the spike.
+
+Steps run in order within WARMUP_BUDGET seconds (0 skips warm-up). The
+budget is a request-style deadline, so a step that overruns stops at its
+next query; the worker then reports ready anyway rather than never joining.
+
+    connections  open WARMUP_CONNECTIONS pooled connections (default: pool size)
+    catalog      map or build the catalog snapshot (catalog.py)
+    templates    read WARMUP_TEMPLATE_IDS, when the snapshot does not
+                 already hold the templates
+    nutrition    run the category aggregate behind /api/benchmark/complex-query
+
+Only the connection and catalog steps fill caches the routes read. The
+templates and nutrition steps discard their results: they warm the database
+side (buffer pool pages, prepared statements on a pooled connection). A
+fresh worker has no request history to rank templates by, so which ones to
+read is left to WARMUP_TEMPLATE_IDS; without it the step is skipped.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import catalog
+import database
+import deadlines
+import metrics
+import queries
+import tracing
+
+logger = logging.getLogger("diet_api.warmup")
+
+WARMUP_BUDGET = float(os.getenv("WARMUP_BUDGET", "30"))
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(database.DB_POOL_SIZE)))
+WARMUP_TEMPLATE_IDS = [int(t) for t in os.getenv("WARMUP_TEMPLATE_IDS", "").split(",") if t.strip()]
+
+WARMUP_READY = metrics.registry.register(metrics.Gauge(
+    "warmup_ready", "1 once startup warm-up has finished or used its budget",
+))
+WARMUP_STEP_SECONDS = metrics.registry.register(metrics.Gauge(
+    "warmup_step_seconds", "Time spent in each warm-up step", ("step", "result"),
+))
+
+
+def _connections() -> str:
+    pools = [database.pool, *database.replicas.pools]
+    opened = sum(p.prewarm(WARMUP_CONNECTIONS) for p in pools)
+    return f"{opened} connections"
+
+
+def _catalog() -> str:
+    if not catalog.catalog.enabled:
+        return "disabled"
+    catalog.catalog.warm()
+    snapshot = catalog.catalog.snapshot()
+    return f"{snapshot.size} foods, {snapshot.templates} templates"
+
+
+def _templates() -> str:
+    snapshot = catalog.catalog.snapshot() if catalog.catalog.enabled else None
+    if snapshot is not None and snapshot.templates:
+        return "served from catalog snapshot"
+    if not WARMUP_TEMPLATE_IDS:
+        return "skipped: WARMUP_TEMPLATE_IDS not set"
+    for template_id in WARMUP_TEMPLATE_IDS:
+        queries.get_template_full(template_id)
+    return f"{len(WARMUP_TEMPLATE_IDS)} templates read"
+
+
+def _nutrition() -> str:
+    return f"{len(queries.get_nutritional_stats_by_category())} categories"
+
+
+STEPS = [
+    ("connections", _connections),
+    ("catalog", _catalog),
+    ("templates", _templates),
+    ("nutrition", _nutrition),
+]
+
+
+class WarmUp:
+    """Runs STEPS once and tracks readiness for /health."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.state = "pending"
+        self.steps: dict[str, dict] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self):
+        if self.budget <= 0:
+            self._finish()
+            return
+        self.state = "warming"
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        started = time.perf_counter()
+        with tracing.capture_queries() as ctx:
+            ctx.max_statements = 0
+            ctx.deadline = started + self.budget
+            for name, step in STEPS:
+                step_started = time.perf_counter()
+                try:
+                    detail, result = step(), "ok"
+                except deadlines.DeadlineExceeded:
+                    detail, result = "budget exhausted", "timeout"
+                except Exception as e:
+                    logger.exception("warm-up step %s failed", name)
+                    detail, result = str(e), "error"
+                seconds = time.perf_counter() - step_started
+                WARMUP_STEP_SECONDS.set(seconds, name, result)
+                self.steps[name] = {"result": result, "detail": detail, "seconds": round(seconds, 3)}
+                if result == "timeout":
+                    break
+        logger.info("warm-up finished in %.2fs: %s", time.perf_counter() - started, self.steps)
+        self._finish()
+
+    def _finish(self):
+        self.state = "ready"
+        WARMUP_READY.set(1)
+
+    def status(self) -> dict:
+        return {"state": self.state, "steps": self.steps}
+
+
+warmup = WarmUp(WARMUP_BUDGET)
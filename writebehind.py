@@ -0,0 +1,448 @@
+"""
+Write-behind queue for the POST routes.
+
+With WRITE_BEHIND=1, create_food, create_category, create_template and the
+bulk meal-item insert no longer commit per request. A validated write is
+appended to this worker's journal, fsync'd, and answered with 202 and a
+ticket; a background thread applies queued writes in batches of up to
+WRITE_BEHIND_BATCH per transaction (queries.apply_writes) and records each
+outcome in write_behind_results. Clients poll GET /api/writes/{ticket}.
+
+Durability: the journal is a JSON-lines file per worker in WRITE_BEHIND_DIR,
+held under an exclusive flock while the worker lives. Concurrent requests
+share fsyncs (group commit). On startup each worker replays journals whose
+owner died; tickets that already reached the ledger are skipped, so a write
+is applied once even if the crash came between commit and compaction. Once
+JOURNAL_COMPACT_BYTES at the front of a journal are applied, they are cut
+off by rewriting the unapplied tail to a new file and renaming it over the
+journal.
+
+Trade-offs: an accepted write can still fail when applied (unknown category,
+duplicate template code); the failure shows in its ticket status. A batch
+that keeps raising something other than a database error (a bug or a
+malformed record, not an outage) is retried WRITE_BEHIND_MAX_ATTEMPTS times,
+then its writes are tried one by one and those that still raise are marked
+failed. Reads see the write only once its batch commits, and only the ledger
+knows the new id.
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Optional
+
+from fastapi import HTTPException
+
+import catalog
+import metrics
+import queries
+from database import Error
+
+logger = logging.getLogger("diet_api.writebehind")
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", "write_behind")
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_LINGER = float(os.getenv("WRITE_BEHIND_LINGER", "0.005"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_RETENTION = float(os.getenv("WRITE_BEHIND_RETENTION", "86400"))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "10"))
+
+# Compact a journal once this many bytes at its front are applied
+JOURNAL_COMPACT_BYTES = 1 << 20
+# Completed tickets answered from memory before asking the ledger
+RECENT_TICKETS = 10000
+
+WRITES = metrics.registry.register(metrics.Counter(
+    "write_behind_writes_total", "Write-behind writes applied, by operation and result",
+    ("operation", "result"),
+))
+PENDING = metrics.registry.register(metrics.Gauge(
+    "write_behind_pending", "Write-behind writes accepted but not yet committed",
+))
+BATCH_SIZE = metrics.registry.register(metrics.Histogram(
+    "write_behind_batch_size", "Writes per write-behind transaction",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+))
+FLUSH_ERRORS = metrics.registry.register(metrics.Counter(
+    "write_behind_flush_errors_total", "Write-behind batches that failed and were retried",
+))
+COMPACTIONS = metrics.registry.register(metrics.Counter(
+    "write_behind_compactions_total", "Journal compactions, by whether unapplied records were copied",
+    ("kind",),
+))
+
+
+# =============================================================================
+# JOURNAL
+# =============================================================================
+
+class Journal:
+    """Append-only JSON-lines file; concurrent appends share one fsync.
+
+    Each record is identified by its logical offset, which never changes:
+    compaction only moves `_base`, the logical offset of the file's first
+    byte. Records stay live until release(); compact() drops everything in
+    front of the oldest live one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "ab")
+        # Held for the worker's lifetime; a lockable journal is an orphan
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+        self._base = 0
+        self._end = 0
+        # Offsets of unapplied records; appended in order, so the first is the oldest
+        self._live: dict[int, None] = {}
+
+    def append(self, record: dict) -> int:
+        """Write one record, return once it is on disk; returns its offset."""
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        with self._lock:
+            offset = self._end
+            self._file.write(line)
+            self._end += len(line)
+            self._live[offset] = None
+            self._written += 1
+            seq = self._written
+        try:
+            with self._sync_lock:
+                # A flush that started after our write already covered it
+                if self._synced >= seq:
+                    return offset
+                with self._lock:
+                    self._file.flush()
+                    covered = self._written
+                os.fsync(self._file.fileno())
+                self._synced = covered
+        except BaseException:
+            # Never acknowledged, so it need not survive compaction
+            self.release(offset)
+            raise
+        return offset
+
+    def release(self, offset: int):
+        """The record at `offset` is committed (or failed); compaction may drop it."""
+        with self._lock:
+            self._live.pop(offset, None)
+
+    def compact(self, min_bytes: int) -> bool:
+        """Drop the applied records in front of the oldest live one, if they take min_bytes."""
+        with self._sync_lock, self._lock:
+            upto = next(iter(self._live), self._end)
+            if upto == self._base or upto - self._base < min_bytes:
+                return False
+            self._file.flush()
+            if upto == self._end:
+                # Everything applied: empty the file in place
+                self._file.truncate(0)
+                os.fsync(self._file.fileno())
+                COMPACTIONS.inc("truncate")
+            else:
+                self._rewrite(upto - self._base)
+                COMPACTIONS.inc("rewrite")
+            self._base = upto
+            return True
+
+    def _rewrite(self, start: int):
+        """Replace the file with its bytes from `start` on, atomically."""
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            tail = f.read()
+        tmp = self.path + ".compact"
+        # Append mode, like the original: writes always land at the end
+        new = open(tmp, "ab")
+        try:
+            # Locked before it gets the journal's name, so no one replays it
+            fcntl.flock(new, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            new.write(tail)
+            new.flush()
+            os.fsync(new.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            new.close()
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        directory = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        old, self._file = self._file, new
+        old.close()
+
+
+def _read_journal(path: str) -> list[dict]:
+    records = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Torn last line from a crash mid-append; it was never acknowledged
+                break
+    return records
+
+
+# =============================================================================
+# QUEUE
+# =============================================================================
+
+class WriteBehindQueue:
+    """Journaled queue of writes flushed to the database in grouped transactions."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.journal: Optional[Journal] = None
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        # Tickets journaled but not yet queued, and the batch being applied
+        self._appending = 0
+        self._flushing: list = []
+        # Journal offset of every queued or flushing ticket
+        self._offsets: dict[str, int] = {}
+        self._recent: OrderedDict[str, dict] = OrderedDict()
+        self._purged_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Unique per start: a reused pid must not adopt a dead worker's journal
+        name = f"journal-{os.getpid()}-{uuid.uuid4().hex[:8]}.log"
+        self.journal = Journal(os.path.join(self.directory, name))
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def drain(self, timeout: float) -> bool:
+        """Wait for queued writes to commit (graceful shutdown)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._flushing or self._appending:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(min(left, 0.05))
+        return True
+
+    # -------------------------------------------------------------------------
+    # Request side
+
+    def submit(self, operation: str, kwargs: dict) -> str:
+        """Journal a write and queue it; returns its ticket."""
+        with self._cond:
+            if len(self._queue) + len(self._flushing) + self._appending >= WRITE_BEHIND_MAX_PENDING:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Write-behind queue full",
+                    headers={"Retry-After": "1"},
+                )
+            self._appending += 1
+
+        ticket = uuid.uuid4().hex
+        offset = None
+        try:
+            offset = self.journal.append({"ticket": ticket, "operation": operation, "kwargs": kwargs})
+        finally:
+            with self._cond:
+                self._appending -= 1
+                if offset is not None:
+                    self._queue.append((ticket, operation, kwargs))
+                    self._offsets[ticket] = offset
+                self._cond.notify_all()
+        PENDING.inc()
+        return ticket
+
+    def status(self, ticket: str) -> dict:
+        """queued, done or failed; pending when this worker does not know the ticket."""
+        with self._cond:
+            recent = self._recent.get(ticket)
+            if recent is not None:
+                return recent
+            if any(t == ticket for t, _, _ in self._queue) or any(t == ticket for t, _, _ in self._flushing):
+                return {"ticket": ticket, "status": "queued"}
+        row = queries.get_write_result(ticket)
+        if row is None:
+            # Possibly queued on another worker
+            return {"ticket": ticket, "status": "pending"}
+        return self._describe(row)
+
+    @staticmethod
+    def _describe(row: dict) -> dict:
+        return {
+            "ticket": row["ticket"],
+            "status": "failed" if row["error"] else "done",
+            "operation": row["operation"],
+            "result": row["result"],
+            "error": row["error"],
+            "completed_at": row["completed_at"],
+        }
+
+    # -------------------------------------------------------------------------
+    # Flusher
+
+    def _run(self):
+        self._replay_orphans()
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                if len(self._queue) < WRITE_BEHIND_BATCH and WRITE_BEHIND_LINGER > 0:
+                    # Let concurrent requests join this transaction
+                    self._cond.wait(WRITE_BEHIND_LINGER)
+                count = min(len(self._queue), WRITE_BEHIND_BATCH)
+                self._flushing = [self._queue.popleft() for _ in range(count)]
+            self._apply(self._flushing)
+            with self._cond:
+                done = len(self._flushing)
+                for ticket, _, _ in self._flushing:
+                    self.journal.release(self._offsets.pop(ticket))
+                self._flushing = []
+                self._cond.notify_all()
+            PENDING.dec(amount=done)
+            try:
+                self.journal.compact(JOURNAL_COMPACT_BYTES)
+            except OSError:
+                logger.exception("compacting the write-behind journal failed")
+            self._purge()
+
+    def _apply(self, batch: list, attempts: Optional[int] = None):
+        """Commit a batch and record every ticket's outcome.
+
+        A batch that still raises after `attempts` is split: each write is
+        tried once on its own, and only those that raise again are marked
+        failed.
+        """
+        try:
+            results = self._commit(batch, attempts or WRITE_BEHIND_MAX_ATTEMPTS)
+        except Exception as e:
+            if len(batch) > 1:
+                for write in batch:
+                    self._apply([write], attempts=1)
+                return
+            results = self._fail(batch, e)
+        BATCH_SIZE.observe(len(batch))
+
+        with self._cond:
+            for ticket, operation, _ in batch:
+                status = self._describe(results[ticket])
+                WRITES.inc(operation, status["status"])
+                self._recent[ticket] = status
+            while len(self._recent) > RECENT_TICKETS:
+                self._recent.popitem(last=False)
+        self._notify_catalog(batch, results)
+
+    @staticmethod
+    def _commit(batch: list, attempts: int) -> dict:
+        """queries.apply_writes with backoff.
+
+        Database errors (a lost connection, a deadlock) are retried until the
+        database takes the batch; anything else is raised after `attempts`.
+        """
+        delay = 0.1
+        failures = 0
+        while True:
+            try:
+                return queries.apply_writes(batch)
+            except Exception as e:
+                FLUSH_ERRORS.inc()
+                outage = isinstance(e, (Error, HTTPException))
+                if not outage:
+                    failures += 1
+                    if failures >= attempts:
+                        raise
+                logger.exception("write-behind batch of %d failed; retrying in %.1fs", len(batch), delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    @staticmethod
+    def _fail(batch: list, error: Exception) -> dict:
+        """Mark a write that cannot be applied as failed, in the ledger if possible."""
+        message = f"Write could not be applied: {type(error).__name__}: {error}"
+        logger.error("giving up on write-behind ticket %s: %s", batch[0][0], message)
+        completed_at = time.time()
+        results = {
+            ticket: {"ticket": ticket, "operation": operation, "result": None,
+                     "error": message, "completed_at": completed_at}
+            for ticket, operation, _ in batch
+        }
+        try:
+            queries.record_write_failures(list(results.values()))
+        except Exception:
+            # Still answered from memory (_recent) until this worker restarts
+            logger.exception("recording failed write-behind tickets failed")
+        return results
+
+    @staticmethod
+    def _notify_catalog(batch: list, results: dict):
+        if not catalog.catalog.enabled:
+            return
+        templates, meals, foods = set(), set(), False
+        for ticket, operation, kwargs in batch:
+            result = results[ticket]
+            if result["error"]:
+                continue
+            if operation in ("create_food", "create_category"):
+                foods = True
+            elif operation == "create_template":
+                templates.add(result["result"]["id"])
+            elif result["result"]["inserted_count"]:
+                meals.add(kwargs["meal_id"])
+        if foods:
+            catalog.catalog.invalidate()
+        templates.update(queries.get_meal_template_id(meal_id) for meal_id in meals)
+        if templates:
+            catalog.catalog.templates_changed(templates)
+
+    def _replay_orphans(self):
+        """Apply journals left behind by workers that died, then delete them."""
+        for path in glob.glob(os.path.join(self.directory, "journal-*.log")):
+            if path == self.journal.path:
+                continue
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owner is alive
+                try:
+                    if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                        continue  # compacted under us: the live owner renamed a new file over it
+                except FileNotFoundError:
+                    continue
+                records = _read_journal(path)
+                for start in range(0, len(records), WRITE_BEHIND_BATCH):
+                    chunk = records[start:start + WRITE_BEHIND_BATCH]
+                    self._apply([(r["ticket"], r["operation"], r["kwargs"]) for r in chunk])
+                logger.info("replayed %d write-behind records from %s", len(records), path)
+                os.unlink(path)
+
+    def _purge(self):
+        if time.monotonic() - self._purged_at < 60:
+            return
+        self._purged_at = time.monotonic()
+        try:
+            queries.purge_write_results(time.time() - WRITE_BEHIND_RETENTION)
+        except Exception:
+            logger.exception("purging write-behind results failed")
+
+
+queue = WriteBehindQueue(WRITE_BEHIND_DIR)